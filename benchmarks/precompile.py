@@ -0,0 +1,151 @@
+"""Benchmark the import time of a python lambda with and without
+``precompile: true``.
+
+It creates a synthetic lambda with many modules (or uses the code directory
+you pass with ``--code``), builds it twice using gordon, extracts both .zip
+files the same way AWS Lambda does (preserving the timestamps of the zip file
+entries in a read-only location) and measures how long the gordon python
+loader (``_gloader.py``) takes to import and invoke the handler.
+
+Usage:
+
+    python benchmarks/precompile.py --python python2.7 --runs 20
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import calendar
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gordon.resources.lambdas import PythonLambda  # noqa
+
+GORDON_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gordon')
+
+
+class BenchmarkProject(object):
+    """Bare minimum of a gordon project required to build one lambda."""
+
+    debug = False
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self._gordon_root = GORDON_ROOT
+
+    def register_resource_reference(self, *args):
+        pass
+
+    def create_workspace(self):
+        pass
+
+    def get_workspace(self):
+        return self.path
+
+    def puts(self, message):
+        print(message)
+
+
+def create_code(path, modules, functions):
+    os.makedirs(os.path.join(path, 'package'))
+    with open(os.path.join(path, 'package', '__init__.py'), 'w') as f:
+        f.write('')
+    for i in range(modules):
+        with open(os.path.join(path, 'package', 'module{}.py'.format(i)), 'w') as f:
+            for j in range(functions):
+                f.write('def function{}(event, values=({})):\n'.format(j, ', '.join([str(k) for k in range(10)])))
+                f.write('    """Function {} of module {}."""\n'.format(j, i))
+                f.write('    return [v * {} for v in values if v % 2] + [event.get("key{}")]\n\n'.format(j, j))
+    with open(os.path.join(path, 'code.py'), 'w') as f:
+        for i in range(modules):
+            f.write('import package.module{}\n'.format(i))
+        f.write('\n\ndef handler(event, context):\n    return "hello"\n')
+
+
+def extract(filename, destination):
+    """Extract ``filename`` preserving the timestamps of the entries."""
+    with zipfile.ZipFile(filename) as zfile:
+        for info in zfile.infolist():
+            zfile.extract(info, destination)
+            mtime = calendar.timegm(info.date_time + (0, 0, -1))
+            os.utime(os.path.join(destination, info.filename), (mtime, mtime))
+    shutil.copyfile(
+        os.path.join(GORDON_ROOT, 'loaders', 'python.py'),
+        os.path.join(destination, '_gloader.py')
+    )
+
+
+def measure(path, python, runs):
+    """Returns the time each one of ``runs`` invocations of the loader took.
+    Bytecode is never written, the same way /var/task is read-only."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        process = subprocess.Popen(
+            [python, '_gloader.py', 'code.handler', 'benchmark', '128', '3'],
+            cwd=path,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        out, _ = process.communicate(json.dumps({'key': 'value'}).encode('utf-8'))
+        timings.append(time.time() - start)
+        assert b'output: hello' in out, out
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--python', default='python2.7', help='Interpreter of the runtime.')
+    parser.add_argument('--runtime', default='python2.7', help='Runtime of the lambda.')
+    parser.add_argument('--code', help='Code directory of the lambda to benchmark.')
+    parser.add_argument('--modules', type=int, default=200, help='Modules of the synthetic lambda.')
+    parser.add_argument('--functions', type=int, default=50, help='Functions per module of the synthetic lambda.')
+    parser.add_argument('--runs', type=int, default=10)
+    options = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        code = options.code
+        if not code:
+            code = os.path.join(path, 'code')
+            create_code(code, options.modules, options.functions)
+
+        results = {}
+        for precompile in (False, True):
+            project = BenchmarkProject(path, {})
+            lambda_ = PythonLambda(
+                'benchmark',
+                {
+                    'code': os.path.abspath(code),
+                    'runtime': options.runtime,
+                    'precompile': precompile,
+                    'precompile-python': options.python
+                },
+                project=project
+            )
+            filename = os.path.join(path, 'precompile-{}.zip'.format(precompile))
+            lambda_.write_zip_file(filename)
+            destination = os.path.join(path, 'precompile-{}'.format(precompile))
+            extract(filename, destination)
+            results[precompile] = (os.path.getsize(filename), measure(destination, options.python, options.runs))
+    finally:
+        shutil.rmtree(path)
+
+    print("{:<12} {:>12} {:>12} {:>12}".format('precompile', 'zip size', 'median', 'min'))
+    for precompile in (False, True):
+        size, timings = results[precompile]
+        print("{:<12} {:>12} {:>11.1f}ms {:>11.1f}ms".format(
+            str(precompile), size, timings[len(timings) // 2] * 1000, timings[0] * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark the time-to-first-invocation of ``gordon run``.
+
+It creates a synthetic project with many applications, each one of them
+with several lambdas and streams, and measures:
+
+ - How long it takes to load the project the way ``gordon run`` does
+   (``ProjectRun``), compared with loading the whole project the way
+   ``gordon build`` does (``ProjectBuild``).
+ - How long ``gordon run app.lambda`` takes from the moment the process
+   starts until the handler has returned.
+
+Usage:
+
+    python benchmarks/run.py --apps 50 --lambdas 20 --runs 10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gordon.core import ProjectBuild, ProjectRun  # noqa
+from gordon.utils import cd  # noqa
+
+GORDON_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def create_project(path, apps, lambdas, streams):
+    """Create a project with ``apps`` applications, each one of them with
+    ``lambdas`` python lambdas and ``streams`` dynamodb streams."""
+    app_names = ['app{}'.format(i) for i in range(apps)]
+    with open(os.path.join(path, 'settings.yml'), 'w') as f:
+        f.write('---\nproject: benchmark\ndefault-region: us-east-1\ncode-bucket: benchmark\napps:\n')
+        for name in app_names:
+            f.write('  - {}\n'.format(name))
+
+    for name in app_names:
+        os.makedirs(os.path.join(path, name, 'code'))
+        with open(os.path.join(path, name, 'code', 'code.py'), 'w') as f:
+            f.write('def handler(event, context):\n    return event["key"]\n')
+        with open(os.path.join(path, name, 'settings.yml'), 'w') as f:
+            f.write('lambdas:\n')
+            for i in range(lambdas):
+                f.write((
+                    '  {}_lambda{}:\n'
+                    '    code: code\n'
+                    '    handler: code.handler\n'
+                    '    runtime: python2.7\n'
+                ).format(name, i))
+            f.write('dynamodb:\n')
+            for i in range(streams):
+                f.write((
+                    '  stream{i}:\n'
+                    '    lambda: {app}.{app}_lambda{i}\n'
+                    '    stream: arn:aws:dynamodb:us-east-1:123456789012:'
+                    'table/{app}{i}/stream/2016-01-01T00:00:00.000\n'
+                    '    starting_position: LATEST\n'
+                ).format(app=name, i=i % lambdas))
+    return '{0}.{0}_lambda0'.format(app_names[-1])
+
+
+def measure_load(cls, path, runs, **kwargs):
+    cls = type(cls.__name__, (cls,), {'quiet': True})
+    timings = []
+    with cd(path):
+        for _ in range(runs):
+            start = time.time()
+            cls(path=path, stdin=None, **kwargs)
+            timings.append(time.time() - start)
+    return sorted(timings)
+
+
+def measure_run(path, lambda_name, runs):
+    env = dict(os.environ, PYTHONPATH=GORDON_ROOT)
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; from gordon.bin import main; sys.exit(main())', 'run', lambda_name],
+            cwd=path,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        out, _ = process.communicate(json.dumps({'key': 'hello'}).encode('utf-8'))
+        timings.append(time.time() - start)
+        assert b'output: hello' in out, out
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apps', type=int, default=50, help='Applications of the synthetic project.')
+    parser.add_argument('--lambdas', type=int, default=20, help='Lambdas per application.')
+    parser.add_argument('--streams', type=int, default=5, help='Dynamodb streams per application.')
+    parser.add_argument('--runs', type=int, default=5)
+    options = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        lambda_name = create_project(path, options.apps, options.lambdas, options.streams)
+        results = [
+            ('load (build)', measure_load(ProjectBuild, path, options.runs)),
+            ('load (run)', measure_load(ProjectRun, path, options.runs, lambda_name=lambda_name)),
+            ('gordon run', measure_run(path, lambda_name, options.runs)),
+        ]
+    finally:
+        shutil.rmtree(path)
+
+    print("{} apps, {} lambdas, {} streams".format(
+        options.apps, options.apps * options.lambdas, options.apps * options.streams
+    ))
+    print("{:<16} {:>12} {:>12}".format('', 'median', 'min'))
+    for name, timings in results:
+        print("{:<16} {:>11.1f}ms {:>11.1f}ms".format(name, timings[len(timings) // 2] * 1000, timings[0] * 1000))
+
+
+if __name__ == '__main__':
+    main()
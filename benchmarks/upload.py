@@ -0,0 +1,178 @@
+"""Benchmark the throughput of uploading lambda artifacts into S3 with
+different transfer settings (``s3-transfer`` in the settings of a project,
+or the ``--multipart-*``, ``--max-concurrency`` and ``--max-bandwidth``
+options of ``gordon apply``).
+
+It starts a minimal S3 stand-in on localhost, which supports plain and
+multipart uploads and limits the bandwidth of each connection the same way
+the bandwidth of each connection to S3 is limited, and uploads files of
+several sizes the same way ``UploadToS3`` does, using each one of the
+transfer settings.
+
+Usage:
+
+    python benchmarks/upload.py --sizes 10M,50M,100M,250M --connection-bandwidth 32M
+"""
+import os
+import sys
+import time
+import uuid
+import shutil
+import tempfile
+import argparse
+import threading
+
+import boto3
+from botocore.client import Config
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gordon import utils  # noqa
+
+# Name of each transfer setting, and its ``s3-transfer`` settings.
+TRANSFER_SETTINGS = (
+    ('single-put', {'multipart-threshold': '5G'}),
+    ('default', {}),
+    ('64M-chunks', {'multipart-threshold': '64M', 'multipart-chunksize': '64M'}),
+    ('16M-chunks-x16', {'multipart-threshold': '16M', 'multipart-chunksize': '16M', 'max-concurrency': 16}),
+)
+
+
+class S3RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles the requests boto3 needs to upload objects: ``PutObject``,
+    ``CreateMultipartUpload``, ``UploadPart``, ``CompleteMultipartUpload``
+    and ``AbortMultipartUpload``. Objects are read and discarded."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status=200, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """Read the body of the request, at most at ``bandwidth`` bytes per
+        second."""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        bandwidth = self.server.bandwidth
+        start = time.time()
+        received = 0
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 256 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            received += len(chunk)
+            if bandwidth:
+                delay = start + received / float(bandwidth) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def do_HEAD(self):
+        self.respond(404)
+
+    def do_PUT(self):
+        self.read_body()
+        self.respond(headers={'ETag': '"{}"'.format(uuid.uuid4().hex)})
+
+    def do_POST(self):
+        self.read_body()
+        query = parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+        if 'uploads' in query:
+            body = (
+                '<InitiateMultipartUploadResult><Bucket>benchmark</Bucket><Key>artifact.zip</Key>'
+                '<UploadId>{}</UploadId></InitiateMultipartUploadResult>'
+            ).format(uuid.uuid4().hex)
+        else:
+            body = (
+                '<CompleteMultipartUploadResult><Bucket>benchmark</Bucket><Key>artifact.zip</Key>'
+                '<ETag>"{}"</ETag></CompleteMultipartUploadResult>'
+            ).format(uuid.uuid4().hex)
+        self.respond(body=body.encode('utf-8'), headers={'Content-Type': 'application/xml'})
+
+    def do_DELETE(self):
+        self.read_body()
+        self.respond(204)
+
+
+class S3Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, bandwidth):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), S3RequestHandler)
+        self.bandwidth = bandwidth
+
+
+def create_file(path, size):
+    with open(path, 'wb') as f:
+        chunk = os.urandom(1024 * 1024)
+        for _ in range(size // len(chunk)):
+            f.write(chunk)
+        f.write(chunk[:size % len(chunk)])
+
+
+def measure(s3, filename, settings, runs):
+    """Returns the best time of ``runs`` uploads of ``filename``."""
+    config = utils.get_transfer_config(settings)
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        s3.Object('benchmark', 'artifact.zip').upload_file(
+            filename,
+            ExtraArgs={'Metadata': {'sha1': 'benchmark'}},
+            Config=config
+        )
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10M,50M,100M,250M', help='Sizes of the artifacts to upload.')
+    parser.add_argument('--connection-bandwidth', default='32M',
+                        help='Bytes per second each connection to the stand-in can upload. 0 means unlimited.')
+    parser.add_argument('--runs', type=int, default=1)
+    options = parser.parse_args()
+
+    server = S3Server(utils.parse_size(options.connection_bandwidth))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    s3 = boto3.session.Session(
+        aws_access_key_id='benchmark',
+        aws_secret_access_key='benchmark',
+        region_name='us-east-1'
+    ).resource(
+        's3',
+        endpoint_url='http://127.0.0.1:{}'.format(server.server_address[1]),
+        config=Config(s3={'addressing_style': 'path'})
+    )
+
+    path = tempfile.mkdtemp()
+    print("{:<10} {:<16} {:>10} {:>12}".format('size', 'settings', 'time', 'throughput'))
+    try:
+        for size in options.sizes.split(','):
+            filename = os.path.join(path, 'artifact.zip')
+            create_file(filename, utils.parse_size(size))
+            for name, settings in TRANSFER_SETTINGS:
+                duration = measure(s3, filename, settings, options.runs)
+                print("{:<10} {:<16} {:>9.2f}s {:>8.1f}MB/s".format(
+                    size, name, duration, os.path.getsize(filename) / duration / 1024 / 1024
+                ))
+    finally:
+        shutil.rmtree(path)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
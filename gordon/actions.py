@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import json
+import hashlib
 import tempfile
 import zipfile
 import shutil
+import threading
 from collections import Iterable
+from multiprocessing.pool import ThreadPool
 
 import six
 import boto3
 import troposphere
-from clint.textui import colored, puts
+from clint.textui import colored
 
 from gordon import utils, exceptions
 
+# Creating boto3 clients and resources from the default session is not
+# thread safe. Once created, clients can be shared between threads.
+_boto3_lock = threading.Lock()
+
 
 class Serializable(object):
     """Base Serializable abstractions we'll use to serialize actions and
@@ -125,10 +133,18 @@ class ActionsTemplate(Serializable):
     def add_output(self, output):
         self.outputs[output.name] = output
 
-    def apply(self, context, project):
-        action_outputs = {}
-        for action in self.actions:
-            action_outputs[action.name] = action.apply(context, project)
+    def apply(self, context, project, jobs=1):
+        """Apply the actions of this template with ``context`` and return its
+        outputs. If the template is ``parallelizable``, up to ``jobs`` actions
+        are applied concurrently."""
+        jobs = min(jobs if self.parallelizable else 1, len(self.actions))
+        if jobs > 1:
+            action_outputs = self._apply_concurrently(context, project, jobs)
+        else:
+            action_outputs = {}
+            for action in self.actions:
+                action_outputs[action.name] = action.apply(context, project)
+
         outputs = {}
         for name, output in six.iteritems(self.outputs):
             if isinstance(output.value, GetAttr):
@@ -138,6 +154,43 @@ class ActionsTemplate(Serializable):
             outputs[name] = value
         return outputs
 
+    def _apply_concurrently(self, context, project, jobs):
+        """Apply the actions of this template using ``jobs`` threads. The
+        output of each action is buffered and printed once it finishes, in
+        the same order a serial apply would. Once one action fails, the ones
+        which haven't started yet are skipped, and the errors of all the
+        actions which failed are raised together."""
+        failed = threading.Event()
+
+        def _apply(action):
+            buffered = BufferedProject(project)
+            if failed.is_set():
+                return buffered, None, None
+            try:
+                return buffered, action.apply(context, buffered), None
+            except Exception:
+                failed.set()
+                return buffered, None, sys.exc_info()
+
+        action_outputs, errors = {}, []
+        pool = ThreadPool(jobs)
+        try:
+            for action, (buffered, output, error) in zip(self.actions, pool.imap(_apply, self.actions)):
+                for args, kwargs in buffered.output:
+                    project.puts(*args, **kwargs)
+                if error:
+                    errors.append((action.name, error))
+                action_outputs[action.name] = output
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if len(errors) == 1:
+            six.reraise(*errors[0][1])
+        elif errors:
+            raise exceptions.ActionsFailedError([(name, error[1]) for name, error in errors])
+        return action_outputs
+
     def __bool__(self):
         return bool(self.actions)
 
@@ -145,6 +198,21 @@ class ActionsTemplate(Serializable):
         return bool(self.actions)
 
 
+class BufferedProject(object):
+    """Proxy of ``project`` which buffers what actions print, so it can be
+    printed later on."""
+
+    def __init__(self, project):
+        self._project = project
+        self.output = []
+
+    def __getattr__(self, name):
+        return getattr(self._project, name)
+
+    def puts(self, *args, **kwargs):
+        self.output.append((args, kwargs))
+
+
 class BaseAction(Serializable):
 
     def apply(self):
@@ -170,11 +238,12 @@ class UploadToS3(BaseAction):
     def apply(self, context, project):
         """
         Check if this file needs to get uploaded or not. In order to do so,
-        we could rely on ETAG for normal files, but one of the mainline
-        cases of gordon is to upload .zip files, and identical source folders
-        don't have consistent hashes when you zip them, so we need to
-        workaround this by generating our own hash by reading the zip content
-        in a particular order."""
+        we store the sha1 of the file as metadata of the object and compare
+        it with the hash of the local file. Gordon writes deterministic .zip
+        files, so identical source folders produce identical hashes.
+
+        The file is only prepared (see ``prepare_file``) if it needs to get
+        uploaded, and the prepared copy is removed afterwards."""
 
         self.project = project
         self.context = context
@@ -186,16 +255,15 @@ class UploadToS3(BaseAction):
             self._get('filename', context)
         )
 
-        self.filename = self.prepare_file(self.filename)
-
-        s3client = boto3.client('s3')
+        with _boto3_lock:
+            s3client = boto3.client('s3')
         try:
             obj = s3client.head_object(Bucket=self.bucket, Key=self.key)
         except Exception:
             obj = None
 
         # Calculate the hash of this file
-        file_hash = utils.get_file_hash(self.filename)
+        file_hash = self.get_file_hash(self.filename)
 
         # If the object is present, and the hash in the metadata is the same
         # we don't need to upload it.
@@ -213,8 +281,18 @@ class UploadToS3(BaseAction):
                 file_hash[:8], self.bucket, self.key))
             )
 
-        obj = boto3.resource('s3').Object(self.bucket, self.key)
-        obj.upload_file(self.filename, ExtraArgs={'Metadata': {'sha1': file_hash}})
+        filename = self.prepare_file(self.filename)
+        try:
+            with _boto3_lock:
+                obj = boto3.resource('s3').Object(self.bucket, self.key)
+            obj.upload_file(
+                filename,
+                ExtraArgs={'Metadata': {'sha1': file_hash}},
+                Config=getattr(project, 'transfer_config', None)
+            )
+        finally:
+            if filename != self.filename:
+                os.remove(filename)
         self._success(file_hash, project.puts)
         return self.output(obj.version_id)
 
@@ -229,8 +307,17 @@ class UploadToS3(BaseAction):
         }
 
     def prepare_file(self, filename):
+        """Returns the file to upload in place of ``filename``. Actions
+        which modify the file return a temporary copy of it."""
         return filename
 
+    def get_file_hash(self, filename):
+        """Returns the hash of ``filename``, taken from the manifest of the
+        build if the file hasn't changed since it was built."""
+        return utils.get_artifact_hash(
+            filename, getattr(self.project, 'manifest', None) or {}, self.project.build_path
+        )
+
     def _success(self, metadata, puts_function):
         puts_function(
             colored.green(
@@ -258,15 +345,34 @@ class InjectContextAndUploadToS3(UploadToS3):
         ('context_destinaton', None, False),
     )
 
-    def prepare_file(self, filename):
+    def _get_context(self):
+        """Returns where the context is injected and its content."""
         context_to_inject = enrich_references(self.context_to_inject or {}, self.context)
-        context_destinaton = self.context_destinaton or '.context'
-        _, tmpfile = tempfile.mkstemp(suffix='.{}'.format(self.filename.rsplit('.', 1)[1]))
-        shutil.copyfile(self.filename, tmpfile)
-        zfile = zipfile.ZipFile(tmpfile, 'a')
-
-        context_info = zipfile.ZipInfo(context_destinaton)
-        context_info.external_attr = 0o444 << 16
-        zfile.writestr(context_info, json.dumps(context_to_inject))
-        zfile.close()
+        return self.context_destinaton or '.context', json.dumps(context_to_inject, sort_keys=True)
+
+    def get_file_hash(self, filename):
+        """The hash of the file with the context injected is derived from
+        the hash of ``filename`` and the context, so it can be calculated
+        without writing it."""
+        file_hash = super(InjectContextAndUploadToS3, self).get_file_hash(filename)
+        digest = hashlib.sha1()
+        for value in (file_hash,) + self._get_context():
+            digest.update(six.text_type(value).encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def prepare_file(self, filename):
+        context_destinaton, context = self._get_context()
+        fd, tmpfile = tempfile.mkstemp(suffix='.{}'.format(filename.rsplit('.', 1)[1]))
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmpfile)
+            zfile = zipfile.ZipFile(tmpfile, 'a')
+            context_info = zipfile.ZipInfo(context_destinaton)
+            context_info.external_attr = 0o444 << 16
+            zfile.writestr(context_info, context)
+            zfile.close()
+        except Exception:
+            os.remove(tmpfile)
+            raise
         return tmpfile
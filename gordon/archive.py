@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import os
+import zlib
+import struct
+import hashlib
+import tempfile
+import collections
+from multiprocessing.pool import ThreadPool
+
+import six
+
+# Every entry is stored as if it was created on 1980-01-01 00:00:00, which
+# is the oldest date the zip format can represent.
+DOS_DATE = (0 << 9) | (1 << 5) | 1
+DOS_TIME = 0
+
+COMPRESSION_LEVEL = 6
+
+# Members with these extensions are already compressed, so they are stored
+# as they are if they are bigger than the given number of bytes.
+STORED_EXTENSIONS = {
+    '.jar': 0,
+    '.zip': 0,
+    '.whl': 0,
+    '.egg': 0,
+    '.gz': 0,
+    '.tgz': 0,
+    '.bz2': 0,
+    '.xz': 0,
+    '.png': 0,
+    '.jpg': 0,
+    '.jpeg': 0,
+    '.gif': 0,
+    '.webp': 0,
+    '.so': 1024 * 1024,
+}
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_DIRECTORY_HEADER = struct.Struct('<4s6H3L5H2L')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+
+FLAG_UTF8 = 0x800
+VERSION = 20
+UNIX = 3
+STORED = 0
+DEFLATED = 8
+MAX_SIZE = 0xFFFFFFFF
+CHUNK_SIZE = 64 * 1024
+# Members are compressed before their entry is written, and kept in memory
+# up to this size, and in a temporary file beyond it.
+SPOOL_SIZE = 4 * 1024 * 1024
+
+
+def get_mode(filename):
+    """Returns the normalized permissions of ``filename``. Only the
+    executable bit is preserved."""
+    if os.stat(filename).st_mode & 0o111:
+        return 0o755
+    return 0o644
+
+
+class DeterministicZipFile(object):
+    """Forward-only zip writer which creates byte-identical archives for
+    identical content.
+
+    All entries have the same timestamp, normalized permissions and are
+    compressed using the same parameters. Each member is compressed into a
+    temporary file first, so its size and checksum are written in its local
+    header without data descriptors, which streaming readers (like java's
+    ``ZipInputStream``) don't support for stored entries. The output never
+    needs to be seeked. The sha1 of the archive is calculated while it is being written and is
+    available in ``hexdigest``.
+
+    Members with extensions in ``stored_extensions`` are stored without
+    compression, as are all members if ``compresslevel`` is ``0``.
+
+    Entries are written in the same order they are added, so callers need
+    to add them in a stable order (see ``write_tree``)."""
+
+    def __init__(self, filename, compresslevel=COMPRESSION_LEVEL, stored_extensions=None):
+        self.compresslevel = compresslevel
+        self.stored_extensions = STORED_EXTENSIONS if stored_extensions is None else stored_extensions
+        self._fileobj = open(filename, 'wb')
+        self._offset = 0
+        self._entries = []
+        self._digest = hashlib.sha1()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fileobj.close()
+
+    def _write(self, data):
+        self._fileobj.write(data)
+        self._digest.update(data)
+        self._offset += len(data)
+
+    def _encode_name(self, arcname):
+        if isinstance(arcname, six.binary_type):
+            arcname = arcname.decode('utf-8')
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        while arcname.startswith('./'):
+            arcname = arcname[2:]
+        try:
+            return arcname.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return arcname.encode('utf-8'), FLAG_UTF8
+
+    def get_compress_type(self, arcname, size):
+        """Returns if the member ``arcname`` of ``size`` bytes should be
+        ``STORED`` or ``DEFLATED``."""
+        if self.compresslevel == 0:
+            return STORED
+        threshold = self.stored_extensions.get(os.path.splitext(arcname)[1].lower())
+        if threshold is not None and size >= threshold:
+            return STORED
+        return DEFLATED
+
+    def _compress(self, stream, compress_type, write):
+        """Read ``stream`` one chunk at a time, compress it and pass it to
+        ``write``. Returns the crc, size and compressed size of the data.
+        zlib releases the GIL, so several streams can be compressed
+        concurrently in different threads."""
+        crc, size, compressed_size = 0, 0, 0
+        compressor = None
+        if compress_type == DEFLATED:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            compressed_size += len(chunk)
+            write(chunk)
+        if compressor:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            write(chunk)
+        return crc & 0xFFFFFFFF, size, compressed_size
+
+    def _write_entry(self, arcname, mode, compress_type, output, result):
+        """Write one entry into the archive with the compressed data in the
+        file-like object ``output``, and the crc, size and compressed size
+        in ``result``. ``output`` is closed afterwards."""
+        with output:
+            crc, size, compressed_size = result
+            name, flags = self._encode_name(arcname)
+            offset = self._offset
+            if max(size, offset + LOCAL_HEADER.size + len(name) + compressed_size) > MAX_SIZE:
+                raise ValueError("{} is too big for a zip file without ZIP64 extensions.".format(arcname))
+
+            self._write(LOCAL_HEADER.pack(
+                b'PK\x03\x04', VERSION, flags, compress_type, DOS_TIME, DOS_DATE,
+                crc, compressed_size, size, len(name), 0
+            ))
+            self._write(name)
+            for chunk in iter(lambda: output.read(CHUNK_SIZE), b''):
+                self._write(chunk)
+            self._entries.append((name, flags, compress_type, crc, compressed_size, size, mode, offset))
+
+    def write(self, filename, arcname, mode=None):
+        """Compress the content of ``filename`` into the archive as
+        ``arcname``."""
+        compress_type = self.get_compress_type(arcname, os.path.getsize(filename))
+        with open(filename, 'rb') as f:
+            self.write_stream(f, arcname, mode or get_mode(filename), compress_type)
+
+    def writestr(self, arcname, data, mode=0o644):
+        """Store ``data`` in the archive as ``arcname``."""
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        self.write_stream(six.BytesIO(data), arcname, mode, self.get_compress_type(arcname, len(data)))
+
+    def write_stream(self, stream, arcname, mode=0o644, compress_type=DEFLATED):
+        """Compress the content of the file-like object ``stream`` into
+        the archive as ``arcname``."""
+        if self.compresslevel == 0:
+            compress_type = STORED
+        self._write_entry(arcname, mode, compress_type, *self._compress_stream(stream, compress_type))
+
+    def _compress_stream(self, stream, compress_type):
+        """Compress ``stream`` into a temporary file, so its crc and sizes
+        are known before its entry is written. Returns the temporary file
+        and the crc, size and compressed size of the data."""
+        output = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        try:
+            result = self._compress(stream, compress_type, output.write)
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        return output, result
+
+    def _compress_file(self, filename, compress_type):
+        """Compress ``filename`` into a temporary file. Used to compress
+        several files concurrently."""
+        with open(filename, 'rb') as f:
+            return self._compress_stream(f, compress_type)
+
+    def _write_compressed(self, arcname, mode, compress_type, compressed):
+        self._write_entry(arcname, mode, compress_type, *compressed.get())
+
+    def write_tree(self, path, files=None, jobs=1):
+        """Add all files within ``path`` to the archive sorted by name.
+        If ``files`` is provided, only those paths (relative to ``path``)
+        are added. Returns the number of written entries.
+
+        If ``jobs`` is bigger than one, files are compressed concurrently
+        using that many threads, and written in the same order. The archive
+        is identical regardless of the number of jobs."""
+        if files is None:
+            files = []
+            for basedir, dirs, filenames in os.walk(path):
+                relative = os.path.relpath(basedir, path)
+                files.extend([os.path.normpath(os.path.join(relative, f)) for f in filenames])
+        files = sorted(files, key=lambda f: f.replace(os.sep, '/'))
+
+        if jobs <= 1 or len(files) <= 1:
+            for filename in files:
+                self.write(os.path.join(path, filename), filename)
+            return len(files)
+
+        # Only a few files are compressed ahead of the one being written,
+        # so memory usage is bounded by SPOOL_SIZE * jobs * 2.
+        pool = ThreadPool(jobs)
+        pending = collections.deque()
+        try:
+            for filename in files:
+                source = os.path.join(path, filename)
+                compress_type = self.get_compress_type(filename, os.path.getsize(source))
+                if self.compresslevel == 0:
+                    compress_type = STORED
+                pending.append((
+                    filename,
+                    get_mode(source),
+                    compress_type,
+                    pool.apply_async(self._compress_file, (source, compress_type))
+                ))
+                if len(pending) >= jobs * 2:
+                    self._write_compressed(*pending.popleft())
+            while pending:
+                self._write_compressed(*pending.popleft())
+        finally:
+            for _, _, _, compressed in pending:
+                try:
+                    compressed.get()[0].close()
+                except Exception:
+                    pass
+            pool.terminate()
+            pool.join()
+        return len(files)
+
+    def close(self):
+        """Write the central directory and close the archive."""
+        if len(self._entries) > 0xFFFF:
+            raise ValueError("Too many files for a zip file without ZIP64 extensions.")
+        start = self._offset
+        for name, flags, compress_type, crc, compressed_size, size, mode, offset in self._entries:
+            self._write(CENTRAL_DIRECTORY_HEADER.pack(
+                b'PK\x01\x02', (UNIX << 8) | VERSION, VERSION, flags, compress_type,
+                DOS_TIME, DOS_DATE, crc, compressed_size, size, len(name),
+                0, 0, 0, 0, ((0o100000 | mode) << 16), offset
+            ))
+            self._write(name)
+        self._write(END_OF_CENTRAL_DIRECTORY.pack(
+            b'PK\x05\x06', 0, 0, len(self._entries), len(self._entries),
+            self._offset - start, start, 0
+        ))
+        self._fileobj.close()
+
+    def hexdigest(self):
+        """Returns the sha1 of the bytes written so far."""
+        return self._digest.hexdigest()
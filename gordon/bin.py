@@ -5,8 +5,12 @@ import argparse
 
 from clint.textui import colored, puts
 
-from .core import Bootstrap, ProjectBuild, ProjectApply, ProjectDelete, ProjectRun
+from .core import (
+    Bootstrap, ProjectBuild, ProjectApply, ProjectDelete, ProjectRun, ProjectBench, ProjectReplay, ProjectServe,
+    ProjectServeApi, Cache
+)
 from .exceptions import BaseGordonException
+from . import utils
 
 
 def stage_validator(s):
@@ -17,6 +21,26 @@ def stage_validator(s):
         raise argparse.ArgumentTypeError("Stage names can only contain alphanumeric characters")
 
 
+def positive_integer_validator(s):
+    """Value must be a positive integer."""
+    try:
+        value = int(s)
+    except ValueError:
+        value = 0
+    if value > 0:
+        return value
+    raise argparse.ArgumentTypeError("{} is not a positive integer".format(s))
+
+
+def size_validator(s):
+    """Sizes are a number of bytes, optionally followed by K, M or G."""
+    try:
+        return utils.parse_size(s)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError("Invalid size {}. Use for example 500M or 2G".format(s))
+
+
 def main(argv=None, stdin=None):
     stdin = stdin or sys.stdin
     argv = (argv or sys.argv)[1:]
@@ -37,6 +61,13 @@ def main(argv=None, stdin=None):
                        action="store_true",
                        help="Verbose output for debugging purpouses.")
 
+    def add_enforce_memory_argument(p):
+        p.add_argument("--enforce-memory",
+                       dest="enforce_memory",
+                       action="store_true",
+                       help=("Limit the lambda to its configured memory, and report an out of memory error "
+                             "if it needs more. Python (Linux only) and Node lambdas."))
+
     startproject_parser = subparsers.add_parser('startproject', description='Start a new project')
     add_default_arguments(startproject_parser)
     startproject_parser.set_defaults(cls=Bootstrap)
@@ -63,6 +94,21 @@ def main(argv=None, stdin=None):
     add_default_arguments(build_parser)
     build_parser.set_defaults(cls=ProjectBuild)
     build_parser.set_defaults(func="build")
+    build_parser.add_argument("-j", "--jobs",
+                              dest="jobs",
+                              type=positive_integer_validator,
+                              default=None,
+                              help="Number of lambdas to build concurrently. Default: number of CPUs")
+    build_parser.add_argument("--no-cache",
+                              dest="build_cache",
+                              action="store_false",
+                              help="Build the project without reusing cached lambdas or templates.")
+    build_parser.add_argument("--profile",
+                              dest="profile",
+                              metavar="FILE",
+                              default=None,
+                              help="Write a report of the time and memory each build phase took into FILE, "
+                                   "and a Chrome trace of it next to it.")
 
     apply_parser = subparsers.add_parser('apply', description='Apply')
     add_default_arguments(apply_parser)
@@ -78,6 +124,28 @@ def main(argv=None, stdin=None):
                               type=int,
                               default=15,
                               help="CloudFormation timeout.")
+    apply_parser.add_argument("-j", "--jobs",
+                              dest="jobs",
+                              type=positive_integer_validator,
+                              default=8,
+                              help=("Number of actions (like uploading the code of lambdas) to apply "
+                                    "concurrently. Default: 8"))
+    apply_parser.add_argument("--multipart-threshold",
+                              dest="multipart_threshold",
+                              type=size_validator,
+                              help="Upload files larger than this size to S3 in parts, for example 64M.")
+    apply_parser.add_argument("--multipart-chunksize",
+                              dest="multipart_chunksize",
+                              type=size_validator,
+                              help="Size of each part of the files uploaded to S3 in parts, for example 16M.")
+    apply_parser.add_argument("--max-concurrency",
+                              dest="max_concurrency",
+                              type=positive_integer_validator,
+                              help="Number of parts of each file to upload to S3 at the same time.")
+    apply_parser.add_argument("--max-bandwidth",
+                              dest="max_bandwidth",
+                              type=size_validator,
+                              help="Limit uploads to S3 to this many bytes per second, for example 10M.")
 
     run_parser = subparsers.add_parser('run', description='Run lambda locally')
     add_default_arguments(run_parser)
@@ -86,6 +154,120 @@ def main(argv=None, stdin=None):
     run_parser.add_argument("lambda_name",
                             type=str,
                             help="Lambda you want to run locally in the format APP.LAMBDA_NAME")
+    run_parser.add_argument("--batch",
+                            dest="batch",
+                            action="store_true",
+                            help=("Read one json event per line from stdin and invoke the lambda once per event, "
+                                  "writing the result of each invocation as one json line."))
+    add_enforce_memory_argument(run_parser)
+
+    bench_parser = subparsers.add_parser('bench', description='Benchmark lambda locally')
+    add_default_arguments(bench_parser)
+    bench_parser.set_defaults(cls=ProjectBench)
+    bench_parser.set_defaults(func="bench")
+    bench_parser.add_argument("lambda_name",
+                              type=str,
+                              help="Lambda you want to benchmark in the format APP.LAMBDA_NAME")
+    bench_parser.add_argument("--events",
+                              dest="events",
+                              required=True,
+                              help=("Event file (.json), events file with one event per line (.ndjson) "
+                                    "or directory with several of them."))
+    bench_parser.add_argument("-c", "--concurrency",
+                              dest="concurrency",
+                              type=positive_integer_validator,
+                              default=1,
+                              help="Number of workers invoking the lambda concurrently. Default: 1")
+    bench_parser.add_argument("-n", "--iterations",
+                              dest="iterations",
+                              type=positive_integer_validator,
+                              default=100,
+                              help="Total number of invocations. Default: 100")
+    bench_parser.add_argument("--json",
+                              dest="json",
+                              metavar="FILE",
+                              default=None,
+                              help="Write the report as json into FILE.")
+    add_enforce_memory_argument(bench_parser)
+
+    replay_parser = subparsers.add_parser('replay', description='Replay stream records locally')
+    add_default_arguments(replay_parser)
+    replay_parser.set_defaults(cls=ProjectReplay)
+    replay_parser.set_defaults(func="replay")
+    replay_parser.add_argument("stream_name",
+                               type=str,
+                               help="Stream you want to replay in the format kinesis:APP:NAME or dynamodb:APP:NAME")
+    replay_parser.add_argument("--from",
+                               dest="records",
+                               required=True,
+                               help=("Records file (.ndjson) with the data of one record per line, "
+                                     "or directory with several of them."))
+    replay_parser.add_argument("--shards",
+                               dest="shards",
+                               type=positive_integer_validator,
+                               default=1,
+                               help="Number of shards records are distributed across. Default: 1")
+    replay_parser.add_argument("--partition-key",
+                               dest="partition_key",
+                               default=None,
+                               help="Field of the records used as partition key. Default: the number of the record")
+    replay_parser.add_argument("--json",
+                               dest="json",
+                               metavar="FILE",
+                               default=None,
+                               help="Write the report as json into FILE.")
+
+    serve_parser = subparsers.add_parser('serve', description='Serve lambda locally')
+    add_default_arguments(serve_parser)
+    serve_parser.set_defaults(cls=ProjectServe)
+    serve_parser.set_defaults(func="serve")
+    serve_parser.add_argument("lambda_name",
+                              type=str,
+                              help="Lambda you want to serve locally in the format APP.LAMBDA_NAME")
+    serve_parser.add_argument("--host",
+                              dest="host",
+                              default="127.0.0.1",
+                              help="Address to listen on. Default: 127.0.0.1")
+    serve_parser.add_argument("--port",
+                              dest="port",
+                              type=int,
+                              default=8080,
+                              help="Port to listen on. Default: 8080")
+    serve_parser.add_argument("--socket",
+                              dest="socket",
+                              metavar="PATH",
+                              default=None,
+                              help="Listen on this unix socket instead of a port.")
+    add_enforce_memory_argument(serve_parser)
+
+    serve_api_parser = subparsers.add_parser('serve-api', description='Serve api gateway locally')
+    add_default_arguments(serve_api_parser)
+    serve_api_parser.set_defaults(cls=ProjectServeApi)
+    serve_api_parser.set_defaults(func="serve_api")
+    serve_api_parser.add_argument("api_name",
+                                  type=str,
+                                  nargs="?",
+                                  default=None,
+                                  help="Api you want to serve locally. Required if the project has several of them.")
+    serve_api_parser.add_argument("--host",
+                                  dest="host",
+                                  default="127.0.0.1",
+                                  help="Address to listen on. Default: 127.0.0.1")
+    serve_api_parser.add_argument("--port",
+                                  dest="port",
+                                  type=int,
+                                  default=8080,
+                                  help="Port to listen on. Default: 8080")
+    serve_api_parser.add_argument("-s", "--stage",
+                                  dest="stage",
+                                  type=stage_validator,
+                                  default='dev',
+                                  help="Stage reported to the lambdas in the request context. Default: dev")
+    serve_api_parser.add_argument("-c", "--concurrency",
+                                  dest="concurrency",
+                                  type=positive_integer_validator,
+                                  default=None,
+                                  help="Maximum number of warm workers per lambda. Default: number of CPUs")
 
     delete_parser = subparsers.add_parser('delete', description='Delete this project stacks')
     add_default_arguments(delete_parser)
@@ -101,6 +283,24 @@ def main(argv=None, stdin=None):
                                action="store_false",
                                help="Confirm the deletion of the resources")
 
+    cache_parser = subparsers.add_parser('cache', description='Manage gordon caches')
+    add_default_arguments(cache_parser)
+    cache_parser.set_defaults(cls=Cache)
+    cache_parser.set_defaults(func="stats")
+    cache_subparsers = cache_parser.add_subparsers()
+
+    cache_stats_parser = cache_subparsers.add_parser('stats', description='Show cache statistics')
+    cache_stats_parser.set_defaults(func="stats")
+
+    cache_prune_parser = cache_subparsers.add_parser('prune', description='Prune caches')
+    cache_prune_parser.set_defaults(func="prune")
+    cache_prune_parser.add_argument("--max-size",
+                                    dest="max_size",
+                                    type=size_validator,
+                                    required=True,
+                                    help=("Evict least-recently-used entries until caches are smaller than this size. "
+                                          "Use 0 to empty them."))
+
     options, args = parser.parse_known_args(argv)
 
     path = os.getcwd()
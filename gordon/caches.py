@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class BaseCache(object):
+    """Base persistent cache stored within gordon's workspace.
+
+    Every entry of the cache is a file (or a directory) named after its key.
+    Entries are written atomically, so several builds can share the same
+    cache, and each time one entry is used its modification time is updated
+    so we can evict least-recently-used entries first.
+    """
+
+    namespace = None
+    suffix = ''
+
+    def __init__(self, workspace):
+        self.path = os.path.join(workspace, 'cache', self.namespace)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, '{}{}'.format(key, self.suffix))
+
+    def _create(self):
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # Other build could have created it in the meantime.
+                if not os.path.isdir(self.path):
+                    raise
+
+    def lock(self, key):
+        """Returns a lock shared by all threads of this process which work
+        on the entry ``key``, so expensive entries are only created once."""
+        with _locks_lock:
+            return _locks.setdefault((self.path, key), threading.Lock())
+
+    def mkdtemp(self):
+        """Returns a new temporary directory within the cache which can be
+        later stored as an entry using ``commit``."""
+        self._create()
+        return tempfile.mkdtemp(dir=self.path, prefix='.tmp')
+
+    def get(self, key):
+        """Returns the path of the entry ``key`` or ``None`` if it is not
+        present in the cache."""
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def put(self, key, source):
+        """Store a copy of ``source`` as the entry ``key`` and return its
+        path."""
+        self._create()
+        if os.path.isdir(source):
+            tmp = self.mkdtemp()
+            os.rmdir(tmp)
+            shutil.copytree(source, tmp, symlinks=True)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+            os.close(fd)
+            shutil.copyfile(source, tmp)
+        return self.commit(key, tmp)
+
+    def commit(self, key, tmp):
+        """Atomically move ``tmp`` into the cache as entry ``key``. If other
+        process stored the same entry first, we keep that one."""
+        path = self._entry_path(key)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+            self._delete(tmp)
+        return path
+
+    def entries(self):
+        """Returns a list of ``(key, path, size, last_used)`` for all
+        entries in the cache."""
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for name in os.listdir(self.path):
+            if name.startswith('.') or not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.path, name)
+            key = name[:len(name) - len(self.suffix)] if self.suffix else name
+            entries.append((key, path, self._get_size(path), os.path.getmtime(path)))
+        return entries
+
+    def stats(self):
+        """Returns the number of entries and the total size of the cache."""
+        entries = self.entries()
+        return {
+            'entries': len(entries),
+            'size': sum([e[2] for e in entries])
+        }
+
+    def prune(self, max_size):
+        """Evict least-recently-used entries until the cache is no bigger than
+        ``max_size`` bytes. Returns the number of evicted entries and the
+        number of bytes freed."""
+        entries = sorted(self.entries(), key=lambda e: e[3])
+        total = sum([e[2] for e in entries])
+        removed, freed = 0, 0
+        for key, path, size, last_used in entries:
+            if total <= max_size:
+                break
+            self._delete(path)
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def _get_size(self, path):
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        size = 0
+        for basedir, dirs, files in os.walk(path):
+            for filename in files:
+                filename = os.path.join(basedir, filename)
+                if not os.path.islink(filename):
+                    size += os.path.getsize(filename)
+        return size
+
+    def _delete(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+class ArtifactCache(BaseCache):
+    """Cache of the finished .zip files of lambdas, keyed by the digest of
+    everything that could change their content."""
+
+    namespace = 'artifacts'
+    suffix = '.zip'
+
+
+class DependencyCache(BaseCache):
+    """Cache of installed dependency trees (pip packages, node_modules...)
+    keyed by the digest of the files which define them, the runtime and the
+    platform. Entries are directories which get hardlinked (or copied) into
+    the build directory of each lambda."""
+
+    namespace = 'dependencies'
+
+
+AVAILABLE_CACHES = (
+    ArtifactCache,
+    DependencyCache,
+)
@@ -5,6 +5,9 @@ import json
 import random
 import hashlib
 import shutil
+import signal
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from collections import defaultdict
 
 import six
@@ -19,6 +22,11 @@ from . import utils
 from . import actions
 from . import resources
 from . import protocols
+from . import caches
+from . import profiling
+from . import workers
+from . import emulators
+from . import get_version
 
 SETTINGS_FILE = 'settings.yml'
 
@@ -42,35 +50,53 @@ AVAILABLE_RESOURCES = {
     'apigateway': resources.apigateway.ApiGateway
 }
 
+BUILD_STAGES = ('pre_project', 'project', 'pre_resources', 'resources', 'post_resources')
+
+
+def overrides_hook(cls, hook):
+    """Returns if ``cls`` (or any of its parents) overrides ``hook`` of
+    ``BaseResource``. Hooks which are not overridden do nothing, so there
+    is no need to call them."""
+    for klass in cls.__mro__:
+        if hook in vars(klass):
+            return klass is not resources.base.BaseResource
+    return False
+
 
 class BaseResourceContainer(object):
     """Base abstraction about types which can define resources in their settings."""
 
     def __init__(self, *args, **kwargs):
         self._resources = defaultdict(list)
-        self._load_resources()
+        if kwargs.get('load_resources', True):
+            self._load_resources()
 
     def _load_resources(self):
         """Load resources defined in ``self.settings`` and stores them in
         ``self._resources`` map."""
-        puts = (getattr(self, 'project', None) or self).puts
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
+        for resource_type in AVAILABLE_RESOURCES:
             for name in self.settings.get(resource_type, {}):
-                extra = {
-                    'project': getattr(self, 'project', None) or self,
-                    'app': self if hasattr(self, 'project') else None,
-                }
-
-                with indent(4 if hasattr(self, 'project') else 2):
-                    puts(colored.green(u"✓ {}:{}".format(resource_type, name)))
-
-                self._resources[resource_type].append(
-                    resource_cls.factory(
-                        name=name,
-                        settings=self.settings.get(resource_type, {})[name],
-                        **extra
-                    )
-                )
+                self._load_resource(resource_type, name)
+
+    def _load_resource(self, resource_type, name):
+        """Load the resource ``name`` of ``resource_type`` defined in
+        ``self.settings`` and return it."""
+        puts = (getattr(self, 'project', None) or self).puts
+        extra = {
+            'project': getattr(self, 'project', None) or self,
+            'app': self if hasattr(self, 'project') else None,
+        }
+
+        with indent(4 if hasattr(self, 'project') else 2):
+            puts(colored.green(u"✓ {}:{}".format(resource_type, name)))
+
+        resource = AVAILABLE_RESOURCES[resource_type].factory(
+            name=name,
+            settings=self.settings.get(resource_type, {})[name],
+            **extra
+        )
+        self._resources[resource_type].append(resource)
+        return resource
 
     def get_resources(self, resource_type):
         for r in sorted(self._resources[resource_type], key=lambda r: r.name):
@@ -122,7 +148,7 @@ class BaseProject(object):
             os.makedirs(self.get_workspace())
 
     def get_workspace(self):
-        return os.path.join(os.path.expanduser("~"), '.gordon')
+        return utils.get_workspace()
 
     def puts(self, *args, **kwargs):
         if not self.quiet:
@@ -133,6 +159,8 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
     """Representation of a project on build time. This type initializes
     application and resources defined accrross the settings."""
 
+    FRAGMENTS_DIRECTORY = '.fragments'
+
     DEFAULT_SETTINS = {
         'apps': {}
     }
@@ -141,14 +169,66 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
         self.applications = []
         self._in_project_resource_references = {}
         self._in_project_cf_resource_references = {}
+        self._in_project_cf_names = set()
+        self.jobs = kwargs.pop('jobs', None) or multiprocessing.cpu_count()
+        self.build_cache = kwargs.pop('build_cache', True)
+        self.profile = kwargs.pop('profile', None)
+        if self.profile:
+            profiling.enable()
         BaseProject.__init__(self, *args, **kwargs)
+        self._load(*args, **kwargs)
+
+    def _load(self, *args, **kwargs):
+        """Load all resources of the project and its applications, and
+        validate them."""
         self.puts(colored.blue("Loading project resources"))
-        BaseResourceContainer.__init__(self, *args, **kwargs)
+        with profiling.span('load project resources'):
+            BaseResourceContainer.__init__(self, *args, **kwargs)
         self.puts(colored.blue("Loading installed applications"))
-        self._load_installed_applications()
+        with profiling.span('load installed applications'):
+            self._load_installed_applications()
+        self._build_resource_index()
+        with profiling.span('validate resources'):
+            for resource_type in AVAILABLE_RESOURCES:
+                for resouce in self.get_resources(resource_type):
+                    resouce.validate()
+
+    def _build_resource_index(self):
+        """Index all resources of the project by type, and which of them
+        need to be called for each build stage.
+
+        ``_resource_index`` maps each resource type to a list of
+        ``(container, resources)``, one per application and one for the
+        project, with resources sorted by name.
+
+        ``_stage_hooks`` maps each build stage to a list of
+        ``(resource_type, resource_cls, call_type_hook, containers)`` with
+        only the resource types and resources which override the hooks of
+        that stage."""
+        self._resource_index = {}
         for resource_type in AVAILABLE_RESOURCES:
-            for resouce in self.get_resources(resource_type):
-                resouce.validate()
+            self._resource_index[resource_type] = [
+                (container, list(BaseResourceContainer.get_resources(container, resource_type)))
+                for container in self.applications + [self]
+            ]
+
+        self._stage_hooks = {}
+        for stage in BUILD_STAGES:
+            type_hook, hook = 'register_type_{}_template'.format(stage), 'register_{}_template'.format(stage)
+            overridden = {}
+            self._stage_hooks[stage] = []
+            for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
+                containers = []
+                for container, container_resources in self._resource_index[resource_type]:
+                    container_resources = [
+                        r for r in container_resources
+                        if overridden.setdefault(r.__class__, overrides_hook(r.__class__, hook))
+                    ]
+                    if container_resources:
+                        containers.append((container, container_resources))
+                call_type_hook = overrides_hook(resource_cls, type_hook)
+                if call_type_hook or containers:
+                    self._stage_hooks[stage].append((resource_type, resource_cls, call_type_hook, containers))
 
     def _load_installed_applications(self):
         """Loads all installed applications.
@@ -165,6 +245,23 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
         assumed to be the name and the value of that key is assumed to be a
         settings dictionary that will override the default app settings.
         """
+        for application_name, settings, path in self._get_installed_applications():
+            with indent(2):
+                self.puts(colored.cyan("{}:".format(application_name)))
+
+            with profiling.span(application_name, category='application'):
+                self.add_application(
+                    App(
+                        name=application_name,
+                        settings=settings,
+                        project=self,
+                        path=path
+                    )
+                )
+
+    def _get_installed_applications(self):
+        """Returns the name, settings and path of each installed application
+        (see ``_load_installed_applications``) without loading them."""
         for application in self.settings.get('apps', None) or []:
             path = None
             if isinstance(application, six.string_types):
@@ -179,18 +276,7 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
                 settings = application.values()[0]
             else:
                 raise exceptions.InvalidAppFormatError(application)
-
-            with indent(2):
-                self.puts(colored.cyan("{}:".format(application_name)))
-
-            self.add_application(
-                App(
-                    name=application_name,
-                    settings=settings,
-                    project=self,
-                    path=path
-                )
-            )
+            yield application_name, settings, path
 
     def add_application(self, new_app):
         for app in self.applications:
@@ -202,20 +288,41 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
         """Register a resouce called ``name`` as ``cf_name``"""
         if name in self._in_project_resource_references or \
            name in self._in_project_cf_resource_references or \
-           cf_name in self._in_project_cf_resource_references.values():
+           cf_name in self._in_project_cf_names:
             raise exceptions.DuplicateResourceNameError(name, cf_name)
 
         self._in_project_cf_resource_references[name] = cf_name
+        self._in_project_cf_names.add(cf_name)
         self._in_project_resource_references[name] = resource
 
+    def _add_fragment_reference(self, name):
+        """Record that the fragment of the application being built references
+        the resource ``name``, so if the application of that resource changes
+        the fragment is not reused (see ``_load_fragments``)."""
+        application = getattr(self, '_fragment_application', None)
+        if application is None:
+            return
+        parts = name.split(':')
+        application_name = parts[1] if len(parts) > 2 else ''
+        if application_name in self._fragments and application_name != application.name:
+            self._fragments[application.name]['references'][application_name] = \
+                self._fragments[application_name]['fingerprint']
+
     def reference(self, name):
         """Resolve ``name`` as a CloudFormation reference"""
         if name in self._in_project_cf_resource_references:
+            self._add_fragment_reference(name)
             return self._in_project_cf_resource_references[name]
         raise exceptions.ResourceNotFoundError(name, self._in_project_cf_resource_references.keys())
 
     def get_resources(self, resource_type=None):
         """Returns all project and application resources"""
+        if resource_type in getattr(self, '_resource_index', {}):
+            for _, container_resources in self._resource_index[resource_type]:
+                for r in container_resources:
+                    yield r
+            return
+
         for application in self.applications:
             for r in application.get_resources(resource_type):
                 yield r
@@ -223,8 +330,23 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
         for r in BaseResourceContainer.get_resources(self, resource_type):
             yield r
 
+    def get_artifact_cache(self):
+        """Returns the cache where built lambdas are stored, or ``None`` if
+        the cache is disabled for this build."""
+        if not self.build_cache:
+            return None
+        return caches.ArtifactCache(self.get_workspace())
+
+    def get_dependency_cache(self):
+        """Returns the cache where installed dependencies of lambdas are
+        stored, or ``None`` if the cache is disabled for this build."""
+        if not self.build_cache:
+            return None
+        return caches.DependencyCache(self.get_workspace())
+
     def get_resource(self, grn):
         if grn in self._in_project_resource_references:
+            self._add_fragment_reference(grn)
             return self._in_project_resource_references[grn]
         raise exceptions.ResourceNotFoundError(grn, self._in_project_resource_references.keys())
 
@@ -232,17 +354,237 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
         """Build current current project"""
         self.puts(colored.blue("Building project..."))
 
-        if os.path.exists(self.build_path):
-            shutil.rmtree(self.build_path)
-        os.makedirs(self.build_path)
+        try:
+            with profiling.span('build'):
+                self._load_fragments()
+                self._clean_build_path()
 
-        with indent(2):
-            self._reset_build_sequence_id()
-            self._build_pre_project_template()
-            self._build_project_template()
-            self._build_pre_resources_template()
-            self._build_resources_template()
-            self._build_post_resources_template()
+                with indent(2):
+                    self._reset_build_sequence_id()
+                    with profiling.span('pre_project template'):
+                        self._build_pre_project_template()
+                    with profiling.span('project template'):
+                        self._build_project_template()
+                    with profiling.span('lambdas code'):
+                        self._build_lambdas_code()
+                    with profiling.span('pre_resources template'):
+                        self._build_pre_resources_template()
+                    with profiling.span('resources template'):
+                        self._build_resources_template()
+                    with profiling.span('post_resources template'):
+                        self._build_post_resources_template()
+
+                self._save_fragments()
+        finally:
+            if self.profile:
+                profiling.save(self.profile)
+                profiling.disable()
+                self.puts(colored.white(u"✸ Profile written to {} and {}".format(
+                    self.profile, profiling.get_trace_filename(self.profile)))
+                )
+
+    def _clean_build_path(self):
+        """Remove the output of previous builds, but keep the fragments
+        directory so unchanged applications don't need to be built again."""
+        if not os.path.exists(self.build_path):
+            os.makedirs(self.build_path)
+            return
+
+        for filename in os.listdir(self.build_path):
+            if filename == self.FRAGMENTS_DIRECTORY:
+                continue
+            path = os.path.join(self.build_path, filename)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def _get_fragments_path(self):
+        return os.path.join(self.build_path, self.FRAGMENTS_DIRECTORY)
+
+    def _get_application_fingerprint(self, application):
+        """Returns the fingerprint of the contribution of ``application`` to
+        the project templates. It only depends on the settings of the
+        application and the project, and the version of gordon."""
+        return utils.get_object_digest(get_version(), application.name, application.settings, self.settings)
+
+    def _load_fragments(self):
+        """Load the fragments of all applications which haven't changed since
+        the previous build, nor have the applications they reference."""
+        self._fragments = {}
+        self._reused_fragments = {}
+        self._fragment_application = None
+        fingerprints = dict(
+            (application.name, self._get_application_fingerprint(application)) for application in self.applications
+        )
+        for application in self.applications:
+            self._fragments[application.name] = {
+                'fingerprint': fingerprints[application.name],
+                'references': {},
+                'stages': {}
+            }
+
+            filename = os.path.join(self._get_fragments_path(), '{}.json'.format(application.name))
+            if not self.build_cache or not os.path.isfile(filename):
+                continue
+
+            with open(filename, 'r') as f:
+                try:
+                    fragments = json.loads(f.read())
+                except ValueError:
+                    continue
+
+            references = fragments.get('references', {})
+            if fragments.get('fingerprint') == fingerprints[application.name] and \
+               all(fingerprints.get(name) == fingerprint for name, fingerprint in six.iteritems(references)):
+                self._reused_fragments[application.name] = fragments['stages']
+                self._fragments[application.name]['references'] = references
+                if self.debug:
+                    with indent(2):
+                        self.puts(colored.white(u"✸ Reusing templates of {}".format(application.name)))
+
+    def _save_fragments(self):
+        """Store the fragments of all applications so subsequent builds can
+        reuse them."""
+        path = self._get_fragments_path()
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        for name, fragments in six.iteritems(self._fragments):
+            with open(os.path.join(path, '{}.json'.format(name)), 'w') as f:
+                f.write(json.dumps(fragments))
+
+    def _get_application_fragment(self, application, stage, resource_type, application_resources,
+                                  new_template, serialize):
+        """Returns the serialized contribution of ``application_resources``
+        (the ``resource_type`` resources of ``application``) to ``stage``. If
+        the application hasn't changed since the previous build, the
+        previous fragment is reused, unless any of its resources doesn't
+        allow it (see ``BaseResource.reuse_fragments``)."""
+        fragment = self._reused_fragments.get(application.name, {}).get(stage, {}).get(resource_type)
+        if fragment is None or not all(r.reuse_fragments for r in application_resources):
+            template = new_template()
+            self._fragment_application = application
+            try:
+                for r in application_resources:
+                    self._call_hook(r, 'register_{}_template'.format(stage), template)
+            finally:
+                self._fragment_application = None
+            with profiling.span('serialize', category='serialize', stage=stage, app=application.name):
+                fragment = serialize(template)
+
+        self._fragments[application.name]['stages'].setdefault(stage, {})[resource_type] = fragment
+        return fragment
+
+    def _get_stage_fragments(self, stage, new_template, serialize):
+        """Returns the serialized contributions of all resources to ``stage``
+        in the same order hooks are called:
+         - ``register_type_{stage}_template`` of each resource type.
+         - ``register_{stage}_template`` of the resources of each application.
+         - ``register_{stage}_template`` of the resources of the project.
+        Only the resource types and resources in ``_stage_hooks`` are
+        called, as the hooks of the rest don't contribute anything.
+        """
+        fragments = []
+        for resource_type, resource_cls, call_type_hook, containers in self._stage_hooks[stage]:
+            if call_type_hook:
+                template = new_template()
+                self._call_hook(resource_cls, 'register_type_{}_template'.format(stage), self, template)
+                with profiling.span('serialize', category='serialize', stage=stage):
+                    fragments.append(serialize(template))
+
+            for container, container_resources in containers:
+                if container is not self:
+                    fragments.append(
+                        self._get_application_fragment(
+                            container, stage, resource_type, container_resources, new_template, serialize
+                        )
+                    )
+                    continue
+
+                template = new_template()
+                for r in container_resources:
+                    self._call_hook(r, 'register_{}_template'.format(stage), template)
+                with profiling.span('serialize', category='serialize', stage=stage):
+                    fragments.append(serialize(template))
+        return fragments
+
+    def _call_hook(self, resource, hook, *args):
+        """Call ``hook`` of ``resource`` (either a resource type or
+        instance) recording it as a span."""
+        if isinstance(resource, type):
+            name, span_args = '{}.{}'.format(resource.__name__, hook), {}
+        else:
+            name, span_args = '{}.{}'.format(resource.__class__.__name__, hook), {'resource': resource.in_project_name}
+        with profiling.span(name, category='hook', **span_args):
+            getattr(resource, hook)(*args)
+
+    def _serialize_troposphere_template(self, template):
+        return {
+            'template': template.to_dict(),
+            'references': utils.get_troposphere_references(template)
+        }
+
+    def _merge_troposphere_fragments(self, fragments):
+        """Merge troposphere ``fragments`` into the base template, adding
+        parameters for those references which are not present in it."""
+        template = self._base_troposphere_template()
+        data = template.to_dict()
+        for fragment in fragments:
+            for section, values in six.iteritems(fragment['template']):
+                if not isinstance(values, dict):
+                    data[section] = values
+                    continue
+                for key, value in six.iteritems(values):
+                    if key in data.setdefault(section, {}):
+                        template.handle_duplicate_key(key)
+                    data[section][key] = value
+
+        for fragment in fragments:
+            for name, type_ in fragment['references']:
+                if name not in data.get('Parameters', {}) and name not in data['Resources']:
+                    data.setdefault('Parameters', {})[name] = {'Type': type_}
+        return data
+
+    def _merge_actions_fragments(self, fragments):
+        """Merge custom template ``fragments`` into one ``ActionsTemplate``."""
+        data = actions.ActionsTemplate().serialize()
+        for fragment in fragments:
+            data['actions'].extend(fragment['actions'])
+            data['parameters'].update(fragment['parameters'])
+            data['outputs'].update(fragment['outputs'])
+            data['parallelizable'] = data['parallelizable'] or fragment['parallelizable']
+        return data
+
+    def _build_custom_template(self, stage, output_filename):
+        """Collect registered hooks both for ``register_type_{stage}_template``
+        and ``register_{stage}_template`` into a custom template."""
+        fragments = self._get_stage_fragments(stage, actions.ActionsTemplate, lambda t: t.serialize())
+        with profiling.span('merge', category='serialize', stage=stage):
+            template = self._merge_actions_fragments(fragments)
+
+        if template['actions']:
+            output_filename = output_filename.format(self._get_next_build_sequence_id())
+            self.puts(colored.cyan(output_filename))
+            with profiling.span('write', category='write', filename=output_filename):
+                with open(os.path.join(self.build_path, output_filename), 'w') as f:
+                    f.write(json.dumps(template, indent=4, sort_keys=True))
+
+    def _build_troposphere_template(self, stage, output_filename, required=True):
+        """Collect registered hooks both for ``register_type_{stage}_template``
+        and ``register_{stage}_template`` into a CloudFormation template. If
+        not ``required``, the template is only created if it has resources."""
+        fragments = self._get_stage_fragments(stage, troposphere.Template, self._serialize_troposphere_template)
+        with profiling.span('merge', category='serialize', stage=stage):
+            template = self._merge_troposphere_fragments(fragments)
+
+        if required or template['Resources']:
+            output_filename = output_filename.format(self._get_next_build_sequence_id())
+            self.puts(colored.cyan(output_filename))
+            with profiling.span('write', category='write', filename=output_filename):
+                with open(os.path.join(self.build_path, output_filename), 'w') as f:
+                    f.write(json.dumps(template, indent=4, sort_keys=True, separators=(',', ': ')))
 
     def _reset_build_sequence_id(self):
         self._build_sequence = 0
@@ -276,104 +618,376 @@ class ProjectBuild(BaseProject, BaseResourceContainer):
     def _build_pre_project_template(self, output_filename="{}_pr_p.json"):
         """Collect registered hooks both for ``register_type_pre_project_template``
         and ``register_pre_project_template``"""
-        template = actions.ActionsTemplate()
-
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
-            resource_cls.register_type_pre_project_template(self, template)
-            for r in self.get_resources(resource_type):
-                r.register_pre_project_template(template)
-
-        if template:
-            output_filename = output_filename.format(self._get_next_build_sequence_id())
-            self.puts(colored.cyan(output_filename))
-            with open(os.path.join(self.build_path, output_filename), 'w') as f:
-                f.write(template.to_json(indent=4))
+        self._build_custom_template('pre_project', output_filename)
 
-    def _build_project_template(self,  output_filename="{}_p.json"):
+    def _build_project_template(self, output_filename="{}_p.json"):
         """Collect registered hooks both for ``register_type_project_template``
         and ``register_project_template``"""
+        self._build_troposphere_template('project', output_filename)
+
+    def _build_lambdas_code(self):
+        """Collect, build and zip the code of all lambdas in the project.
+        Lambdas are independent from each other, so up to ``jobs`` of them
+        are built concurrently. The output of each lambda is buffered and
+        printed once it finishes, in the same order a serial build would.
+
+        The digest, size and number of members of each .zip file are written
+        into the manifest of the build (``utils.MANIFEST_FILE``), so apply
+        doesn't need to read them again."""
+        lambdas = list(self.get_resources('lambdas'))
+        if not lambdas:
+            return
 
-        output_filename = output_filename.format(self._get_next_build_sequence_id())
-        template = self._base_troposphere_template()
+        self.create_workspace()
+        code_path = os.path.join(self.build_path, 'code')
+        if not os.path.exists(code_path):
+            os.makedirs(code_path)
+
+        def _build_lambda_code(lambda_):
+            output = []
+            entry = lambda_.build_code(log=output.append)
+            return output, entry
+
+        manifest = {}
 
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
-            resource_cls.register_type_project_template(self, template)
-            for r in self.get_resources(resource_type):
-                r.register_project_template(template)
+        def _add_to_manifest(lambda_, entry):
+            filename = os.path.relpath(lambda_.get_code_filename(), self.build_path)
+            manifest[filename.replace(os.sep, '/')] = entry
 
-        template = utils.fix_troposphere_references(template)
+        jobs = min(self.jobs, len(lambdas))
+        if jobs == 1:
+            for lambda_ in lambdas:
+                _add_to_manifest(lambda_, lambda_.build_code())
+        else:
+            pool = ThreadPool(jobs)
+            try:
+                for lambda_, (output, entry) in zip(lambdas, pool.imap(_build_lambda_code, lambdas)):
+                    with indent(4):
+                        for message in output:
+                            self.puts(message)
+                    _add_to_manifest(lambda_, entry)
+            finally:
+                pool.terminate()
+                pool.join()
 
-        self.puts(colored.cyan(output_filename))
-        with open(os.path.join(self.build_path, output_filename), 'w') as f:
-            f.write(template.to_json())
+        utils.write_manifest(self.build_path, manifest)
 
     def _build_pre_resources_template(self, output_filename="{}_pr_r.json"):
         """Collect registered hooks both for ``register_type_pre_resources_template``
         and ``register_pre_resources_template``"""
-        template = actions.ActionsTemplate()
-
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
-            resource_cls.register_type_pre_resources_template(self, template)
-            for r in self.get_resources(resource_type):
-                r.register_pre_resources_template(template)
-
-        if template:
-            output_filename = output_filename.format(self._get_next_build_sequence_id())
-            self.puts(colored.cyan(output_filename))
-            with open(os.path.join(self.build_path, output_filename), 'w') as f:
-                f.write(template.to_json(indent=4))
+        self._build_custom_template('pre_resources', output_filename)
 
     def _build_resources_template(self, output_filename="{}_r.json"):
         """Collect registered hooks both for ``register_type_resources_template``
         and ``register_resources_template``"""
-
-        template = self._base_troposphere_template()
-
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
-            resource_cls.register_type_resources_template(self, template)
-            for r in self.get_resources(resource_type):
-                r.register_resources_template(template)
-
-        template = utils.fix_troposphere_references(template)
-
-        if template and template.resources:
-            output_filename = output_filename.format(self._get_next_build_sequence_id())
-            self.puts(colored.cyan(output_filename))
-            with open(os.path.join(self.build_path, output_filename), 'w') as f:
-                f.write(template.to_json())
+        self._build_troposphere_template('resources', output_filename, required=False)
 
     def _build_post_resources_template(self, output_filename="{}_ps_r.json"):
         """Collect registered hooks both for ``register_type_post_resources_template``
         and ``register_post_resources_template``"""
-
-        template = actions.ActionsTemplate()
-
-        for resource_type, resource_cls in six.iteritems(AVAILABLE_RESOURCES):
-            resource_cls.register_type_post_resources_template(self, template)
-            for r in self.get_resources(resource_type):
-                r.register_post_resources_template(template)
-
-        if template:
-            output_filename = output_filename.format(self._get_next_build_sequence_id())
-            self.puts(colored.cyan(output_filename))
-            with open(os.path.join(self.build_path, output_filename), 'w') as f:
-                f.write(template.to_json(indent=4))
+        self._build_custom_template('post_resources', output_filename)
 
 
 class ProjectRun(ProjectBuild):
+    """Representation of a project when one of its lambdas is run locally.
+    Only the application of the lambda, the lambda and the resources it
+    depends on (its context and vpc) are loaded, and they are not validated
+    against the rest of the project."""
 
     quiet = True
 
     def __init__(self, *args, **kwargs):
+        self.lambda_friendly_name = kwargs.get('lambda_name')
+        self.batch = kwargs.pop('batch', False)
+        self.enforce_memory = kwargs.pop('enforce_memory', False)
         super(ProjectRun, self).__init__(*args, **kwargs)
-        self.lambda_friendly_name = kwargs['lambda_name']
+
+    def _load(self, *args, **kwargs):
+        BaseResourceContainer.__init__(self, load_resources=False)
+        self.lambda_ = self._load_lambda(self.lambda_friendly_name)
+
+    def _get_application(self, name):
+        """Returns the installed application ``name`` with its settings,
+        but none of its resources, loaded. ``None`` if it isn't installed."""
+        for application in self.applications:
+            if application.name == name:
+                return application
+
+        for installed_name, settings, path in self._get_installed_applications():
+            if installed_name == name:
+                application = App(
+                    name=name,
+                    settings=settings,
+                    project=self,
+                    path=path,
+                    load_resources=False
+                )
+                self.add_application(application)
+                return application
+        return None
+
+    def _load_lambda(self, lambda_friendly_name):
+        """Load the lambda ``lambda_friendly_name`` (``APP.LAMBDA_NAME``) and
+        the project resources it depends on, and return it."""
+        application_name, _, name = lambda_friendly_name.partition('.')
+        application = self._get_application(application_name)
+        if application is None or name not in application.settings.get('lambdas', {}):
+            raise exceptions.LambdaNotFound(lambda_friendly_name)
+        lambda_ = application._load_resource('lambdas', name)
+
+        for resource_type, resource_name in (('contexts', lambda_.get_context_key()),
+                                             ('vpcs', lambda_.settings.get('vpc'))):
+            if resource_name in self.settings.get(resource_type, {}) and \
+                    resource_name not in [r.name for r in self._resources[resource_type]]:
+                self._load_resource(resource_type, resource_name)
+        return lambda_
 
     def run(self):
-        grn = utils.lambda_friendly_name_to_grn(self.lambda_friendly_name).rsplit(':', 1)[0]
-        lambdas = [l for l in self.get_resources('lambdas') if l.in_project_name == grn]
-        if not lambdas:
-            raise exceptions.LambdaNotFound(self.lambda_friendly_name)
-        lambdas[0].collect_and_run(stdin=self.stdin)
+        self.lambda_.collect_and_run(stdin=self.stdin, batch=self.batch, enforce_memory=self.enforce_memory)
+
+
+class ProjectBench(ProjectRun):
+    """Benchmark one lambda of the project locally using several warm
+    workers concurrently (see ``gordon.workers.benchmark``)."""
+
+    quiet = False
+
+    def __init__(self, *args, **kwargs):
+        self.events = kwargs.pop('events')
+        self.concurrency = kwargs.pop('concurrency', 1)
+        self.iterations = kwargs.pop('iterations', 100)
+        self.json = kwargs.pop('json', None)
+        super(ProjectBench, self).__init__(*args, **kwargs)
+
+    def bench(self):
+        events = workers.load_events(self.events)
+        if not events:
+            raise exceptions.NoEventsError(self.events)
+
+        self.puts(colored.blue("Benchmarking {}".format(self.lambda_friendly_name)))
+        with open(os.devnull, 'w') as devnull:
+            report = workers.benchmark(
+                self.lambda_,
+                events,
+                concurrency=self.concurrency,
+                iterations=self.iterations,
+                stderr=None if self.debug else devnull,
+                enforce_memory=self.enforce_memory
+            )
+
+        if self.json:
+            with open(self.json, 'w') as f:
+                f.write(json.dumps(report, indent=4, sort_keys=True))
+
+        color = colored.red if report['errors'] else colored.green
+        self.puts(color(u"{} {} invocations in {:.2f}s ({:.1f}/s) using {} workers, {} errors{}".format(
+            u"✗" if report['errors'] else u"✓", report['iterations'], report['wall'],
+            report['throughput'] or 0, report['concurrency'], report['errors'],
+            u"".join(u" ({} {})".format(report[key], name) for key, name in (
+                ('timeouts', 'timeouts'), ('out_of_memory', 'out of memory')) if report[key])
+        )))
+        with indent(2):
+            for name in ('cold_start', 'init_duration', 'warm'):
+                self._puts_summary(name.replace('_', ' '), report[name])
+            for worker in report['workers']:
+                self.puts(u"worker {:<7} {} invocations, cold start {}, peak rss {}".format(
+                    worker['worker'],
+                    worker['invocations'],
+                    u"{:.1f}ms".format(worker['cold_start']) if 'cold_start' in worker else u"-",
+                    utils.get_human_size(worker['max_rss']) if worker['max_rss'] else u"-"
+                ))
+
+    def _puts_summary(self, name, summary, value_format=u"{:.1f}ms"):
+        """Print the percentiles of ``summary`` (see ``workers.summarize``)."""
+        if not summary['count']:
+            return
+        self.puts(u"{:<14} {}".format(name, u"  ".join(
+            u"{} {}".format(key, value_format.format(summary[key]))
+            for key in ('min', 'p50', 'p90', 'p99', 'max') if key in summary
+        )))
+
+
+class ProjectReplay(ProjectBench):
+    """Replay records into the lambda of one kinesis or dynamodb stream of
+    the project, the way its event source mapping would (see
+    ``gordon.emulators.StreamEmulator``). Only the stream, its lambda and
+    the resources it depends on are loaded."""
+
+    def __init__(self, *args, **kwargs):
+        self.stream_name = kwargs.pop('stream_name')
+        self.records = kwargs.pop('records')
+        self.shards = kwargs.pop('shards', 1)
+        self.partition_key = kwargs.pop('partition_key', None)
+        self.region = kwargs.get('region') or None
+        super(ProjectReplay, self).__init__(*args, events=None, **kwargs)
+
+    def _load(self, *args, **kwargs):
+        BaseResourceContainer.__init__(self, load_resources=False)
+        self.region = self.region or self.settings.get('default-region') or 'us-east-1'
+        resource_type, _, path = self.stream_name.partition(':')
+        resource_type = {'kinesis-stream': 'kinesis', 'dynamodb-stream': 'dynamodb'}.get(resource_type, resource_type)
+        application_name, _, name = path.partition(':')
+
+        container = self._get_application(application_name) if application_name else self
+        if resource_type not in emulators.STREAM_EMULATORS or container is None or \
+                name not in container.settings.get(resource_type, {}):
+            raise exceptions.StreamNotFoundError(self.stream_name)
+
+        self.stream = container._load_resource(resource_type, name)
+        self.stream.get_starting_position()
+        self.lambda_ = self._load_lambda(self.stream.settings['lambda'])
+        self.emulator_class = emulators.STREAM_EMULATORS[resource_type]
+
+    def replay(self):
+        records = workers.load_events(self.records)
+        if not records:
+            raise exceptions.NoEventsError(self.records)
+
+        self.puts(colored.blue("Replaying {} records into {}".format(len(records), self.stream.in_project_name)))
+        with open(os.devnull, 'w') as devnull:
+            report = self.emulator_class(
+                self.stream,
+                self.lambda_,
+                shards=self.shards,
+                partition_key=self.partition_key,
+                region=self.region,
+                stderr=None if self.debug else devnull
+            ).replay(records)
+
+        if self.json:
+            with open(self.json, 'w') as f:
+                f.write(json.dumps(report, indent=4, sort_keys=True))
+
+        color = colored.red if report['errors'] else colored.green
+        self.puts(color(u"{} {} records in {} batches in {:.2f}s ({:.1f} records/s) using {} shards, {} errors".format(
+            u"✗" if report['errors'] else u"✓", report['records'], report['batches'], report['wall'],
+            report['throughput'] or 0, report['shards'], report['errors']
+        )))
+        with indent(2):
+            self._puts_summary('batch size', report['batch_sizes'], value_format=u"{}")
+            self._puts_summary('cold start', report['cold_start'])
+            self._puts_summary('batch latency', report['latency'])
+            for shard in report['shard_reports']:
+                self.puts(u"{} {} batches, {} records, {} errors".format(
+                    shard['shard'], shard['batches'], shard['records'], shard['errors']
+                ))
+
+
+class ProjectServe(ProjectRun):
+    """Serve one lambda of the project locally, keeping its code collected
+    and its handler loaded between invocations (see ``gordon.workers``)."""
+
+    quiet = False
+
+    def __init__(self, *args, **kwargs):
+        self.host = kwargs.pop('host', '127.0.0.1')
+        self.port = kwargs.pop('port', 8080)
+        self.socket = kwargs.pop('socket', None)
+        super(ProjectServe, self).__init__(*args, **kwargs)
+
+    def serve(self):
+        warm_lambda = workers.WarmLambda(self.lambda_, enforce_memory=self.enforce_memory)
+        self.puts(colored.blue("Collecting {}".format(self.lambda_friendly_name)))
+        warm_lambda.reload()
+
+        def log(result):
+            with indent(2):
+                self.puts(workers.format_result(result))
+
+        server = workers.create_server(warm_lambda, host=self.host, port=self.port, socket=self.socket, log=log)
+        if self.socket:
+            address = 'unix:{}'.format(self.socket)
+        else:
+            address = 'http://{}:{}/'.format(*server.server_address[:2])
+        self.puts(colored.green(u"✓ Serving {} on {}".format(self.lambda_friendly_name, address)))
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            warm_lambda.close()
+
+
+class ProjectServeApi(ProjectRun):
+    """Serve one api gateway of the project locally (see
+    ``gordon.emulators``). Only the api, the lambdas it integrates with and
+    the resources they depend on are loaded."""
+
+    quiet = False
+
+    def __init__(self, *args, **kwargs):
+        self.api_name = kwargs.pop('api_name', None)
+        self.host = kwargs.pop('host', '127.0.0.1')
+        self.port = kwargs.pop('port', 8080)
+        self.stage = kwargs.pop('stage', 'dev')
+        self.concurrency = kwargs.pop('concurrency', None) or multiprocessing.cpu_count()
+        super(ProjectServeApi, self).__init__(*args, **kwargs)
+
+    def _load(self, *args, **kwargs):
+        BaseResourceContainer.__init__(self, load_resources=False)
+        apis = [(self, name) for name in self.settings.get('apigateway', {})]
+        for application_name, _, _ in self._get_installed_applications():
+            application = self._get_application(application_name)
+            apis.extend((application, name) for name in application.settings.get('apigateway', {}))
+
+        available = sorted(name for _, name in apis)
+        if self.api_name:
+            apis = [(container, name) for container, name in apis if name == self.api_name]
+        if len(apis) != 1:
+            raise exceptions.ApiGatewayNotFoundError(self.api_name or '', ', '.join(available) or '-')
+
+        container, name = apis[0]
+        self.api = container._load_resource('apigateway', name)
+        self.lambdas = {}
+        for _, _, configuration in self.api.get_methods():
+            lambda_friendly_name = configuration.get('integration', {}).get('lambda')
+            if lambda_friendly_name and lambda_friendly_name not in self.lambdas:
+                self.lambdas[lambda_friendly_name] = self._load_lambda(lambda_friendly_name)
+
+    def serve_api(self):
+        emulator = emulators.ApiGatewayEmulator(
+            self.api,
+            self.lambdas,
+            stage=self.stage,
+            concurrency=self.concurrency
+        )
+        for lambda_friendly_name in sorted(self.lambdas):
+            self.puts(colored.blue("Collecting {}".format(lambda_friendly_name)))
+            emulator.pools[lambda_friendly_name].reload()
+
+        def log(request, response, latency):
+            color = colored.red if response.status >= 500 else colored.green
+            with indent(2):
+                self.puts(color(u"{} {} {} {:.1f}ms".format(request.method, request.path, response.status, latency)))
+                if response.result:
+                    with indent(2):
+                        self.puts(workers.format_result(response.result))
+
+        server = emulators.ApiGatewayServer((self.host, self.port), emulator, log=log)
+        self.puts(colored.green(u"✓ Serving {} on http://{}:{}/".format(self.api.name, *server.server_address[:2])))
+        for route in emulator.routes:
+            with indent(2):
+                self.puts(u"{:<7} {} ({})".format(
+                    route.method, route.path, route.lambda_name or route.integration_type
+                ))
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            emulator.close()
 
 
 class ProjectApplyLoopBase(BaseProject):
@@ -420,6 +1034,15 @@ class ProjectApplyLoopBase(BaseProject):
 
 class ProjectApply(ProjectApplyLoopBase):
 
+    def __init__(self, *args, **kwargs):
+        super(ProjectApply, self).__init__(*args, **kwargs)
+        self.jobs = kwargs.pop('jobs', None) or 8
+        self.manifest = utils.load_manifest(self.build_path)
+        self.transfer_config = utils.get_transfer_config(
+            self.settings.get('s3-transfer'),
+            **dict((option, kwargs.pop(option, None)) for _, option, _ in utils.TRANSFER_SETTINGS)
+        )
+
     def apply(self):
         self.puts(colored.blue("Applying project..."))
         context = self.get_initial_context()
@@ -453,7 +1076,7 @@ class ProjectApply(ProjectApplyLoopBase):
 
         # If not defined in settings.yml then retrieve the account_id of the credentials currently in use.
         # The first approach is slightly more lightweight than the second.
-        if self.settings.get('aws-account-id', None) == None:
+        if self.settings.get('aws-account-id', None) is None:
             try:
                 aws_account_id = boto3.client('iam').get_user()['User']['Arn'].split(':')[4]
             except ClientError:
@@ -487,7 +1110,7 @@ class ProjectApply(ProjectApplyLoopBase):
         with open(os.path.join(self.build_path, filename), 'r') as f:
             template = actions.ActionsTemplate.from_dict(json.loads(f.read()))
 
-        outputs = template.apply(context, self)
+        outputs = template.apply(context, self, jobs=self.jobs)
 
         for key, value in six.iteritems(outputs):
             context[key] = value
@@ -500,7 +1123,8 @@ class ProjectApply(ProjectApplyLoopBase):
             template_filename=os.path.join(self.build_path, filename),
             context=context,
             timeout_in_minutes=self.timeout_in_minutes,
-            bucket=context.get('CodeBucket')
+            bucket=context.get('CodeBucket'),
+            transfer_config=self.transfer_config
         )
 
         for output in stack.get('Outputs', []):
@@ -560,6 +1184,33 @@ class ProjectDelete(ProjectApplyLoopBase):
         )
 
 
+class Cache(object):
+    """Inspect and prune gordon's persistent caches."""
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.max_size = kwargs.pop('max_size', None)
+        self.caches = [cache_cls(utils.get_workspace()) for cache_cls in caches.AVAILABLE_CACHES]
+
+    def stats(self):
+        """Output the number of entries and size of each cache."""
+        for cache in self.caches:
+            stats = cache.stats()
+            puts(colored.cyan("{}:".format(cache.namespace)))
+            with indent(2):
+                puts("entries: {}".format(stats['entries']))
+                puts("size: {}".format(utils.get_human_size(stats['size'])))
+
+    def prune(self):
+        """Evict least-recently-used entries until each cache is no bigger
+        than ``max_size``."""
+        for cache in self.caches:
+            removed, freed = cache.prune(self.max_size)
+            puts(colored.green(u"✓ {}: {} entries removed ({})".format(
+                cache.namespace, removed, utils.get_human_size(freed)))
+            )
+
+
 class Bootstrap(object):
     """Project and apps bootstraper"""
 
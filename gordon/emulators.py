@@ -0,0 +1,700 @@
+# -*- coding: utf-8 -*-
+"""Local emulation of the services which invoke lambdas.
+
+``ApiGatewayEmulator`` routes http requests the same way an ``apigateway``
+resource of the project does once deployed, and dispatches them to their
+integration: ``AWS`` and ``AWS_PROXY`` integrations invoke the lambda using a
+pool of warm workers (see ``gordon.workers.WorkerPool``), ``HTTP`` ones are
+forwarded to their ``uri`` and ``MOCK`` ones respond with their integration
+response.
+
+Mapping templates are rendered using a small subset of the Velocity Template
+Language: ``#set`` directives, ``$input.body``, ``$input.json()``,
+``$input.path()``, ``$input.params()``, ``$context`` and ``$stageVariables``.
+
+``StreamEmulator`` replays records into the lambda of a ``kinesis`` or
+``dynamodb`` stream the same way its event source mapping does: records are
+distributed across shards, and the batches of each shard are invoked in
+order while shards are processed concurrently.
+"""
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import threading
+from decimal import Decimal
+from collections import namedtuple
+
+import six
+from boto3.dynamodb.types import TypeSerializer
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit, urlencode, parse_qsl, unquote
+from six.moves.urllib.request import urlopen, Request
+from six.moves.urllib.error import HTTPError, URLError
+
+from . import exceptions
+from . import workers
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# Api Gateway gives up on integrations after 29 seconds.
+INTEGRATION_TIMEOUT = 29
+
+# Event source mappings don't send batches bigger than the maximum payload
+# of a synchronous invocation.
+MAX_BATCH_PAYLOAD = 6 * 1024 * 1024
+
+EXPRESSION = r"""input\.(?:json|path|params)\((?:'[^']*'|"[^"]*")?\)|[a-zA-Z]\w*(?:\.[a-zA-Z_]\w*)*"""
+REFERENCE = re.compile(r"\$(!?)(?:\{{({0})\}}|({0}))".format(EXPRESSION))
+FUNCTION = re.compile(r"""^input\.(json|path|params)\((?:'([^']*)'|"([^"]*)")?\)$""")
+SET = re.compile(r"^#set\s*\(\s*\$\{?(\w+)\}?\s*=\s*(.+?)\s*\)$")
+
+Response = namedtuple('Response', ('status', 'headers', 'body', 'result'))
+
+
+def json_response(status, data, result=None):
+    return Response(status, {'Content-Type': JSON_CONTENT_TYPE}, json.dumps(data).encode('utf-8'), result)
+
+
+def load_json(body):
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return None
+
+
+def json_path(value, path):
+    """Returns the element of ``value`` at the JSONPath ``path``. Only the
+    root (``$``), children (``.key`` or ``['key']``) and indexes are
+    supported."""
+    for key, quoted, index in re.findall(r"""\.([^.\[]+)|\[['"]([^'"]+)['"]\]|\[(\d+)\]""", path.lstrip('$')):
+        try:
+            value = value[int(index)] if index else value[key or quoted]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+
+def render_template(template, body, params=None, context=None, stage_variables=None):
+    """Render the mapping ``template`` with the ``body`` of the request (or
+    response), the ``params`` of the request (``path``, ``querystring`` and
+    ``header``) and the request ``context``."""
+    params = params or {}
+    variables = {'context': context or {}, 'stageVariables': stage_variables or {}}
+
+    def evaluate(expression):
+        match = FUNCTION.match(expression)
+        if match:
+            function, argument = match.group(1), match.group(2) or match.group(3) or ''
+            if function == 'params':
+                for location in ('path', 'querystring', 'header'):
+                    if argument in params.get(location, {}):
+                        return params[location][argument]
+                return ''
+            value = json_path(load_json(body), argument)
+            return json.dumps(value) if function == 'json' else value
+        if expression == 'input.body':
+            return body
+        name, _, path = expression.partition('.')
+        value = variables.get(name)
+        for key in filter(None, path.split('.')):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+
+    def replace(match):
+        quiet, expression = match.group(1), match.group(2) or match.group(3)
+        value = evaluate(expression)
+        if value is None:
+            # Velocity leaves unknown references as they are, unless they
+            # are quiet ($!reference).
+            return '' if quiet else match.group(0)
+        return value if isinstance(value, six.string_types) else json.dumps(value)
+
+    output = []
+    for line in template.splitlines(True):
+        directive = line.strip()
+        if directive.startswith('##'):
+            continue
+        if directive.startswith('#'):
+            match = SET.match(directive)
+            if not match:
+                raise exceptions.UnsupportedMappingTemplateError(directive.split('(')[0])
+            name, expression = match.groups()
+            reference = REFERENCE.match(expression)
+            if reference and reference.end() == len(expression):
+                variables[name] = evaluate(reference.group(2) or reference.group(3))
+            else:
+                value = load_json(expression)
+                variables[name] = expression.strip("'") if value is None else value
+            continue
+        output.append(REFERENCE.sub(replace, line))
+    return ''.join(output)
+
+
+def select_response(responses, selector):
+    """Returns the first integration response whose ``pattern`` matches
+    ``selector`` (an error message or a status code) or the default one (the
+    one with an empty ``pattern``)."""
+    responses = responses or [{'pattern': '', 'code': '200'}]
+    if selector is not None:
+        for response in responses:
+            pattern = six.text_type(response.get('pattern', ''))
+            if pattern and re.match(u'(?:{})$'.format(pattern), selector, re.DOTALL):
+                return response
+    for response in responses:
+        if not six.text_type(response.get('pattern', '')):
+            return response
+    return None
+
+
+class ApiRequest(object):
+
+    def __init__(self, method, path, headers=None, body=b'', source_ip='127.0.0.1'):
+        url = urlsplit(path)
+        self.method = method.upper()
+        self.path = unquote(url.path)
+        self.query = parse_qsl(url.query, keep_blank_values=True)
+        self.headers = headers or {}
+        self.body = body
+        self.source_ip = source_ip
+
+    def get_header(self, name, default=None):
+        for key, value in six.iteritems(self.headers):
+            if key.lower() == name.lower():
+                return value
+        return default
+
+    def get_text_body(self):
+        """Returns the body as text, and if it needed to be base64 encoded
+        to be so."""
+        try:
+            return self.body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            return base64.b64encode(self.body).decode('ascii'), True
+
+
+class Route(object):
+    """``method`` of the resource ``path`` of ``api``. Parameters of the
+    path (``/shop/{item}``) match any segment, and greedy ones
+    (``/{proxy+}``) any number of them."""
+
+    def __init__(self, api, path, method, settings):
+        self.path = api.normalize_path(path)
+        self.method = method.upper()
+        self.settings = settings
+        self.integration = settings.get('integration', {})
+        self.integration_type = api.get_integration_type(settings)
+        self.lambda_name = self.integration.get('lambda')
+        self.parameters = []
+
+        segments = []
+        for segment in self.path.split('/')[1:]:
+            match = re.match(r'^\{(.+?)(\+?)\}$', segment)
+            if match:
+                self.parameters.append(match.group(1))
+                segments.append('(.+)' if match.group(2) else '([^/]+)')
+            else:
+                segments.append(re.escape(segment))
+        self.regex = re.compile('^/{}$'.format('/'.join(segments)))
+
+        # Literal paths are more specific than parametrized ones, and these
+        # more than greedy ones. Methods are more specific than ANY.
+        self.priority = (self.path.count('+}'), len(self.parameters), -self.path.count('/'), self.method == 'ANY')
+
+    def match(self, path):
+        """Returns the values of the parameters of this route in ``path``,
+        or ``None`` if it doesn't match it."""
+        match = self.regex.match(path)
+        if match:
+            return dict(zip(self.parameters, match.groups()))
+        return None
+
+
+class ApiGatewayEmulator(object):
+    """Emulates ``api`` (an ``ApiGateway`` resource). ``lambdas`` maps the
+    name (``app.lambda``) of each lambda the api integrates with to its
+    resource. Each lambda gets a pool of up to ``concurrency`` warm workers,
+    so concurrent requests don't need to start a new process each."""
+
+    def __init__(self, api, lambdas, stage='dev', concurrency=1, stderr=None):
+        self.api = api
+        self.stage = stage
+        self.routes = sorted(
+            (Route(api, path, method, settings) for path, method, settings in api.get_methods()),
+            key=lambda route: route.priority
+        )
+        self.pools = dict(
+            (name, workers.WorkerPool(lambda_, size=concurrency, stderr=stderr))
+            for name, lambda_ in six.iteritems(lambdas)
+        )
+
+    def resolve(self, method, path):
+        """Returns the route of the most specific resource matching ``path``
+        which accepts ``method``, and the values of its path parameters."""
+        path = self.api.normalize_path(path)
+        for route in self.routes:
+            parameters = route.match(path)
+            if parameters is not None:
+                break
+        else:
+            return None, None
+
+        for candidate in self.routes:
+            if candidate.path == route.path and candidate.method in (method, 'ANY'):
+                return candidate, parameters
+        return None, None
+
+    def handle(self, request):
+        """Returns the ``Response`` of the api to ``request``. If a lambda
+        was invoked, its ``result`` is part of the response."""
+        route, parameters = self.resolve(request.method, request.path)
+        if route is None:
+            return json_response(403, {'message': 'Missing Authentication Token'})
+
+        handler = {
+            'AWS_PROXY': self._invoke_proxy,
+            'AWS': self._invoke,
+            'HTTP': self._forward,
+            'MOCK': self._mock,
+        }[route.integration_type]
+        try:
+            return handler(route, request, parameters)
+        except exceptions.LambdaWorkerError:
+            return json_response(502, {'message': 'Internal server error'})
+        except exceptions.BaseGordonException as exc:
+            return json_response(500, {'message': exc.get_hint()})
+
+    def _get_context(self, route, request):
+        return {
+            'resourcePath': route.path,
+            'httpMethod': request.method,
+            'path': '/{}{}'.format(self.stage, request.path),
+            'stage': self.stage,
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(time.time() * 1000),
+            'identity': {'sourceIp': request.source_ip},
+        }
+
+    def _get_params(self, request, parameters):
+        return {
+            'path': parameters,
+            'querystring': dict(request.query),
+            'header': dict(request.headers),
+        }
+
+    def _render_request(self, route, request, parameters):
+        """Returns the body of the integration request: the body of
+        ``request`` rendered using the request template of its content type,
+        or as it is if there is none."""
+        body, _ = request.get_text_body()
+        templates = self.api.get_request_templates(route.settings)
+        content_type = request.get_header('Content-Type', JSON_CONTENT_TYPE).split(';')[0].strip()
+        if content_type in templates:
+            return render_template(
+                templates[content_type],
+                body,
+                params=self._get_params(request, parameters),
+                context=self._get_context(route, request)
+            )
+        return body
+
+    def _integration_response(self, route, request, response, body, headers=None, result=None):
+        """Returns the method response for the integration ``response``
+        selected for the integration ``body``."""
+        if response is None:
+            return json_response(500, {'message': 'Internal server error'}, result)
+
+        templates = response.get('template') or {}
+        content_type = JSON_CONTENT_TYPE if JSON_CONTENT_TYPE in templates or not templates else sorted(templates)[0]
+        output = body
+        if content_type in templates:
+            output = render_template(templates[content_type], body, context=self._get_context(route, request))
+
+        response_headers = {'Content-Type': content_type}
+        for destination, source in six.iteritems(response.get('parameters') or {}):
+            if not destination.startswith('method.response.header.'):
+                continue
+            if source.startswith("'") and source.endswith("'"):
+                value = source[1:-1]
+            elif source.startswith('integration.response.header.'):
+                value = (headers or {}).get(source[len('integration.response.header.'):])
+            elif source.startswith('integration.response.body'):
+                value = json_path(load_json(body), '$' + source[len('integration.response.body'):])
+                if value is not None and not isinstance(value, six.string_types):
+                    value = json.dumps(value)
+            else:
+                value = None
+            if value is not None:
+                response_headers[destination[len('method.response.header.'):]] = value
+
+        return Response(int(response['code']), response_headers, output.encode('utf-8'), result)
+
+    def _invoke_proxy(self, route, request, parameters):
+        body, is_base64_encoded = request.get_text_body()
+        multi_value_query = {}
+        for name, value in request.query:
+            multi_value_query.setdefault(name, []).append(value)
+
+        result = self.pools[route.lambda_name].invoke({
+            'resource': route.path,
+            'path': request.path,
+            'httpMethod': request.method,
+            'headers': dict(request.headers) or None,
+            'queryStringParameters': dict(request.query) or None,
+            'multiValueQueryStringParameters': multi_value_query or None,
+            'pathParameters': parameters or None,
+            'stageVariables': None,
+            'requestContext': self._get_context(route, request),
+            'body': body or None,
+            'isBase64Encoded': is_base64_encoded,
+        })
+
+        # Lambdas behind proxy integrations need to return the status code,
+        # headers and body of the response.
+        output = result.get('output')
+        if 'error' in result or not isinstance(output, dict) or \
+                not isinstance(output.get('body') or '', six.string_types):
+            return json_response(502, {'message': 'Internal server error'}, result)
+
+        headers = dict((k, six.text_type(v)) for k, v in six.iteritems(output.get('headers') or {}))
+        for name, values in six.iteritems(output.get('multiValueHeaders') or {}):
+            headers[name] = ', '.join(six.text_type(v) for v in values)
+        body = output.get('body') or ''
+        body = base64.b64decode(body) if output.get('isBase64Encoded') else body.encode('utf-8')
+        return Response(int(output.get('statusCode', 200)), headers, body, result)
+
+    def _invoke(self, route, request, parameters):
+        body = self._render_request(route, request, parameters)
+        event = load_json(body.strip())
+        if event is None and body.strip():
+            return json_response(400, {'message': 'Could not parse request body into json'})
+
+        result = self.pools[route.lambda_name].invoke(event)
+        if 'error' in result:
+            error_type, _, message = result['error'].partition(': ')
+            output, selector = {'errorMessage': message, 'errorType': error_type}, message
+        else:
+            output, selector = result.get('output'), None
+        response = select_response(route.integration.get('responses'), selector)
+        return self._integration_response(route, request, response, json.dumps(output), result=result)
+
+    def _forward(self, route, request, parameters):
+        params = self._get_params(request, parameters)
+        uri, query, headers = route.integration['uri'], [], {}
+        for destination, source in six.iteritems(route.integration.get('parameters') or {}):
+            if source.startswith("'") and source.endswith("'"):
+                value = source[1:-1]
+            else:
+                _, _, location, name = source.split('.', 3)
+                value = params.get(location, {}).get(name)
+            _, _, location, name = destination.split('.', 3)
+            if value is None:
+                continue
+            elif location == 'path':
+                uri = uri.replace('{%s}' % name, value)
+            elif location == 'querystring':
+                query.append((name, value))
+            elif location == 'header':
+                headers[name] = value
+        if query:
+            uri = '{}{}{}'.format(uri, '&' if '?' in uri else '?', urlencode(query))
+
+        body = self._render_request(route, request, parameters)
+        http_request = Request(uri, data=body.encode('utf-8') if body else None, headers=headers)
+        http_request.get_method = lambda: self.api.get_integration_http_method(route.settings)
+        try:
+            http_response = urlopen(http_request, timeout=INTEGRATION_TIMEOUT)
+        except HTTPError as exc:
+            http_response = exc
+        except (URLError, IOError):
+            return json_response(502, {'message': 'Internal server error'})
+
+        status, headers = http_response.getcode(), dict(http_response.info().items())
+        body = http_response.read().decode('utf-8', 'replace')
+        response = select_response(route.integration.get('responses'), six.text_type(status))
+        return self._integration_response(route, request, response, body, headers=headers)
+
+    def _mock(self, route, request, parameters):
+        # Mock integrations select their response using the status code of
+        # their request template.
+        template = load_json(self._render_request(route, request, parameters).strip())
+        status = template.get('statusCode', 200) if isinstance(template, dict) else 200
+        response = select_response(route.integration.get('responses'), six.text_type(status))
+        return self._integration_response(route, request, response, '')
+
+    def reload(self):
+        """Collect the code of all lambdas of the api."""
+        for pool in self.pools.values():
+            pool.reload()
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+
+class ApiGatewayRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Respond to each request with the response of the emulator of the
+    server."""
+
+    def handle_request(self):
+        start = time.time()
+        request = ApiRequest(
+            self.command,
+            self.path,
+            headers=dict(self.headers.items()),
+            body=self.rfile.read(int(self.headers.get('Content-Length') or 0)),
+            source_ip=self.client_address[0]
+        )
+        response = self.server.emulator.handle(request)
+
+        self.send_response(response.status)
+        for name, value in sorted(six.iteritems(response.headers)):
+            if name.lower() != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response.body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(response.body)
+
+        if self.server.log:
+            self.server.log(request, response, round((time.time() - start) * 1000, 3))
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ApiGatewayServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Handles each request in its own thread, so requests to different
+    lambdas (or to the same one, up to the size of its pool) are processed
+    concurrently."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, emulator, log=None):
+        self.emulator = emulator
+        self.log = log
+        BaseHTTPServer.HTTPServer.__init__(self, address, ApiGatewayRequestHandler)
+
+
+class StreamEmulator(object):
+    """Replays records into the lambda of ``stream`` (a ``BaseStream``
+    resource), distributed across ``shards`` by the hash of their partition
+    key, in batches of up to ``get_batch_size()`` records. Each shard has
+    its own warm worker of ``lambda_``."""
+
+    event_source = ''
+
+    def __init__(self, stream, lambda_, shards=1, partition_key=None, region='us-east-1', stderr=None):
+        self.stream = stream
+        self.lambda_ = lambda_
+        self.shards = shards
+        self.partition_key = partition_key
+        self.region = region
+        self.stderr = stderr
+        self.batch_size = stream.get_batch_size()
+        self.arn = stream.settings['stream']
+        if not isinstance(self.arn, six.string_types):
+            self.arn = 'arn:aws:{}:{}:000000000000:{}'.format(self.event_source, region, stream.name)
+
+    def get_shard_id(self, index):
+        return 'shardId-{:012d}'.format(index)
+
+    def get_shard(self, partition_key):
+        """Returns the index of the shard ``partition_key`` belongs to.
+        Shards split the range of md5 hashes evenly."""
+        digest = hashlib.md5(six.text_type(partition_key).encode('utf-8')).hexdigest()
+        return int(digest, 16) * self.shards >> 128
+
+    def get_partition_key(self, data, index):
+        """Returns the value of the ``partition_key`` field of ``data``, or
+        ``index`` if there is none."""
+        if self.partition_key and isinstance(data, dict) and self.partition_key in data:
+            return data[self.partition_key]
+        return index
+
+    def create_record(self, data, partition_key, shard, sequence):
+        raise NotImplementedError()
+
+    def get_batches(self, records):
+        """Returns the batches of each shard of ``records``. Each line of
+        ``records`` is the data of one record, or a whole record previously
+        captured from a stream."""
+        sequences = [0] * self.shards
+        shards = [[] for _ in range(self.shards)]
+        for index, data in enumerate(records):
+            partition_key = self.get_partition_key(data, index)
+            shard = self.get_shard(partition_key)
+            sequences[shard] += 1
+            shards[shard].append(self.create_record(data, partition_key, shard, sequences[shard]))
+
+        batches = []
+        for shard, shard_records in enumerate(shards):
+            shard_batches, batch, size = [], [], 0
+            for record in shard_records:
+                record_size = len(json.dumps(record))
+                if batch and (len(batch) >= self.batch_size or size + record_size > MAX_BATCH_PAYLOAD):
+                    shard_batches.append(batch)
+                    batch, size = [], 0
+                batch.append(record)
+                size += record_size
+            if batch:
+                shard_batches.append(batch)
+            batches.append(shard_batches)
+        return batches
+
+    def replay(self, records):
+        """Invoke the lambda with the batches of ``records`` and return a
+        report with the throughput, the distribution of batch sizes and
+        latencies (of warm invocations) and the cold start of each shard.
+
+        Failed batches are reported but, unlike AWS, not retried."""
+        batches = self.get_batches(records)
+        pool = workers.WorkerPool(self.lambda_, size=self.shards, stderr=self.stderr)
+        pool.reload()
+        reports = [
+            {'shard': self.get_shard_id(shard), 'batches': 0, 'records': 0, 'errors': 0, 'warm': []}
+            for shard in range(self.shards)
+        ]
+        failures = []
+
+        def run(report, shard_batches):
+            try:
+                for batch in shard_batches:
+                    result = pool.invoke({'Records': batch})
+                    if result['cold']:
+                        report['cold_start'] = result['latency']
+                    else:
+                        report['warm'].append(result['latency'])
+                    report['batches'] += 1
+                    report['records'] += len(batch)
+                    report['errors'] += 'error' in result
+            except Exception as exc:
+                failures.append(exc)
+
+        threads = [threading.Thread(target=run, args=args) for args in zip(reports, batches)]
+        start = time.time()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            pool.close()
+        wall = time.time() - start
+        if failures:
+            raise failures[0]
+
+        warm = [latency for report in reports for latency in report.pop('warm')]
+        total = sum(r['records'] for r in reports)
+        return {
+            'stream': self.stream.in_project_name,
+            'lambda': self.lambda_.name,
+            'batch_size': self.batch_size,
+            'shards': self.shards,
+            'records': total,
+            'batches': sum(r['batches'] for r in reports),
+            'errors': sum(r['errors'] for r in reports),
+            'wall': round(wall, 3),
+            'throughput': round(total / wall, 3) if wall else None,
+            'batch_sizes': workers.summarize([len(batch) for shard_batches in batches for batch in shard_batches]),
+            'cold_start': workers.summarize([r['cold_start'] for r in reports if 'cold_start' in r]),
+            'latency': workers.summarize(warm),
+            'shard_reports': [r for r in reports if r['batches']],
+        }
+
+
+class KinesisStreamEmulator(StreamEmulator):
+    """Kinesis records carry their data base64 encoded. Strings are sent as
+    they are and everything else as json."""
+
+    event_source = 'kinesis'
+
+    # Sequence numbers of kinesis records are 56 digits long.
+    SEQUENCE_NUMBER_BASE = 49590338271490256608559692538361571095921575989136588800
+
+    def get_partition_key(self, data, index):
+        if isinstance(data, dict) and 'kinesis' in data:
+            return data['kinesis'].get('partitionKey', index)
+        return super(KinesisStreamEmulator, self).get_partition_key(data, index)
+
+    def create_record(self, data, partition_key, shard, sequence):
+        if isinstance(data, dict) and 'kinesis' in data:
+            return data
+        if not isinstance(data, six.string_types):
+            data = json.dumps(data)
+        sequence_number = six.text_type(self.SEQUENCE_NUMBER_BASE + sequence)
+        return {
+            'kinesis': {
+                'kinesisSchemaVersion': '1.0',
+                'partitionKey': six.text_type(partition_key),
+                'sequenceNumber': sequence_number,
+                'data': base64.b64encode(data.encode('utf-8')).decode('ascii'),
+                'approximateArrivalTimestamp': round(time.time(), 3),
+            },
+            'eventSource': 'aws:kinesis',
+            'eventVersion': '1.0',
+            'eventID': '{}:{}'.format(self.get_shard_id(shard), sequence_number),
+            'eventName': 'aws:kinesis:record',
+            'invokeIdentityArn': 'arn:aws:iam::000000000000:role/{}'.format(self.lambda_.name),
+            'awsRegion': self.region,
+            'eventSourceARN': self.arn,
+        }
+
+
+class DynamodbStreamEmulator(StreamEmulator):
+    """Each record is the ``INSERT`` of an item (converted to the DynamoDB
+    json format) whose key is its ``partition_key`` field."""
+
+    event_source = 'dynamodb'
+
+    SEQUENCE_NUMBER_BASE = 100000000000000000000
+
+    def get_partition_key(self, data, index):
+        if isinstance(data, dict) and 'dynamodb' in data:
+            return json.dumps(data['dynamodb'].get('Keys'), sort_keys=True)
+        return super(DynamodbStreamEmulator, self).get_partition_key(data, index)
+
+    def create_record(self, data, partition_key, shard, sequence):
+        if isinstance(data, dict) and 'dynamodb' in data:
+            return data
+        serializer = TypeSerializer()
+
+        def serialize(value):
+            # DynamoDB numbers are decimals.
+            if isinstance(value, float):
+                return serializer.serialize(Decimal(repr(value)))
+            if isinstance(value, dict):
+                return {'M': dict((k, serialize(v)) for k, v in six.iteritems(value))}
+            if isinstance(value, list):
+                return {'L': [serialize(v) for v in value]}
+            return serializer.serialize(value)
+
+        image = serialize(data)['M'] if isinstance(data, dict) else {}
+        keys = dict((k, v) for k, v in six.iteritems(image) if k == self.partition_key)
+        return {
+            'eventID': uuid.uuid4().hex,
+            'eventVersion': '1.1',
+            'dynamodb': {
+                'ApproximateCreationDateTime': int(time.time()),
+                'Keys': keys,
+                'NewImage': image,
+                'SequenceNumber': six.text_type(self.SEQUENCE_NUMBER_BASE + sequence),
+                'SizeBytes': len(json.dumps(image)),
+                'StreamViewType': 'NEW_AND_OLD_IMAGES',
+            },
+            'awsRegion': self.region,
+            'eventName': 'INSERT',
+            'eventSourceARN': self.arn,
+            'eventSource': 'aws:dynamodb',
+        }
+
+
+STREAM_EMULATORS = {
+    'kinesis': KinesisStreamEmulator,
+    'dynamodb': DynamodbStreamEmulator,
+}
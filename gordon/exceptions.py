@@ -174,3 +174,55 @@ class LambdaNotFound(BaseGordonException):
 class ValidationError(BaseGordonException):
     hint = u"  Validation Error: {}"
     code = 24
+
+
+class LambdaPrecompileError(BaseGordonException):
+    hint = u"Lambda {} runtime is {}, but '{}' is python {}. Use 'precompile-python' to define a python {} interpreter."
+    code = 25
+
+
+class LambdaBatchNotSupportedError(BaseGordonException):
+    hint = u"Lambda {} can't be invoked in batch mode. {} doesn't support it."
+    code = 26
+
+
+class LambdaWorkerError(BaseGordonException):
+    hint = u"Worker of lambda {} exited unexpectedly (exit code {})."
+    code = 27
+
+
+class NoEventsError(BaseGordonException):
+    hint = u"No events found in {}. Use .json files with one event, or .ndjson files with one event per line."
+    code = 28
+
+
+class ApiGatewayNotFoundError(BaseGordonException):
+    hint = u"Api gateway {} can't be found. Available apis: {}"
+    code = 29
+
+
+class UnsupportedMappingTemplateError(BaseGordonException):
+    hint = u"Mapping template directive {} is not supported locally."
+    code = 30
+
+
+class StreamNotFoundError(BaseGordonException):
+    hint = (u"Stream {} can't be found. Use the format kinesis:APP:NAME or dynamodb:APP:NAME "
+            u"(APP is empty for project streams).")
+    code = 31
+
+
+class LambdaMemoryLimitNotSupportedError(BaseGordonException):
+    hint = u"Memory of lambda {} can't be enforced. Runtime {} doesn't support it on {}."
+    code = 32
+
+
+class ActionsFailedError(BaseGordonException):
+
+    code = 33
+
+    def get_hint(self):
+        return u"{} actions failed:\n{}".format(
+            len(self.args[0]),
+            u"\n".join(u"  {}: {}".format(name, error) for name, error in self.args[0])
+        )
@@ -1,5 +1,5 @@
 // Mock LambdaContext event
-function LambdaContext(functionName, memoryLimitInMB, timeout){
+function LambdaContext(functionName, memoryLimitInMB, timeout, done){
     this.functionName = functionName;
     this.memoryLimitInMB = memoryLimitInMB;
     this.timeout = timeout;
@@ -11,6 +11,13 @@ function LambdaContext(functionName, memoryLimitInMB, timeout){
     this.identity = null;
     this.clientContext = null;
     this.invokedFunctionArn = 'invoked_function_arn';
+    this.done = done || function(error, output) {
+        if (error) {
+            console.log("fail: " + error);
+        } else {
+            console.log("output: " + output);
+        }
+    };
 
     var date = new Date();
     this.startTime = date.getTime();
@@ -22,11 +29,11 @@ LambdaContext.prototype.getRemainingTimeInMillis = function() {
 }
 
 LambdaContext.prototype.succeed = function(message) {
-    console.log("output: " + message);
+    this.done(null, message);
 }
 
 LambdaContext.prototype.fail = function(error) {
-    console.log("fail: " + error);
+    this.done(error);
 }
 
 // This language needs more love
@@ -35,28 +42,217 @@ String.prototype.rsplit = function(sep, maxsplit) {
     return maxsplit ? [ split.slice(0, -maxsplit).join(sep) ].concat(split.slice(-maxsplit)) : split;
 }
 
-// Capture stdin before converting it into json
-var stdin = process.stdin,
-    stdout = process.stdout,
-    inputChunks = [];
+var handler = process.argv[2],
+    name = process.argv[3],
+    memory = process.argv[4],
+    timeout = process.argv[5],
+    options = process.argv.slice(6);
 
-stdin.resume();
-stdin.setEncoding('utf8');
-
-stdin.on('data', function (chunk) {
-    inputChunks.push(chunk);
-});
+// Returns the value of the ``--name=value`` option passed to the loader.
+function getOption(name, defaultValue) {
+    var prefix = '--' + name + '=';
+    for (var i = 0; i < options.length; i++) {
+        if (options[i].indexOf(prefix) === 0) {
+            return options[i].slice(prefix.length);
+        }
+    }
+    return defaultValue;
+}
 
-// Once the stdin has finished, process it as JSON, load the
-// the user module and invoque it.
-stdin.on('end', function () {
+// Lambda bills the duration of invocations rounded up to this many ms.
+var billingGranularity = parseInt(getOption('billing-granularity', 1), 10);
 
-    var inputJSON = inputChunks.join(),
-        eventData = JSON.parse(inputJSON),
-        handler_elements = process.argv[2].rsplit('.', 1),
-        context = new LambdaContext(process.argv[4], process.argv[5], process.argv[6]),
+function loadHandler() {
+    var handler_elements = handler.rsplit('.', 1),
         module = require('./' + handler_elements[0] + '.js');
+    return module[handler_elements[1]];
+}
+
+function elapsed(since) {
+    var diff = process.hrtime(since);
+    return Math.round((diff[0] * 1e3 + diff[1] / 1e6) * 1000) / 1000;
+}
+
+// Returns the ``REPORT`` line Lambda logs after each invocation.
+function formatReport(requestId, result) {
+    var report = [
+        'REPORT RequestId: ' + requestId,
+        'Duration: ' + result.duration.toFixed(2) + ' ms',
+        'Billed Duration: ' + result.billed_duration + ' ms',
+        'Memory Size: ' + memory + ' MB'
+    ];
+    if (result.max_rss) {
+        report.push('Max Memory Used: ' + Math.ceil(result.max_rss / 1024 / 1024) + ' MB');
+    }
+    if (result.init_duration !== undefined) {
+        report.push('Init Duration: ' + result.init_duration.toFixed(2) + ' ms');
+    }
+    return report.join('\t');
+}
+
+// Invoke ``fn`` with ``eventData`` and call ``done`` once with the result of
+// the invocation: its output (or error), duration and peak memory. The
+// handler can finish using the context, the callback, or the promise it
+// returns. If it takes longer than ``timeout``, the result is a timeout
+// error, and the process exits once ``done`` has been called, the same way
+// Lambda stops the runtime.
+var maxRss = 0;
+
+function invoke(fn, eventData, done) {
+    var finished = false,
+        started = process.hrtime(),
+        context,
+        timer,
+        result;
+
+    var finish = function(error, output, timedOut) {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        clearTimeout(timer);
+
+        var result = {};
+        if (error) {
+            result.error = error instanceof Error ? error.name + ': ' + error.message : String(error);
+        } else {
+            result.output = output === undefined ? null : output;
+        }
+        if (timedOut) {
+            result.timed_out = true;
+        }
+        result.duration = elapsed(started);
+        // Timed out invocations are billed up to the timeout.
+        result.billed_duration = Math.max(Math.ceil((timedOut ? timeout * 1000 : result.duration) / billingGranularity), 1) * billingGranularity;
+        maxRss = Math.max(maxRss, process.memoryUsage().rss);
+        result.max_rss = maxRss;
+        done(result, context.awsRequestId);
+        if (timedOut) {
+            process.exit(1);
+        }
+    };
+
+    context = new LambdaContext(name, memory, timeout, finish);
+    context.awsRequestId = require('crypto').randomBytes(16).toString('hex');
+    timer = setTimeout(function() {
+        finish('Task timed out after ' + parseFloat(timeout).toFixed(2) + ' seconds', null, true);
+    }, timeout * 1000);
+
+    try {
+        result = fn(eventData, context, finish);
+    } catch (error) {
+        console.error(error.stack || error);
+        return finish(error);
+    }
+    if (result && typeof result.then === 'function') {
+        result.then(function(output) { finish(null, output); }, finish);
+    }
+}
 
-    module[handler_elements[1]](eventData, context);
+// Invoke the handler once per line of stdin, each one of them a json event,
+// and write one json line per invocation into stdout with its output (or
+// error), duration and billed duration in ms, and the peak memory of the
+// process. The first line also contains how long it took to require the
+// handler (``init_duration``). Anything the handler logs is sent to stderr,
+// so it doesn't get mixed with the results, followed by the ``REPORT`` line
+// of each invocation.
+function batch() {
+    var fs = require('fs'),
+        readline = require('readline'),
+        queue = [],
+        busy = false,
+        closed = false;
 
-});
+    console.log = console.info = console.error;
+
+    var start = process.hrtime(),
+        fn = loadHandler(),
+        initDuration = elapsed(start);
+
+    function next() {
+        if (busy) {
+            return;
+        }
+        if (!queue.length) {
+            if (closed) {
+                process.exit(0);
+            }
+            return;
+        }
+        busy = true;
+        var line = queue.shift();
+
+        var done = function(result, requestId) {
+            if (initDuration !== null) {
+                result.init_duration = initDuration;
+                initDuration = null;
+            }
+            console.error(formatReport(requestId, result));
+            fs.writeSync(1, JSON.stringify(result) + '\n');
+            busy = false;
+            setImmediate(next);
+        };
+
+        var eventData;
+        try {
+            eventData = JSON.parse(line);
+        } catch (error) {
+            eventData = error;
+        }
+        if (eventData instanceof Error) {
+            invoke(function() { throw eventData; }, null, done);
+        } else {
+            invoke(fn, eventData, done);
+        }
+    }
+
+    var lines = readline.createInterface({input: process.stdin, terminal: false});
+    lines.on('line', function(line) {
+        if (line.trim()) {
+            queue.push(line);
+            next();
+        }
+    });
+    lines.on('close', function() {
+        closed = true;
+        next();
+    });
+}
+
+function main() {
+    var stdin = process.stdin,
+        inputChunks = [];
+
+    stdin.resume();
+    stdin.setEncoding('utf8');
+
+    stdin.on('data', function (chunk) {
+        inputChunks.push(chunk);
+    });
+
+    // Once the stdin has finished, process it as JSON, load the
+    // the user module and invoque it.
+    stdin.on('end', function () {
+        var eventData = JSON.parse(inputChunks.join('')),
+            start = process.hrtime(),
+            fn = loadHandler(),
+            initDuration = elapsed(start);
+
+        invoke(fn, eventData, function(result, requestId) {
+            result.init_duration = initDuration;
+            if (result.error) {
+                console.log(result.timed_out ? result.error : "fail: " + result.error);
+            } else {
+                console.log("output: " + result.output);
+            }
+            console.log(formatReport(requestId, result));
+            process.exitCode = result.error ? 1 : 0;
+        });
+    });
+}
+
+if (options.indexOf('--batch') !== -1) {
+    batch();
+} else {
+    main();
+}
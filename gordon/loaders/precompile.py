@@ -0,0 +1,70 @@
+"""Compile all python files within a directory into the bytecode files the
+running interpreter would load (``.pyc`` next to the source in python 2 and
+``__pycache__`` in python 3).
+
+Gordon runs this script using the interpreter of the runtime of the lambda.
+Bytecode files reference the timestamp gordon assigns to every file of a
+lambda .zip file, and the path where the runtime extracts them, so the
+output is deterministic and valid once deployed.
+
+Usage: python precompile.py <path> <prefix>
+"""
+import os
+import sys
+import struct
+import marshal
+
+# 1980-01-01 00:00:00 UTC. Timestamp of every file in gordon's zip files.
+SOURCE_MTIME = 315532800
+
+
+def get_bytecode_path(path):
+    if sys.version_info[0] == 2:
+        return path + 'c'
+    import importlib.util
+    return importlib.util.cache_from_source(path)
+
+
+def get_header(source_size):
+    if sys.version_info[0] == 2:
+        import imp
+        return imp.get_magic() + struct.pack('<I', SOURCE_MTIME)
+    import importlib.util
+    if sys.version_info >= (3, 7):
+        return importlib.util.MAGIC_NUMBER + struct.pack('<III', 0, SOURCE_MTIME, source_size & 0xFFFFFFFF)
+    return importlib.util.MAGIC_NUMBER + struct.pack('<II', SOURCE_MTIME, source_size & 0xFFFFFFFF)
+
+
+def main(root, prefix):
+    compiled = 0
+    for basedir, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith('.py'):
+                continue
+            path = os.path.join(basedir, name)
+            with open(path, 'rb') as f:
+                source = f.read()
+            try:
+                code = compile(source, prefix + os.path.relpath(path, root).replace(os.sep, '/'), 'exec', 0, True)
+            except SyntaxError:
+                # Same as compileall, files which can't be compiled by this
+                # interpreter are left alone.
+                continue
+
+            bytecode_path = get_bytecode_path(path)
+            if not os.path.isdir(os.path.dirname(bytecode_path)):
+                os.makedirs(os.path.dirname(bytecode_path))
+            # Never write in place, this file could be a hardlink.
+            if os.path.exists(bytecode_path):
+                os.remove(bytecode_path)
+            with open(bytecode_path, 'wb') as f:
+                f.write(get_header(len(source)))
+                f.write(marshal.dumps(code))
+            compiled += 1
+
+    sys.stdout.write("{}.{} {}\n".format(sys.version_info[0], sys.version_info[1], compiled))
+
+
+if __name__ == '__main__':
+    main(root=sys.argv[1], prefix=sys.argv[2])
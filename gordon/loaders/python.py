@@ -1,9 +1,20 @@
+import os
 import sys
+import math
 import time
 import json
 import uuid
+import threading
+import traceback
 import importlib
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OUT_OF_MEMORY_ERROR = 'Runtime exited with error: out of memory (exceeded the limit of {} MB)'
+
 
 class LambdaContext(object):
 
@@ -22,27 +33,215 @@ class LambdaContext(object):
         self.start_time = time.time() * 1000
 
     def get_remaining_time_in_millis(self):
-        return max(self.timeout * 1000 - int((time.time() * 1000) - self.start_time), 0)
+        return max(int(self.timeout) * 1000 - int((time.time() * 1000) - self.start_time), 0)
 
 
-def main(handler, name, memory, timeout):
+def load_handler(handler):
     sys.path.insert(0, '.')
     module_name, handler_name = handler.rsplit('.', 1)
     module = importlib.import_module(module_name)
-    out = getattr(module, handler_name)(
-        json.loads(sys.stdin.read()),
-        LambdaContext(
+    return getattr(module, handler_name)
+
+
+def get_max_rss():
+    """Returns the peak resident memory of this process in bytes."""
+    if not resource:
+        return None
+    # ru_maxrss is reported in bytes in OSX, and KB everywhere else.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def limit_memory(memory):
+    """Limit the address space of this process to ``memory`` MB, so
+    allocations beyond it raise ``MemoryError``. The address space of a
+    process is larger than the memory it actually uses, so this limit is
+    slightly stricter than Lambda's."""
+    limit = int(memory) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def get_billed_duration(duration, granularity):
+    """Returns ``duration`` rounded up to the ``granularity`` (in ms) Lambda
+    bills invocations in."""
+    return max(int(math.ceil(duration / granularity)), 1) * granularity
+
+
+def format_report(request_id, result, memory):
+    """Returns the ``REPORT`` line Lambda logs after each invocation."""
+    report = [
+        'REPORT RequestId: {}'.format(request_id),
+        'Duration: {:.2f} ms'.format(result['duration']),
+        'Billed Duration: {} ms'.format(result['billed_duration']),
+        'Memory Size: {} MB'.format(memory),
+    ]
+    if result.get('max_rss'):
+        report.append('Max Memory Used: {} MB'.format(int(math.ceil(result['max_rss'] / 1024.0 / 1024))))
+    if result.get('init_duration') is not None:
+        report.append('Init Duration: {:.2f} ms'.format(result['init_duration']))
+    return '\t'.join(report)
+
+
+def invoke(function, context, on_exit, enforce_memory=False, billing_granularity=1):
+    """Call ``function`` and return the result of the invocation, with its
+    ``output`` (or ``error``), duration, billed duration (rounded up to
+    ``billing_granularity`` ms) and peak memory.
+
+    If ``function`` takes longer than the timeout of ``context`` (or, if
+    ``enforce_memory``, runs out of memory), the result of the invocation is
+    a timeout (or out of memory) error, which is passed to ``on_exit``
+    before this process exits, the same way Lambda stops the runtime."""
+    lock = threading.Lock()
+    finished = threading.Event()
+    start = time.time()
+
+    def timeout():
+        # The lock is held until the process exits, so the invocation can't
+        # report its own result after the timeout has reported it.
+        lock.acquire()
+        if finished.is_set():
+            # The invocation finished while this timer was firing.
+            lock.release()
+            return
+        finished.set()
+        duration = (time.time() - start) * 1000
+        # Timed out invocations are billed up to the timeout.
+        on_exit({
+            'error': 'Task timed out after {:.2f} seconds'.format(float(context.timeout)),
+            'timed_out': True,
+            'duration': round(duration, 3),
+            'billed_duration': get_billed_duration(float(context.timeout) * 1000, billing_granularity),
+            'max_rss': get_max_rss(),
+        })
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+    timer = threading.Timer(float(context.timeout), timeout)
+    timer.daemon = True
+    timer.start()
+
+    result = {}
+    try:
+        result['output'] = function()
+    except MemoryError:
+        if not enforce_memory:
+            raise
+        result['out_of_memory'] = True
+    except Exception as exc:
+        traceback.print_exc()
+        result['error'] = '{}: {}'.format(exc.__class__.__name__, exc)
+    with lock:
+        finished.set()
+        timer.cancel()
+
+    duration = (time.time() - start) * 1000
+    result['duration'] = round(duration, 3)
+    result['billed_duration'] = get_billed_duration(duration, billing_granularity)
+    result['max_rss'] = get_max_rss()
+    if result.get('out_of_memory'):
+        result['error'] = OUT_OF_MEMORY_ERROR.format(context.memory_limit_in_mb)
+        on_exit(result)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+    return result
+
+
+def main(handler, name, memory, timeout, enforce_memory=False, billing_granularity=1):
+    if enforce_memory:
+        limit_memory(memory)
+
+    start = time.time()
+    function = load_handler(handler)
+    init_duration = (time.time() - start) * 1000
+
+    event = json.loads(sys.stdin.read())
+    context = LambdaContext(
+        function_name=name,
+        memory_limit_in_mb=memory,
+        timeout=timeout
+    )
+
+    def report(result):
+        result['init_duration'] = round(init_duration, 3)
+        if 'output' in result:
+            print("output: {}".format(result['output']))
+        elif result.get('timed_out') or result.get('out_of_memory'):
+            print(result['error'])
+        print(format_report(context.aws_request_id, result, memory))
+
+    result = invoke(
+        lambda: function(event, context),
+        context,
+        on_exit=report,
+        enforce_memory=enforce_memory,
+        billing_granularity=billing_granularity
+    )
+    report(result)
+    if 'error' in result:
+        sys.exit(1)
+
+
+def batch(handler, name, memory, timeout, enforce_memory=False, billing_granularity=1):
+    """Invoke the handler once per line of stdin, each one of them a json
+    event, and write one json line per invocation into stdout with its
+    output (or error), duration and billed duration in ms, and the peak
+    memory of the process. The first line also contains how long it took to
+    import the handler (``init_duration``). If an invocation times out (or
+    runs out of memory), its result is an error and the process exits.
+
+    Anything the handler prints is sent to stderr, so it doesn't get mixed
+    with the results, followed by the ``REPORT`` line of each invocation."""
+    results = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    if enforce_memory:
+        limit_memory(memory)
+
+    start = time.time()
+    function = load_handler(handler)
+    init_duration = [(time.time() - start) * 1000]
+
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        context = LambdaContext(
             function_name=name,
             memory_limit_in_mb=memory,
             timeout=timeout
         )
-    )
-    print("output: {}".format(out))
+
+        def write(result):
+            if init_duration:
+                result['init_duration'] = round(init_duration.pop(), 3)
+            print(format_report(context.aws_request_id, result, memory))
+            sys.stdout.flush()
+            results.write(json.dumps(result, default=str) + '\n')
+            results.flush()
+
+        write(invoke(
+            lambda: function(json.loads(line), context),
+            context,
+            on_exit=write,
+            enforce_memory=enforce_memory,
+            billing_granularity=billing_granularity
+        ))
+
+
+def get_option(options, name, default=None):
+    """Returns the value of the ``--name=value`` option in ``options``."""
+    prefix = '--{}='.format(name)
+    for option in options:
+        if option.startswith(prefix):
+            return option[len(prefix):]
+    return default
+
 
 if __name__ == '__main__':
-    main(
+    (batch if '--batch' in sys.argv[5:] else main)(
         handler=sys.argv[1],
         name=sys.argv[2],
         memory=sys.argv[3],
         timeout=sys.argv[4],
+        enforce_memory='--enforce-memory' in sys.argv[5:],
+        billing_granularity=int(get_option(sys.argv[5:], 'billing-granularity', 1)),
     )
@@ -0,0 +1,190 @@
+"""Lightweight profiler for gordon builds.
+
+Code wraps interesting phases with ``span``. Spans are no-ops unless a
+profiler has been enabled (``gordon build --profile``), in which case
+their wall time, CPU time and how much they raised the peak memory of the
+process get recorded. Once the build
+finishes, ``save`` writes a JSON report and a Chrome trace-event file which
+can be loaded in ``chrome://tracing`` or https://ui.perfetto.dev.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_profiler = None
+
+
+def _get_thread_cpu_time():
+    """Returns the CPU time consumed by the current thread, or by the whole
+    process if the platform doesn't support it."""
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+    if resource and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    return time.clock()
+
+
+def _get_children_cpu_time():
+    """Returns the CPU time consumed by all finished subprocesses."""
+    if not resource:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_peak_memory():
+    """Returns the peak resident memory of this process in bytes."""
+    if not resource:
+        return 0
+    # ru_maxrss is reported in bytes in OSX, and KB everywhere else.
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+class Profiler(object):
+    """Records spans of time. Spans can be recorded concurrently from
+    different threads."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    def _get_thread_id(self):
+        ident = threading.current_thread().ident
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads) + 1)
+
+    @contextlib.contextmanager
+    def span(self, name, category, args):
+        thread = self._get_thread_id()
+        start = time.time()
+        cpu, children_cpu, process_peak_memory = _get_thread_cpu_time(), _get_children_cpu_time(), _get_peak_memory()
+        try:
+            yield
+        finally:
+            # The peak memory is the high-water mark of the whole process, so
+            # each span records it and how much the span raised it, as the
+            # memory a span used by itself can't be measured.
+            end_process_peak_memory = _get_peak_memory()
+            span = {
+                'name': name,
+                'category': category,
+                'thread': thread,
+                'start': start - self.start,
+                'wall': time.time() - start,
+                'cpu': _get_thread_cpu_time() - cpu,
+                'children_cpu': _get_children_cpu_time() - children_cpu,
+                'process_peak_memory': end_process_peak_memory,
+                'peak_memory_increase': end_process_peak_memory - process_peak_memory,
+                'args': args,
+            }
+            with self._lock:
+                self.spans.append(span)
+
+    def get_report(self):
+        """Returns all recorded spans sorted by start time and a summary
+        of the time spent in each category."""
+        spans = sorted(self.spans, key=lambda s: (s['start'], -s['wall']))
+        summary = {}
+        for span in spans:
+            category = summary.setdefault(span['category'], {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+            category['count'] += 1
+            category['wall'] += span['wall']
+            category['cpu'] += span['cpu']
+        return {
+            'wall': time.time() - self.start,
+            'process_peak_memory': _get_peak_memory(),
+            'summary': summary,
+            'spans': spans,
+        }
+
+    def get_trace(self):
+        """Returns all recorded spans using the Chrome trace-event format."""
+        events = [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': thread,
+                'args': {'name': 'main' if thread == 1 else 'worker {}'.format(thread - 1)},
+            }
+            for thread in sorted(self._threads.values())
+        ]
+        for span in sorted(self.spans, key=lambda s: (s['start'], -s['wall'])):
+            args = dict(span['args'])
+            args.update({
+                'cpu_ms': round(span['cpu'] * 1000, 3),
+                'children_cpu_ms': round(span['children_cpu'] * 1000, 3),
+                'process_peak_memory': span['process_peak_memory'],
+                'peak_memory_increase': span['peak_memory_increase'],
+            })
+            events.append({
+                'name': span['name'],
+                'cat': span['category'],
+                'ph': 'X',
+                'ts': int(span['start'] * 1000000),
+                'dur': int(span['wall'] * 1000000),
+                'pid': os.getpid(),
+                'tid': span['thread'],
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def enable():
+    """Start recording spans."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    """Stop recording spans."""
+    global _profiler
+    _profiler = None
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+@contextlib.contextmanager
+def _null_span():
+    yield
+
+
+def span(name, category='build', **args):
+    """Context manager which records the execution of its block as
+    ``name`` if profiling is enabled."""
+    if _profiler is None:
+        return _null_span()
+    return _profiler.span(name, category, args)
+
+
+def get_trace_filename(filename):
+    """Returns the filename of the Chrome trace which goes together with
+    the report ``filename`` (``out.json`` -> ``out.trace.json``)."""
+    base, extension = os.path.splitext(filename)
+    return '{}.trace{}'.format(base, extension or '.json')
+
+
+def save(filename):
+    """Write the report of the current profiler into ``filename`` and its
+    Chrome trace into ``get_trace_filename(filename)``."""
+    with open(filename, 'w') as f:
+        f.write(json.dumps(_profiler.get_report(), indent=4, sort_keys=True))
+    with open(get_trace_filename(filename), 'w') as f:
+        f.write(json.dumps(_profiler.get_trace()))
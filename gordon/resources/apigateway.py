@@ -22,15 +22,17 @@ LAMBDA_PROXY_INTEGRATION = 50
 class ApiGateway(BaseResource):
 
     grn_type = 'apigateway'
+    # Each build names the deployment of the api after a random hash, so
+    # every apply deploys it again. Reusing its templates would prevent that.
+    reuse_fragments = False
 
     def __init__(self, *args, **kwargs):
         super(ApiGateway, self).__init__(*args, **kwargs)
         self._resources = {}
 
-    def get_or_create_resource(self, path, api, template):
-        """Returns the ID of the Resource ``path`` in ``api``.
-        If the resorce doesn't exits, create a new one and add it to
-        ``template``."""
+    @staticmethod
+    def normalize_path(path):
+        """Returns ``path`` with a leading slash and without trailing one."""
 
         # Add leading slash
         if path and path[0] != '/':
@@ -44,6 +46,15 @@ class ApiGateway(BaseResource):
         if not path:
             path = '/'
 
+        return path
+
+    def get_or_create_resource(self, path, api, template):
+        """Returns the ID of the Resource ``path`` in ``api``.
+        If the resorce doesn't exits, create a new one and add it to
+        ``template``."""
+
+        path = self.normalize_path(path)
+
         # Return API root resource if
         if path == '/':
             return troposphere.GetAtt(api, 'RootResourceId')
@@ -64,6 +75,25 @@ class ApiGateway(BaseResource):
         self._resources[path] = troposphere.Ref(resource)
         return self._resources[path]
 
+    def get_methods(self):
+        """Returns ``(path, method, configuration)`` of each method of each
+        resource of this api. ``methods`` can be a string, a list of methods
+        sharing the configuration of the resource, or a map of methods to
+        their own configuration."""
+        for path, resource in six.iteritems(self.settings.get('resources', {})):
+            methods = resource['methods']
+
+            if isinstance(methods, six.string_types):
+                methods = [methods]
+
+            if not isinstance(methods, dict):
+                method_properties = copy.deepcopy(resource)
+                method_properties.pop('methods', None)
+                methods = dict([[method, method_properties] for method in methods])
+
+            for method, configuration in six.iteritems(methods):
+                yield path, method, configuration
+
     def get_function_name(self, resource):
         """Returns a reference to the current alias of the lambda which will
         process this stream."""
@@ -91,7 +121,7 @@ class ApiGateway(BaseResource):
 
     def _get_integration_type(self, resource):
         if 'integration' not in resource:
-            raise exceptions.InvalidApigatewayIntegrationTypeError("Resource has no integration".format(resource))
+            raise exceptions.InvalidApigatewayIntegrationTypeError("Resource has no integration")
         if 'lambda' in resource['integration']:
             if 'type' in resource['integration'] and \
                     resource['integration']['type'] == 'AWS_PROXY':
@@ -248,40 +278,29 @@ class ApiGateway(BaseResource):
         deployment_resources.append(invoke_lambda_role)
 
         deployment_dependencies = []
-        for path, resource in six.iteritems(self.settings.get('resources', {})):
+        for path, method, configuration in self.get_methods():
             resource_reference = self.get_or_create_resource(path, api, template)
-            methods = resource['methods']
-
-            if isinstance(methods, six.string_types):
-                methods = [methods]
-
-            if not isinstance(methods, dict):
-                method_properties = copy.deepcopy(resource)
-                method_properties.pop('methods', None)
-                methods = dict([[method, method_properties] for method in methods])
+            method_name = [self.name]
+            method_name.extend(path.split('/'))
+            method_name.append(method)
 
-            for method, configuration in six.iteritems(methods):
-                method_name = [self.name]
-                method_name.extend(path.split('/'))
-                method_name.append(method)
-
-                extra = {}
-                if 'parameters' in configuration:
-                    extra['RequestParameters'] = configuration['parameters']
-                m = Method(
-                    utils.valid_cloudformation_name(*method_name),
-                    HttpMethod=method,
-                    AuthorizationType=self.get_authorization_type(configuration),
-                    ApiKeyRequired=self.get_api_key_required(configuration),
-                    Integration=self.get_integration(configuration, invoke_lambda_role),
-                    MethodResponses=self.get_method_responses(configuration),
-                    ResourceId=resource_reference,
-                    RestApiId=troposphere.Ref(api),
-                    **extra
-                )
-                template.add_resource(m)
-                deployment_dependencies.append(m.name)
-                deployment_resources.append(m)
+            extra = {}
+            if 'parameters' in configuration:
+                extra['RequestParameters'] = configuration['parameters']
+            m = Method(
+                utils.valid_cloudformation_name(*method_name),
+                HttpMethod=method,
+                AuthorizationType=self.get_authorization_type(configuration),
+                ApiKeyRequired=self.get_api_key_required(configuration),
+                Integration=self.get_integration(configuration, invoke_lambda_role),
+                MethodResponses=self.get_method_responses(configuration),
+                ResourceId=resource_reference,
+                RestApiId=troposphere.Ref(api),
+                **extra
+            )
+            template.add_resource(m)
+            deployment_dependencies.append(m.name)
+            deployment_resources.append(m)
 
         deploy_hash = hashlib.sha1(six.text_type(uuid.uuid4()).encode('utf-8')).hexdigest()
         deploy = Deployment(
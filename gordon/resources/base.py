@@ -47,6 +47,9 @@ class BaseResource(object):
     """
     grn_type = ''
     required_settings = ()
+    # Whether the templates of this resource can be reused by subsequent
+    # builds if its application hasn't changed.
+    reuse_fragments = True
 
     def __init__(self, name, settings, project=None, app=None):
         self.name = name
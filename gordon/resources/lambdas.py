@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
+import json
 import shutil
 import tempfile
-import zipfile
 import subprocess
 import platform
+import hashlib
 
 import six
 import troposphere
@@ -13,8 +15,12 @@ from troposphere import iam, awslambda, s3
 from clint.textui import colored, indent
 
 from gordon import actions
+from gordon import archive
+from gordon import profiling
 from gordon import utils
+from gordon import workers
 from gordon import exceptions
+from gordon import get_version
 from gordon.contrib.lambdas.resources import LambdaVersion
 from . import base
 
@@ -27,8 +33,30 @@ class Lambda(base.BaseResource):
     REQUIRED_SETTINGS = ('code', )
     code_filename = 'code'
     grn_type = 'lambda'
+    # Files removed from the package of lambdas with ``slim: true``
+    slim_patterns = (
+        'tests/',
+        'test/',
+        'docs/',
+        'doc/',
+        'examples/',
+        'README*',
+        'LICENSE*',
+        'LICENCE*',
+        'CHANGELOG*',
+        'CHANGES*',
+        'HISTORY*',
+        'AUTHORS*',
+        'CONTRIBUTING*',
+        '*.md',
+        '*.rst',
+    )
     _default_runtime = None
     _runtimes = {}
+    # If the loader of this runtime can run in batch mode.
+    supports_batch = False
+    # If the memory of this runtime can be enforced locally (--enforce-memory).
+    supports_memory_limit = False
 
     @classmethod
     def factory(cls, *args, **kwargs):
@@ -79,6 +107,16 @@ class Lambda(base.BaseResource):
         runtime = self.settings.get('runtime', self._default_runtime)
         return self._runtimes[runtime]
 
+    def get_compression_level(self):
+        """Returns the zlib compression level (0-9) of the .zip file of this
+        lambda. ``0`` stores all files without compression."""
+        level = self.settings.get('compression-level')
+        if level is None and self.app:
+            level = self.app.settings.get('compression-level')
+        if level is None:
+            level = self.project.settings.get('compression-level', archive.COMPRESSION_LEVEL)
+        return max(min(int(level), 9), 0)
+
     def get_context_key(self):
         return self.settings.get('context', 'default')
 
@@ -333,18 +371,98 @@ class Lambda(base.BaseResource):
                 )
             ])
 
+    def get_code_filename(self):
+        """Return the path of the .zip file of this lambda within the build
+        directory of the project."""
+        return os.path.join(self.project.build_path, 'code', self.get_bucket_key())
+
+    def build_code(self, log=None):
+        """Collect, build and zip the code of this lambda into
+        ``get_code_filename``. This method doesn't depend on any other
+        resource, so it is safe to call it concurrently for different
+        lambdas as long as ``log`` is not shared between them.
+
+        If the project has an artifact cache, and a previous build of the
+        same code is present on it, that .zip is reused instead.
+
+        Returns the entry of the .zip file in the manifest of the build (see
+        ``utils.get_artifact_entry``), using the digest calculated while
+        the file was written."""
+        log = log or self._log
+        with profiling.span(self.name, category='lambda', resource=self.in_project_name):
+            filename = self.get_code_filename()
+            cache = self.project.get_artifact_cache()
+            if cache is not None and self._get_true_false('build-cache', 't'):
+                with profiling.span('cache lookup', category='cache'):
+                    key = self.get_code_digest()
+                    cached = cache.get(key)
+                if cached:
+                    if self.project.debug:
+                        log(colored.white(u"✸ Using cached build {} of {}".format(key[:8], self.name)))
+                    with profiling.span('write', category='write'):
+                        digest = utils.copy_file_with_hash(cached, filename)
+                    return utils.get_artifact_entry(filename, digest)
+            else:
+                key = None
+
+            digest = self.write_zip_file(filename, log=log, jobs=self.project.jobs)
+
+            if key:
+                with profiling.span('cache store', category='cache'):
+                    cache.put(key, filename)
+            return utils.get_artifact_entry(filename, digest)
+
+    def get_code_digest(self):
+        """Returns a digest of everything which defines the content of the
+        .zip file of this lambda: The source tree, the build command, the
+        runtime, the ``*-install-extra``, ``slim*`` and ``precompile*``
+        settings."""
+        digest = hashlib.sha1()
+        for value in (get_version(), self.get_runtime(), self.settings['code'],
+                      self._pip_path(), self._pip_install_extra(), self._pip_wheelhouse(),
+                      self._npm_path(), self._npm_install_extra(),
+                      self._gradle_path(), self._gradle_build_extra(),
+                      self._get_true_false('slim', 'f'), self.settings.get('slim-include'),
+                      self.settings.get('slim-exclude'), self._get_true_false('precompile', 'f'),
+                      self.settings.get('precompile-python'), self.get_compression_level()):
+            digest.update(six.text_type(value).encode('utf-8'))
+
+        code = os.path.join(self.get_root(), self.settings['code'])
+        if os.path.isfile(code):
+            utils.update_file_digest(digest, code, self.settings['code'])
+            return digest.hexdigest()
+
+        commands = self._get_build_command('{target}')
+        if hasattr(commands, '__call__') or isinstance(commands, six.string_types):
+            commands = [commands]
+        for command in commands:
+            if hasattr(command, '__call__'):
+                command = getattr(command, '__name__', repr(command))
+            else:
+                command = self._format_build_command(command, '{target}')
+            digest.update(six.text_type(command).encode('utf-8'))
+
+        patterns = self._get_code_patterns(commands)
+        digest.update(six.text_type(patterns).encode('utf-8'))
+
+        for filename in utils.walk_files(code, patterns):
+            utils.update_file_digest(digest, os.path.join(code, filename), filename)
+        return digest.hexdigest()
+
+    @classmethod
+    def register_type_pre_resources_template(cls, project, template):
+        """The code of each lambda is uploaded independently, so uploads can
+        be applied concurrently."""
+        template.parallelizable = True
+
     def register_pre_resources_template(self, template):
         """Register one UploadToS3 action into the pre_resources template, as
         well as several Outputs so subsequente templates can reference these
         files.
-        Before registering these actions, we create the .zip file we'll
-        upload to s3 on apply time.
+        The .zip file we'll upload to s3 on apply time is created beforehand
+        by ``build_code``.
         """
 
-        code_path = os.path.join(self.project.build_path, 'code')
-        if not os.path.exists(code_path):
-            os.makedirs(code_path)
-
         # We need to know to which bucket we are uploading these files.
         template.add_parameter(
             actions.Parameter(
@@ -352,10 +470,7 @@ class Lambda(base.BaseResource):
             )
         )
 
-        filename = os.path.join(code_path, self.get_bucket_key())
-        with open(filename, 'wb') as f:
-            f.write(self.get_zip_file().read())
-
+        filename = self.get_code_filename()
         context, context_key = {}, self.get_context_key()
         try:
             lambda_context = self.project.get_resource('contexts::{}'.format(context_key))
@@ -394,13 +509,24 @@ class Lambda(base.BaseResource):
             )
         )
 
-    def collect_and_run(self, stdin):
+    def collect_and_run(self, stdin, batch=False, enforce_memory=False):
+        destination = self.collect()
+        try:
+            self.run(destination, stdin, batch=batch, enforce_memory=enforce_memory)
+        finally:
+            shutil.rmtree(destination)
+
+    def collect(self):
+        """Collect the code of this lambda, built for the current platform,
+        into a new temporary directory and return it. The loader of the
+        runtime is copied along, so the lambda can be run locally from it."""
         self.project.create_workspace()
         destination = tempfile.mkdtemp(dir=self.project.get_workspace())
 
         # Translate pythona architecture to go architecture.
         # https://go.googlesource.com/go/+/master/src/cmd/dist/build.go#1086
-        go_target_arch = {'i386': '386', 'x86_64': 'amd64'}[platform.processor()]
+        # platform.processor() is empty in some linux distributions.
+        go_target_arch = {'i386': '386', 'x86_64': 'amd64'}[platform.processor() or platform.machine()]
 
         try:
             self._collect_lambda_content(
@@ -412,10 +538,12 @@ class Lambda(base.BaseResource):
             shutil.rmtree(destination)
             raise exceptions.LambdaBuildProcessError(exc, self)
 
-        try:
-            self.run(destination, stdin)
-        finally:
-            shutil.rmtree(destination)
+        for source, dest in self._get_loader_requirements():
+            shutil.copyfile(
+                os.path.join(self.project._gordon_root, 'loaders', source),
+                os.path.join(destination, dest)
+            )
+        return destination
 
     def _get_default_run_command(self):
         raise NotImplementedError()
@@ -423,70 +551,280 @@ class Lambda(base.BaseResource):
     def _get_loader_requirements(self):
         return []
 
-    def run(self, path, stdin):
-        for source, dest in self._get_loader_requirements():
-            shutil.copyfile(
-                os.path.join(self.project._gordon_root, 'loaders', source),
-                os.path.join(path, dest)
-            )
+    def _get_memory_limit_command(self, command):
+        """Returns ``command`` changed so the loader can't use more memory
+        than this lambda has."""
+        raise NotImplementedError()
 
+    def _get_loader_options(self, batch=False):
+        """Returns the options the loaders of gordon are run with, for the
+        ``{loader_options}`` placeholder of the default run commands."""
+        options = ' --billing-granularity={}'.format(workers.BILLING_GRANULARITY)
+        if batch:
+            options = '{} --batch'.format(options)
+        return options
+
+    def get_run_command(self, path, batch=False, enforce_memory=False):
+        """Returns the command which runs the loader of this lambda within
+        ``path``. In ``batch`` mode, the loader invokes the handler once per
+        json line of its stdin (see ``gordon.workers``). If
+        ``enforce_memory``, the loader is limited to the memory of this
+        lambda."""
+        if batch and not self.supports_batch:
+            raise exceptions.LambdaBatchNotSupportedError(self.name, u"Runtime {}".format(self.get_runtime()))
+        if batch and 'run' in self.settings:
+            # Nothing tells us a custom run command speaks the batch protocol.
+            raise exceptions.LambdaBatchNotSupportedError(self.name, u"Its custom run command")
+        if enforce_memory and not self.supports_memory_limit:
+            raise exceptions.LambdaMemoryLimitNotSupportedError(self.name, self.get_runtime(), platform.system())
         command = self.settings.get('run', self._get_default_run_command())
         command = command.format(
             lambda_path=path,
             name=self.name,
             memory=self.get_memory(),
             handler=self.get_handler(),
-            timeout=self.get_timeout()
+            timeout=self.get_timeout(),
+            loader_options=self._get_loader_options(batch=batch)
         )
-
+        if enforce_memory:
+            command = self._get_memory_limit_command(command)
+        return command
+
+    def run(self, path, stdin, batch=False, enforce_memory=False):
+        """Run the collected lambda in ``path`` with the event in ``stdin``.
+        In ``batch`` mode, ``stdin`` contains one event per line, and the
+        result of each invocation is written into stdout as one json line
+        as soon as it finishes. If ``enforce_memory`` and the lambda runs
+        out of its memory, the failure is reported like Lambda does."""
+        if batch:
+            process = subprocess.Popen(
+                self.get_run_command(path, batch=True, enforce_memory=enforce_memory),
+                shell=True,
+                cwd=path,
+                stdin=stdin
+            )
+            code, max_rss = utils.wait_process(process)
+            if code != 0:
+                result = enforce_memory and workers.get_out_of_memory_result(self, code, max_rss)
+                if result:
+                    print(json.dumps(result))
+                    sys.stdout.flush()
+                raise exceptions.LambdaWorkerError(self.name, code)
+            return
+
+        command = self.get_run_command(path, enforce_memory=enforce_memory)
         with utils.cd(path):
+            process = subprocess.Popen(
+                command,
+                shell=True,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            out = process.stdout.read()
+            process.stdout.close()
+            code, max_rss = utils.wait_process(process)
+        print(out.decode('utf-8'))
+        result = enforce_memory and workers.get_out_of_memory_result(self, code, max_rss)
+        if result:
+            print(result['error'])
+
+    def _get_code_patterns(self, commands):
+        """Returns the ignore patterns of the files within the code directory
+        which can change the content of this lambda. Custom build commands
+        could use any file within the code directory, so we can only skip
+        ignored files if gordon is the one collecting the source."""
+        if self._collect_source in commands:
+            return self.get_ignore_patterns()
+        return ['.git/', '.hg/', '.svn/']
+
+    def get_source_signature(self):
+        """Returns the size and modification time of every file which
+        defines the content of this lambda. Much cheaper than
+        ``get_code_digest``, so it can be used to detect changes often."""
+        code = os.path.join(self.get_root(), self.settings['code'])
+        if os.path.isfile(code):
+            filenames = [code]
+        else:
+            commands = self._get_build_command('{target}')
+            if hasattr(commands, '__call__') or isinstance(commands, six.string_types):
+                commands = [commands]
+            filenames = [os.path.join(code, f) for f in utils.walk_files(code, self._get_code_patterns(commands))]
+
+        signature = []
+        for filename in filenames:
+            stat = os.stat(filename)
+            signature.append((filename, stat.st_size, stat.st_mtime))
+        return signature
+
+    def write_zip_file(self, filename, log=None, jobs=1):
+        """Collect all the required source of this lambda and write it as
+        a zip file into ``filename``. Files are compressed and written one
+        chunk at a time, so memory usage doesn't depend on the size of the
+        package. Identical sources produce byte-identical zip files.
+        Returns the sha1 of the zip file.
+
+        If this lambda doesn't need any build step, files are written
+        straight from the source directory into the zip file. Otherwise,
+        they are collected into a temporary directory first.
+
+        Up to ``jobs`` files are compressed concurrently."""
+        log = log or self._log
+        code = os.path.join(self.get_root(), self.settings['code'])
+        destination = None
+
+        slim = self._get_true_false('slim', 'f')
+        precompile = self._get_true_false('precompile', 'f')
+        if os.path.isfile(code) and not precompile or \
+           (not slim and not precompile and self._get_build_command('{target}') == [self._collect_source]):
+            if self.project.debug:
+                log(colored.white(u"✸ Zipping {} straight from its source".format(self.name)))
+        else:
+            self.project.create_workspace()
+            destination = tempfile.mkdtemp(dir=self.project.get_workspace())
             try:
-                out = subprocess.check_output(
-                    command,
-                    shell=True,
-                    stdin=stdin,
-                    stderr=subprocess.STDOUT
-                )
+                with profiling.span('collect', category='collect'):
+                    self._collect_lambda_content(destination, log=log)
             except subprocess.CalledProcessError as exc:
-                print(exc.output)
-            else:
-                print(out.decode('utf-8'))
+                shutil.rmtree(destination)
+                raise exceptions.LambdaBuildProcessError(exc, self)
 
-    def get_zip_file(self):
-        """Returns a zip file file-like object with all the required source
-        on it."""
+            if slim:
+                with profiling.span('slim', category='slim'):
+                    removed, saved = self.slim(destination)
+                log(colored.green(u"✓ {} slimmed: {} files removed, {} saved".format(
+                    self.name, removed, utils.get_human_size(saved))
+                ))
 
-        self.project.create_workspace()
-        destination = tempfile.mkdtemp(dir=self.project.get_workspace())
+            if precompile:
+                with profiling.span('precompile', category='precompile'):
+                    self.precompile(destination, log=log)
 
         try:
-            self._collect_lambda_content(destination)
-        except subprocess.CalledProcessError as exc:
-            shutil.rmtree(destination)
-            raise exceptions.LambdaBuildProcessError(exc, self)
+            with profiling.span('zip', category='zip', jobs=jobs):
+                with archive.DeterministicZipFile(filename, compresslevel=self.get_compression_level()) as zf:
+                    if destination:
+                        zf.write_tree(destination, jobs=jobs)
+                    elif os.path.isfile(code):
+                        zf.write(code, self._get_lambda_file_name())
+                    else:
+                        zf.write_tree(code, self._get_source_files(), jobs=jobs)
+            return zf.hexdigest()
+        except Exception:
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
+        finally:
+            if destination:
+                shutil.rmtree(destination)
+
+    def precompile(self, path, log=None):
+        """Hook to compile the collected code of this lambda in ``path``
+        before it gets zipped. Only runtimes which support it implement it."""
+        pass
+
+    def _get_lambda_file_name(self):
+        """Returns the name of the file of lambdas defined as a single file
+        within their .zip file."""
+        return '{}.{}'.format(self.code_filename, self.extension)
+
+    def _collect_lambda_file_content(self, destination, **kwargs):
+        shutil.copyfile(
+            os.path.join(self.get_root(), self.settings['code']),
+            os.path.join(destination, self._get_lambda_file_name())
+        )
 
-        with tempfile.SpooledTemporaryFile(0, 'wb') as tmp:
-            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for basedir, dirs, files in os.walk(destination):
-                    relative = os.path.relpath(basedir, destination)
-                    for filename in files:
-                        source = os.path.join(destination, basedir, filename)
-                        relative_destination = os.path.join(relative, filename)
-                        if six.PY2:
-                            source = source.decode('utf-8', errors='strict')
-                            relative_destination = relative_destination.decode('utf-8', errors='strict')
-                        zf.write(source, relative_destination)
-
-            tmp.seek(0)
-            output = six.BytesIO(tmp.read())
-
-        output.seek(0)
-        shutil.rmtree(destination)
-        return output
-
-    def _collect_lambda_file_content(self, destination):
-        filename = '{}.{}'.format(self.code_filename, self.extension)
-        shutil.copyfile(os.path.join(self.get_root(), self.settings['code']), os.path.join(destination, filename))
+    def get_ignore_patterns(self):
+        """Returns the list of patterns of files gordon should not include
+        in the code of this lambda. Patterns are defined in ``.gordonignore``
+        files within the application and the code directory of the lambda,
+        and the ``ignore`` setting of the lambda."""
+        code = os.path.join(self.get_root(), self.settings['code'])
+        return (
+            list(utils.DEFAULT_IGNORE_PATTERNS) +
+            utils.load_ignore_patterns(
+                os.path.join(self.get_root(), '.gordonignore'),
+                os.path.join(code, '.gordonignore')
+            ) +
+            list(self.settings.get('ignore', []))
+        )
+
+    def _get_source_files(self):
+        """Returns the list of files of the code directory of this lambda
+        which are not ignored."""
+        code = os.path.join(self.get_root(), self.settings['code'])
+        return utils.walk_files(code, self.get_ignore_patterns())
+
+    def get_slim_patterns(self):
+        """Returns the list of patterns of files ``slim`` removes. Users
+        can remove more files using ``slim-exclude``, or keep some of them
+        using ``slim-include``."""
+        return (
+            list(self.slim_patterns) +
+            list(self.settings.get('slim-exclude', [])) +
+            ['!{}'.format(p) for p in self.settings.get('slim-include', [])]
+        )
+
+    def slim(self, path):
+        """Remove from ``path`` all files which are not required to run this
+        lambda (tests, docs, metadata...) and strip debug symbols from
+        shared objects. Returns the number of removed files and the number
+        of bytes saved."""
+        patterns = self.get_slim_patterns()
+        removed, saved = 0, 0
+        for basedir, dirs, files in os.walk(path):
+            relative = os.path.relpath(basedir, path).replace(os.sep, '/')
+            relative = '' if relative == '.' else '{}/'.format(relative)
+            for name in list(dirs):
+                filename = os.path.join(basedir, name)
+                if os.path.islink(filename) or not utils.is_ignored(relative + name, True, patterns):
+                    continue
+                dirs.remove(name)
+                for subdir, _, subfiles in os.walk(filename):
+                    removed += len(subfiles)
+                    saved += sum([os.lstat(os.path.join(subdir, f)).st_size for f in subfiles])
+                shutil.rmtree(filename)
+
+            for name in files:
+                filename = os.path.join(basedir, name)
+                if utils.is_ignored(relative + name, False, patterns):
+                    removed += 1
+                    saved += os.lstat(filename).st_size
+                    os.remove(filename)
+                elif re.search(r'\.so(\.\d+)*$', name) and not os.path.islink(filename):
+                    saved += self._strip_shared_object(filename)
+        return removed, saved
+
+    def _strip_shared_object(self, filename):
+        """Strip debug symbols of ``filename`` and returns the number of
+        saved bytes. Files might be hardlinks of cached dependencies, so
+        instead of modifying them we replace them with the stripped copy."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        os.close(fd)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                code = subprocess.call(
+                    [self.project.settings.get('strip-path', 'strip'), '-S', '-o', tmp, filename],
+                    stdout=devnull,
+                    stderr=devnull
+                )
+        except OSError:
+            code = 1
+
+        saved = os.path.getsize(filename) - os.path.getsize(tmp)
+        if code != 0 or saved <= 0:
+            os.remove(tmp)
+            return 0
+        shutil.copymode(filename, tmp)
+        os.rename(tmp, filename)
+        return saved
+
+    def _collect_source(self, destination, log=None):
+        """Build step which populates ``destination`` with all the source
+        files of this lambda using hardlinks (or copies if hardlinks are
+        not possible)."""
+        code = os.path.join(self.get_root(), self.settings['code'])
+        utils.link_tree(code, destination, files=self._get_source_files())
 
     def _get_build_command(self, destination):
         return self.settings.get('build', self._get_default_build_command(destination))
@@ -496,53 +834,102 @@ class Lambda(base.BaseResource):
         lambda. Returns a temporal directory path
         """
         if os.path.isfile(os.path.join(self.get_root(), self.settings['code'])):
-            self._collect_lambda_file_content(destination)
+            self._collect_lambda_file_content(destination, **kwargs)
         else:
             self._collect_lambda_module_content(destination, **kwargs)
 
-    def _collect_lambda_module_content(self, destination, go_target_arch='amd64', go_target_os='linux'):
-        root = os.path.join(self.get_root(), self.settings['code'])
-        with utils.cd(root):
-            commands = self._get_build_command(destination)
-            if hasattr(commands, '__call__'):
-                commands()
-                return
-            elif isinstance(commands, six.string_types):
-                commands = [commands]
+    def _log(self, message):
+        with indent(4):
+            self.project.puts(message)
+
+    def _collect_lambda_module_content(self, destination, go_target_arch='amd64', go_target_os='linux', log=None):
+        """Run the build commands of this lambda within its code directory.
+        Build commands run with ``cwd`` instead of changing the working
+        directory of the process, so several lambdas can be built at the
+        same time. Debug output is sent to ``log``.
+
+        Callables (on their own or within a list of build commands) are
+        build steps, and get called with the target directory and ``log``."""
+        log = log or self._log
+        commands = self._get_build_command(destination)
+        if hasattr(commands, '__call__') or isinstance(commands, six.string_types):
+            commands = [commands]
+
+        for command in commands:
+            if hasattr(command, '__call__'):
+                with profiling.span(command.__name__.lstrip('_'), category='build step'):
+                    command(destination, log=log)
+                continue
+            self._run_build_command(
+                command,
+                destination,
+                go_target_os=go_target_os,
+                go_target_arch=go_target_arch,
+                log=log
+            )
 
-            for command in commands:
-                command = command.format(
-                    target=destination,
-                    pip_path=self._pip_path(),
-                    npm_path=self._npm_path(),
-                    gradle_path=self._gradle_path(),
-                    pip_install_extra=self._pip_install_extra(),
-                    npm_install_extra=self._npm_install_extra(),
-                    gradle_build_extra=self._gradle_build_extra(),
-                    project_path=self.project.path,
-                    project_name=self.project.name,
-                    lambda_name=self.name,
-                    go_target_os=go_target_os,
-                    go_target_arch=go_target_arch,
-                )
+    def _run_build_command(self, command, destination, go_target_arch='amd64', go_target_os='linux', log=None):
+        log = log or self._log
+        command = self._format_build_command(
+            command,
+            destination,
+            go_target_os=go_target_os,
+            go_target_arch=go_target_arch
+        )
+        if self.project.debug:
+            log(colored.white(command))
+        with profiling.span('build command', category='build command', command=command):
+            out = subprocess.check_output(
+                command,
+                shell=True,
+                cwd=os.path.join(self.get_root(), self.settings['code']),
+                stderr=subprocess.STDOUT
+            )
+        if self.project.debug and out:
+            log(out.decode("utf-8"))
+
+    def _install_dependencies(self, key, destination, install, log=None):
+        """Install the dependencies of this lambda into ``destination`` by
+        calling ``install`` with a target directory. If ``key`` is not
+        ``None`` and the project has a dependency cache, the installed tree
+        is stored in it so other lambdas (and builds) with the same ``key``
+        only need to hardlink it."""
+        log = log or self._log
+        cache = self.project.get_dependency_cache()
+        if key is None or cache is None or not self._get_true_false('dependency-cache', 't'):
+            install(destination)
+            return
+
+        with cache.lock(key):
+            cached = cache.get(key)
+            if cached:
                 if self.project.debug:
-                    with indent(4):
-                        self.project.puts(colored.white(command))
-                out = subprocess.check_output(
-                    command,
-                    shell=True,
-                    stderr=subprocess.STDOUT
-                )
-                if self.project.debug and out:
-                    with indent(4):
-                        self.project.puts(out.decode("utf-8"))
-
-    def _collect_folder(self, source, destination):
-        for basedir, dirs, files in os.walk(source):
-            relative = os.path.relpath(basedir, source)
-            for filename in files:
-                relative_destination = os.path.join(relative, filename)
-                shutil.copyfile(os.path.join(basedir, filename), os.path.join(destination, relative_destination))
+                    log(colored.white(u"✸ Using cached dependencies {} of {}".format(key[:8], self.name)))
+            else:
+                tmp = cache.mkdtemp()
+                try:
+                    install(tmp)
+                except Exception:
+                    shutil.rmtree(tmp)
+                    raise
+                cached = cache.commit(key, tmp)
+        utils.link_tree(cached, destination)
+
+    def _format_build_command(self, command, destination, go_target_arch='amd64', go_target_os='linux'):
+        return command.format(
+            target=destination,
+            pip_path=self._pip_path(),
+            npm_path=self._npm_path(),
+            gradle_path=self._gradle_path(),
+            pip_install_extra=self._pip_install_extra(),
+            npm_install_extra=self._npm_install_extra(),
+            gradle_build_extra=self._gradle_build_extra(),
+            project_path=self.project.path,
+            project_name=self.project.name,
+            lambda_name=self.name,
+            go_target_os=go_target_os,
+            go_target_arch=go_target_arch,
+        )
 
     def _get_default_build_command(self, destination):
         raise NotImplementedError
@@ -569,6 +956,18 @@ class Lambda(base.BaseResource):
         )
         return ' '.join([e for e in extra if e])
 
+    def _pip_wheelhouse(self):
+        """Returns the absolute path of the local wheelhouse pip should
+        install packages from, if any."""
+        wheelhouse = (
+            self.settings.get('pip-wheelhouse') or
+            (self.app and self.app.settings.get('pip-wheelhouse')) or
+            self.project.settings.get('pip-wheelhouse')
+        )
+        if wheelhouse:
+            return os.path.join(self.project.path, wheelhouse)
+        return None
+
     def _npm_path(self):
         return self.project.settings.get('npm-path', 'npm')
 
@@ -590,20 +989,108 @@ class PythonLambda(Lambda):
         'python2': 'python2.7'
     }
     extension = 'py'
+    supports_batch = True
+    # Address space limits are only enforced by Linux.
+    supports_memory_limit = sys.platform.startswith('linux')
+    slim_patterns = Lambda.slim_patterns + (
+        '*.dist-info/',
+        '*.egg-info/',
+        '*.pyi',
+        '*.pyc',
+        '*.pyo',
+    )
 
     def _get_default_build_command(self, destination):
         code_root = os.path.join(self.get_root(), self.settings['code'])
         requirements_path = os.path.join(code_root, 'requirements.txt')
 
         commands = []
-        commands.append('cp -Rf * {target}')
+        commands.append(self._collect_source)
         if os.path.isfile(requirements_path):
-            commands.append('{pip_path} install --install-option="--prefix=" -r requirements.txt -q -t {target} {pip_install_extra}')
-            commands.append('cd {target} && find . -name "*.pyc" -delete')
+            commands.append(self._install_requirements)
         return commands
 
+    def _install_requirements(self, destination, log=None):
+        """Build step which installs ``requirements.txt`` into
+        ``destination`` using the dependency cache if possible."""
+        requirements_path = os.path.join(self.get_root(), self.settings['code'], 'requirements.txt')
+
+        def install(target):
+            command = ('{pip_path} install --install-option="--prefix=" -r requirements.txt -q '
+                       '-t {target} {pip_install_extra}')
+            if self._pip_wheelhouse():
+                command += ' --no-index --find-links "{}"'.format(self._pip_wheelhouse())
+            self._run_build_command(command, target, log=log)
+            self._run_build_command('cd {target} && find . -name "*.pyc" -delete', target, log=log)
+
+        self._install_dependencies(self._get_requirements_key(requirements_path), destination, install, log=log)
+
+    def _get_requirements_key(self, requirements_path):
+        """Returns the dependency cache key of ``requirements_path``, or
+        ``None`` if the requirements reference other local files (nested
+        requirements, constraints, editable or local packages) and
+        therefore can't be cached safely."""
+        requirements = []
+        with open(requirements_path, 'r') as f:
+            for line in f:
+                line = re.sub(r'(^|\s)#.*$', '', line).strip()
+                if not line:
+                    continue
+                if line.startswith(('-r', '-c', '-e', '--requirement', '--constraint', '--editable',
+                                    '.', '/', 'file:')):
+                    return None
+                requirements.append(re.sub(r'\s+', ' ', line))
+
+        wheels = []
+        if self._pip_wheelhouse() and os.path.isdir(self._pip_wheelhouse()):
+            wheels = sorted(os.listdir(self._pip_wheelhouse()))
+
+        return utils.get_object_digest(
+            get_version(),
+            'pip',
+            requirements,
+            self.get_runtime(),
+            platform.system(),
+            platform.machine(),
+            self._pip_path(),
+            self._pip_install_extra(),
+            self._pip_wheelhouse(),
+            wheels
+        )
+
+    def precompile(self, path, log=None):
+        """Compile all python files in ``path`` into the bytecode the runtime
+        of this lambda loads, so cold starts don't need to compile every
+        imported module. Bytecode is generated by the ``precompile-python``
+        interpreter (by default the one named after the runtime), which must
+        be the same version as the runtime."""
+        log = log or self._log
+        runtime = self.get_runtime()
+        python = self.settings.get('precompile-python', self.project.settings.get('precompile-python', runtime))
+        command = [python, os.path.join(self.project._gordon_root, 'loaders', 'precompile.py'), path, '/var/task/']
+        env = dict(os.environ, PYTHONHASHSEED='0', PYTHONDONTWRITEBYTECODE='1')
+        try:
+            out = subprocess.check_output(command, env=env, stderr=subprocess.STDOUT)
+        except OSError as exc:
+            raise exceptions.LambdaBuildProcessError(
+                subprocess.CalledProcessError(1, ' '.join(command), six.text_type(exc)), self
+            )
+        except subprocess.CalledProcessError as exc:
+            raise exceptions.LambdaBuildProcessError(exc, self)
+
+        version, compiled = out.decode('utf-8').strip().splitlines()[-1].split()
+        expected = runtime.replace('python', '')
+        if version != expected:
+            raise exceptions.LambdaPrecompileError(self.name, runtime, python, version, expected)
+        if self.project.debug:
+            log(colored.white(u"✸ Precompiled {} python files of {}".format(compiled, self.name)))
+
     def _get_default_run_command(self):
-        return 'touch __init__.py && python _gloader.py {handler} {name} {memory} {timeout}'
+        return 'touch __init__.py && python _gloader.py {handler} {name} {memory} {timeout}{loader_options}'
+
+    def _get_memory_limit_command(self, command):
+        # The loader limits its own address space.
+        return '{} --enforce-memory'.format(command)
 
     def _get_loader_requirements(self):
         return [['python.py', '_gloader.py']]
@@ -621,19 +1108,88 @@ class NodeLambda(Lambda):
         'node0.10': 'nodejs'
     }
     extension = 'js'
+    supports_batch = True
+    supports_memory_limit = True
+    slim_patterns = Lambda.slim_patterns + (
+        '__tests__/',
+        '*.d.ts',
+        '*.map',
+        '*.markdown',
+        '.npmignore',
+        '.travis.yml',
+    )
+    lockfiles = ('package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock')
 
     def _get_default_build_command(self, destination):
         code_root = os.path.join(self.get_root(), self.settings['code'])
         package_json_path = os.path.join(code_root, 'package.json')
 
         commands = []
-        commands.append('cp -Rf * {target}')
+        commands.append(self._collect_source)
         if os.path.isfile(package_json_path):
-            commands.append('cd {target} && {npm_path} install {npm_install_extra}')
+            commands.append(self._install_node_modules)
         return commands
 
+    def _install_node_modules(self, destination, log=None):
+        """Build step which installs the ``node_modules`` of ``package.json``
+        into ``destination`` using the dependency cache if possible."""
+        code_root = os.path.join(self.get_root(), self.settings['code'])
+
+        def install(target):
+            if target != destination:
+                for filename in ('package.json',) + self.lockfiles:
+                    if os.path.isfile(os.path.join(code_root, filename)):
+                        shutil.copyfile(os.path.join(code_root, filename), os.path.join(target, filename))
+            self._run_build_command('cd {target} && {npm_path} install {npm_install_extra}', target, log=log)
+            if target != destination:
+                # Cache entries only contain node_modules
+                for filename in os.listdir(target):
+                    if filename != 'node_modules':
+                        os.remove(os.path.join(target, filename))
+
+        self._install_dependencies(self._get_package_key(code_root), destination, install, log=log)
+
+    def _get_package_key(self, code_root):
+        """Returns the dependency cache key of the ``package.json`` (and
+        lockfile) in ``code_root``, or ``None`` if the package depends on
+        other local files (local dependencies or install scripts) and
+        therefore can't be cached safely."""
+        with open(os.path.join(code_root, 'package.json'), 'r') as f:
+            package = json.load(f)
+
+        scripts = package.get('scripts') or {}
+        if [s for s in ('preinstall', 'install', 'postinstall', 'prepare') if s in scripts]:
+            return None
+        for field in ('dependencies', 'devDependencies', 'optionalDependencies'):
+            for version in (package.get(field) or {}).values():
+                if str(version).startswith(('file:', 'link:', '.', '/', '~/')):
+                    return None
+
+        lockfiles = {}
+        for filename in self.lockfiles:
+            path = os.path.join(code_root, filename)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    lockfiles[filename] = f.read()
+
+        return utils.get_object_digest(
+            get_version(),
+            'npm',
+            package,
+            lockfiles,
+            self.get_runtime(),
+            platform.system(),
+            platform.machine(),
+            self._npm_path(),
+            self._npm_install_extra()
+        )
+
     def _get_default_run_command(self):
-        return 'node _gloader.js {handler} {name} {memory} {timeout}'
+        return 'node _gloader.js {handler} {name} {memory} {timeout}{loader_options}'
+
+    def _get_memory_limit_command(self, command):
+        # The heap of node can't be limited once it has started.
+        return 'export NODE_OPTIONS="$NODE_OPTIONS --max-old-space-size={}"; {}'.format(self.get_memory(), command)
 
     def _get_loader_requirements(self):
         return [['node.js', '_gloader.js']]
@@ -649,7 +1205,7 @@ class JavaLambda(Lambda):
     extension = 'java'
 
     def _get_loader_requirements(self):
-            return [['java/build/libs/java.jar', '_gloader.jar']]
+        return [['java/build/libs/java.jar', '_gloader.jar']]
 
     def _get_default_build_command(self, destination):
         return "{gradle_path} build -Ptarget={target} {gradle_build_extra}"
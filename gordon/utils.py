@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import re
 import sys
 import time
 import copy
 import json
+import shutil
+import fnmatch
 import hashlib
 import zipfile
 from datetime import datetime
@@ -12,6 +15,7 @@ from collections import Iterable
 
 import six
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import yaml
 import jinja2
@@ -63,12 +67,14 @@ def mill(iterable):
 
 
 def get_zip_hash(obj):
-    """Return a consistent hash of the content of a zip file ``obj``."""
+    """Return the hash of the zip file ``obj``. Gordon writes deterministic
+    zip files (see ``archive.DeterministicZipFile``), so the same content
+    always produces the same bytes, and we can hash them in one streaming
+    pass without inflating every member."""
     digest = hashlib.sha1()
-    zfile = zipfile.ZipFile(obj, 'r')
-    for path in sorted(zfile.namelist()):
-        digest.update(six.text_type(path).encode('utf-8'))
-        digest.update(zfile.read(path))
+    with open(obj, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
     return digest.hexdigest()
 
 
@@ -83,6 +89,226 @@ def get_file_hash(filename):
         return digest.hexdigest()
 
 
+def copy_file_with_hash(source, destination):
+    """Copy ``source`` into ``destination`` and return the sha1 of its
+    content, calculated while it is being copied."""
+    digest = hashlib.sha1()
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            for chunk in iter(lambda: src.read(65536), b''):
+                digest.update(chunk)
+                dst.write(chunk)
+    return digest.hexdigest()
+
+
+# Name of the manifest of the artifacts of the build, within the build path.
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_artifact_entry(filename, digest=None):
+    """Returns the entry of the artifact ``filename`` in the manifest of the
+    build: its ``digest`` (the same ``get_file_hash`` returns), ``size``,
+    modification time and number of ``members`` if it is a .zip file."""
+    stat = os.stat(filename)
+    entry = {
+        'digest': digest or get_file_hash(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    if filename.endswith('.zip'):
+        # Only the central directory of the file is read.
+        zfile = zipfile.ZipFile(filename)
+        try:
+            entry['members'] = len(zfile.infolist())
+        finally:
+            zfile.close()
+    return entry
+
+
+def write_manifest(build_path, entries):
+    """Write the manifest of the build with ``entries``, the entries of the
+    artifacts within ``build_path`` by their relative path."""
+    with open(os.path.join(build_path, MANIFEST_FILE), 'w') as f:
+        f.write(json.dumps({'artifacts': entries}, indent=4, sort_keys=True))
+
+
+def load_manifest(build_path):
+    """Returns the entries of the artifacts of the manifest of the build in
+    ``build_path``, or no entries if the build doesn't have a manifest."""
+    try:
+        with open(os.path.join(build_path, MANIFEST_FILE), 'r') as f:
+            return json.loads(f.read()).get('artifacts', {})
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def get_artifact_hash(filename, manifest, build_path):
+    """Returns the hash of ``filename``. If the file is in the ``manifest``
+    of the build and its size and modification time haven't changed since
+    then, the digest of the manifest is used instead of reading it."""
+    entry = manifest.get(os.path.relpath(filename, build_path).replace(os.sep, '/'))
+    if entry:
+        stat = os.stat(filename)
+        if stat.st_size == entry.get('size') and stat.st_mtime == entry.get('mtime'):
+            return entry['digest']
+    return get_file_hash(filename)
+
+
+def update_file_digest(digest, filename, name):
+    """Update ``digest`` with the ``name``, permissions and content of
+    ``filename``."""
+    digest.update(six.text_type(name).encode('utf-8'))
+    if os.path.islink(filename) and not os.path.exists(filename):
+        digest.update(six.text_type(os.readlink(filename)).encode('utf-8'))
+        return
+    digest.update(six.text_type(os.stat(filename).st_mode & 0o777).encode('utf-8'))
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+
+
+def link_tree(source, destination, files=None):
+    """Populate ``destination`` with the content of ``source`` using
+    hardlinks, falling back to copying files if hardlinks are not possible
+    (e.g. both directories are in different devices). Files already present
+    in ``destination`` are replaced. If ``files`` is provided, only those
+    paths (relative to ``source``) are populated.
+
+    Because of the hardlinks, files in ``destination`` must not be modified
+    in place, but only replaced or deleted."""
+    if files is None:
+        files = []
+        for basedir, dirs, filenames in os.walk(source):
+            relative = os.path.relpath(basedir, source)
+            links = [d for d in dirs if os.path.islink(os.path.join(basedir, d))]
+            files.extend([os.path.normpath(os.path.join(relative, f)) for f in filenames + links])
+
+    for name in files:
+        path, target_path = os.path.join(source, name), os.path.join(destination, name)
+        target = os.path.dirname(target_path)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        if os.path.isdir(target_path) and not os.path.islink(target_path):
+            shutil.rmtree(target_path)
+        elif os.path.lexists(target_path):
+            os.remove(target_path)
+
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), target_path)
+            continue
+        try:
+            os.link(path, target_path)
+        except (OSError, AttributeError):
+            shutil.copy2(path, target_path)
+
+
+# Files gordon never includes in the code of a lambda. Patterns starting
+# with ``/`` only match top-level files, the same way ``cp -Rf *`` would.
+DEFAULT_IGNORE_PATTERNS = (
+    '/.*',
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '__pycache__/',
+    '*.pyc',
+    '.DS_Store',
+    '*.swp',
+    '*~',
+)
+
+
+def load_ignore_patterns(*filenames):
+    """Returns the list of patterns defined in all ``filenames`` which
+    exist. Blank lines and lines starting with ``#`` are ignored."""
+    patterns = []
+    for filename in filenames:
+        if not os.path.isfile(filename):
+            continue
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    patterns.append(line)
+    return patterns
+
+
+def is_ignored(path, is_dir, patterns):
+    """Returns if the relative ``path`` matches ``patterns``. This is a
+    subset of ``.gitignore``; Patterns without ``/`` match the name of the
+    file in any directory, patterns with ``/`` match the whole path, a
+    trailing ``/`` only matches directories and a leading ``!`` includes
+    again a previously ignored path. The last matching pattern wins."""
+    ignored = False
+    name = path.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        negate = pattern.startswith('!')
+        pattern = pattern.lstrip('!')
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip('/')
+        if '/' in pattern:
+            matched = fnmatch.fnmatchcase(path, pattern.lstrip('/'))
+        else:
+            matched = fnmatch.fnmatchcase(name, pattern)
+        if matched:
+            ignored = not negate
+    return ignored
+
+
+def walk_files(root, patterns=()):
+    """Returns the sorted list of paths (relative to ``root``) of all files
+    within ``root`` which are not ignored by ``patterns``."""
+    files = []
+    for basedir, dirs, filenames in os.walk(root):
+        relative = os.path.relpath(basedir, root).replace(os.sep, '/')
+        relative = '' if relative == '.' else '{}/'.format(relative)
+        dirs[:] = sorted([d for d in dirs if not is_ignored(relative + d, True, patterns)])
+        files.extend([relative + f for f in filenames if not is_ignored(relative + f, False, patterns)])
+    return sorted(files)
+
+
+def get_workspace():
+    """Returns the path of the directory gordon uses to store temporary
+    files and caches."""
+    return os.path.join(os.path.expanduser("~"), '.gordon')
+
+
+def get_human_size(size):
+    """Returns ``size`` bytes in a human readable format."""
+    if size < 1024:
+        return "{}B".format(size)
+    for unit in ('KB', 'MB'):
+        size /= 1024.0
+        if size < 1024:
+            return "{:.1f}{}".format(size, unit)
+    return "{:.1f}GB".format(size / 1024.0)
+
+
+def parse_size(size):
+    """Returns ``size`` in bytes. Sizes are a number of bytes, optionally
+    followed by K, M or G (for example 500M or 2G)."""
+    if isinstance(size, six.integer_types):
+        return size
+    match = re.match(r'^(\d+)([KMG]?)B?$', six.text_type(size).strip().upper())
+    if not match:
+        raise ValueError("Invalid size {}".format(size))
+    number, unit = match.groups()
+    return int(number) * 1024 ** ('', 'K', 'M', 'G').index(unit)
+
+
+def wait_process(process):
+    """Wait for ``process`` to exit and return its exit code and its peak
+    resident memory in bytes (``None`` if it's not available), including
+    the processes it started."""
+    if not hasattr(os, 'wait4') or process.returncode is not None:
+        return process.wait(), None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    # ru_maxrss is reported in bytes in OSX, and KB everywhere else.
+    return process.returncode, usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
 def validate_code_bucket(name):
     """
     Code bucket variable is going to be used as part of a bucket name with
@@ -193,36 +419,69 @@ def convert_cloudformation_types(data):
     return cf_data
 
 
-def fix_troposphere_references(template):
-    """"Tranverse the troposphere ``template`` looking missing references.
-    Fix them by adding a new parameter for those references."""
+def get_troposphere_references(template):
+    """Tranverse the troposphere ``template`` collecting all references.
+    Returns a list of ``[name, type]`` in the order they were found."""
+    references = []
 
-    def _fix_references(value):
+    def _collect_references(value):
         if isinstance(value, troposphere.Ref):
             name = value.data['Ref']
-            if name not in (list(template.parameters.keys()) + list(template.resources.keys())) and not name.startswith('AWS::'):
-                template.add_parameter(
-                    troposphere.Parameter(
-                        name,
-                        Type=getattr(value, '_type', 'String'),
-                    )
-                )
+            if not name.startswith('AWS::'):
+                references.append([name, getattr(value, '_type', 'String')])
 
         elif isinstance(value, troposphere.Join):
             for v in value.data['Fn::Join'][1]:
-                _fix_references(v)
+                _collect_references(v)
 
         elif isinstance(value, troposphere.BaseAWSObject):
             for _, v in six.iteritems(value.properties):
-                _fix_references(v)
+                _collect_references(v)
 
     for _, resource in six.iteritems(template.resources):
         for _, value in six.iteritems(resource.properties):
-            _fix_references(value)
+            _collect_references(value)
+
+    return references
+
+
+def fix_troposphere_references(template):
+    """"Tranverse the troposphere ``template`` looking missing references.
+    Fix them by adding a new parameter for those references."""
+
+    for name, type_ in get_troposphere_references(template):
+        if name not in (list(template.parameters.keys()) + list(template.resources.keys())):
+            template.add_parameter(
+                troposphere.Parameter(
+                    name,
+                    Type=type_,
+                )
+            )
 
     return template
 
 
+def get_object_digest(*objects):
+    """Returns a digest of ``objects``, which could be any combination of
+    settings values (dicts, lists, strings, numbers or troposphere objects).
+    Dictionaries are digested in a consistent order."""
+
+    def _canonical(obj):
+        if isinstance(obj, dict):
+            return sorted([[six.text_type(k), _canonical(v)] for k, v in six.iteritems(obj)])
+        elif isinstance(obj, (list, tuple)):
+            return [_canonical(v) for v in obj]
+        elif hasattr(obj, 'to_dict'):
+            return _canonical(obj.to_dict())
+        elif obj is None or isinstance(obj, (bool, float) + six.integer_types + six.string_types):
+            return obj
+        return repr(obj)
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps(_canonical(objects)).encode('utf-8'))
+    return digest.hexdigest()
+
+
 def lambda_friendly_name_to_grn(name, alias='current'):
     return 'lambda:{}:{}'.format(name.replace('.', ':'), alias)
 
@@ -260,9 +519,45 @@ def filter_context_for_template(context, template_body):
     return dict(parameters)
 
 
-def upload_to_s3(bucket, key, data):
+# Settings of ``s3-transfer`` with the option of ``TransferConfig`` they
+# configure, and how to parse them.
+TRANSFER_SETTINGS = (
+    ('multipart-threshold', 'multipart_threshold', parse_size),
+    ('multipart-chunksize', 'multipart_chunksize', parse_size),
+    ('max-concurrency', 'max_concurrency', int),
+    ('max-bandwidth', 'max_bandwidth', parse_size),
+)
+
+
+def get_transfer_config(settings=None, **options):
+    """Returns the ``TransferConfig`` gordon uses to upload files into s3.
+
+    Each option is taken from ``options`` (for example, from the command
+    line), then from ``settings`` (the ``s3-transfer`` settings of the
+    project), or otherwise left to the default of boto3."""
+    settings = settings or {}
+    config = {}
+    for setting, option, parse in TRANSFER_SETTINGS:
+        value = options.get(option)
+        if value is None and settings.get(setting) is not None:
+            try:
+                value = parse(settings[setting])
+            except (TypeError, ValueError):
+                value = 0
+            if value <= 0:
+                raise exceptions.ValidationError(
+                    "Invalid s3-transfer {}: {}".format(setting, settings[setting])
+                )
+        if value is not None:
+            config[option] = value
+    return TransferConfig(**config)
+
+
+def upload_to_s3(bucket, key, data, transfer_config=None):
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
     s3 = boto3.resource('s3')
-    s3.Bucket(bucket).put_object(Key=key, Body=data)
+    s3.Bucket(bucket).upload_fileobj(io.BytesIO(data), key, Config=transfer_config)
     return 'https://s3.amazonaws.com/{}/{}'.format(bucket, key)
 
 
@@ -288,7 +583,8 @@ def create_stack(name, template_filename, bucket, context, timeout_in_minutes, *
         extra['TemplateURL'] = upload_to_s3(
             bucket,
             get_template_s3_key(template_filename),
-            template_body
+            template_body,
+            transfer_config=kwargs.get('transfer_config')
         )
     else:
         extra['TemplateBody'] = template_body
@@ -323,7 +619,8 @@ def update_stack(name, template_filename, bucket, context, **kwargs):
     if bucket:
         extra['TemplateURL'] = upload_to_s3(
             bucket, get_template_s3_key(template_filename),
-            template_body
+            template_body,
+            transfer_config=kwargs.get('transfer_config')
         )
     else:
         extra['TemplateBody'] = template_body
@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""Warm local invocations of lambdas.
+
+Loaders of runtimes which support it can run in batch mode: they import the
+handler once and invoke it once per json line of their stdin, writing one
+json line per invocation into their stdout with its output (or error),
+duration, billed duration and the peak memory of the process. Loaders stop
+invocations which exceed the timeout of the lambda, reporting a timeout
+error before exiting. If the memory of the lambda is enforced, the same
+happens with invocations which run out of it. ``Worker`` drives one of these
+processes, ``WarmLambda`` keeps one warm for ``gordon serve``, ``WorkerPool``
+keeps several of them warm for ``gordon serve-api`` and ``benchmark`` runs
+several of them concurrently for ``gordon bench``.
+"""
+import os
+import json
+import glob
+import math
+import time
+import signal
+import shutil
+import threading
+import subprocess
+
+from six.moves import BaseHTTPServer, socketserver
+
+from . import utils
+from . import exceptions
+
+# Seconds we wait, on top of the timeout of the lambda, before killing a
+# loader which hasn't stopped a timed out invocation itself. Cold
+# invocations are allowed INIT_TIMEOUT more seconds to load the handler.
+TIMEOUT_GRACE = 5
+INIT_TIMEOUT = 10
+
+# Lambda bills the duration of invocations rounded up to the nearest ms.
+# The loaders of gordon are given this granularity by ``Lambda.get_run_command``.
+BILLING_GRANULARITY = 1
+
+OUT_OF_MEMORY_ERROR = u"Runtime exited with error: out of memory (exceeded the limit of {} MB)"
+
+
+def get_billed_duration(duration):
+    """Returns ``duration`` (in ms) rounded up to what Lambda bills."""
+    return max(int(math.ceil(duration / BILLING_GRANULARITY)), 1) * BILLING_GRANULARITY
+
+
+def get_out_of_memory_result(lambda_, code, max_rss):
+    """Returns the result of the invocation of ``lambda_`` whose loader
+    exited with ``code`` after using up to ``max_rss`` bytes, if it was
+    because it ran out of the memory of the lambda."""
+    memory = lambda_.get_memory()
+    if code == 0 or not max_rss or max_rss < memory * 1024 * 1024:
+        return None
+    return {
+        'error': OUT_OF_MEMORY_ERROR.format(memory),
+        'out_of_memory': True,
+        'max_rss': max_rss,
+    }
+
+
+class Worker(object):
+    """Loader of ``lambda_`` running in batch mode within ``path``, which
+    must contain the collected code of the lambda (see ``Lambda.collect``).
+
+    Invocations are sequential. ``invoke`` returns the result reported by
+    the loader plus ``latency``: How long it took (ms) since the event was
+    sent until the result was received. The first invocation is ``cold``, as
+    it waits for the loader to start and load the handler.
+
+    Once an invocation times out (or runs out of memory, if
+    ``enforce_memory``), the loader exits and the worker is no longer
+    ``alive``, the same way Lambda restarts the runtime. If the loader
+    doesn't stop the invocation itself, it is killed."""
+
+    def __init__(self, lambda_, path, stderr=None, enforce_memory=False):
+        self.lambda_ = lambda_
+        self.path = path
+        self.enforce_memory = enforce_memory
+        self.invocations = 0
+        self.process = subprocess.Popen(
+            lambda_.get_run_command(path, batch=True, enforce_memory=enforce_memory),
+            shell=True,
+            cwd=path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            # Run the loader in its own process group, so we can kill it
+            # together with the shell which started it.
+            preexec_fn=getattr(os, 'setsid', None)
+        )
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except OSError:
+            pass
+
+    def invoke(self, event):
+        timeout = self.lambda_.get_timeout()
+        killed = []
+
+        def expire():
+            killed.append(True)
+            self.kill()
+
+        timer = threading.Timer(timeout + TIMEOUT_GRACE + (INIT_TIMEOUT if self.invocations == 0 else 0), expire)
+        timer.daemon = True
+        start = time.time()
+        timer.start()
+        try:
+            try:
+                self.process.stdin.write((json.dumps(event) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+            except (IOError, OSError):
+                pass
+            line = self.process.stdout.readline()
+        finally:
+            timer.cancel()
+
+        if line:
+            result = json.loads(line.decode('utf-8'))
+            if result.get('timed_out') or result.get('out_of_memory'):
+                # The loader exits right after reporting these errors.
+                self.process.wait()
+        elif killed:
+            self.process.wait()
+            duration = (time.time() - start) * 1000
+            result = {
+                'error': 'Task timed out after {:.2f} seconds'.format(timeout),
+                'timed_out': True,
+                'duration': round(duration, 3),
+                'billed_duration': get_billed_duration(timeout * 1000),
+            }
+        else:
+            code, max_rss = utils.wait_process(self.process)
+            result = self.enforce_memory and get_out_of_memory_result(self.lambda_, code, max_rss)
+            if not result:
+                raise exceptions.LambdaWorkerError(self.lambda_.name, code)
+            duration = (time.time() - start) * 1000
+            result['duration'] = round(duration, 3)
+            result['billed_duration'] = get_billed_duration(duration)
+
+        result['latency'] = round((time.time() - start) * 1000, 3)
+        result['cold'] = self.invocations == 0
+        self.invocations += 1
+        return result
+
+    def close(self):
+        """Stop the loader once it has finished the current invocation."""
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class WarmLambda(object):
+    """Keeps the collected code of ``lambda_`` and a ``Worker`` with its
+    handler loaded between invocations. Before each invocation, the source
+    of the lambda is checked for changes. Only if there are any, the code is
+    collected again and a new worker started."""
+
+    def __init__(self, lambda_, stderr=None, enforce_memory=False):
+        self.lambda_ = lambda_
+        self.stderr = stderr
+        self.enforce_memory = enforce_memory
+        self.path = None
+        self.worker = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def reload(self):
+        signature = self.lambda_.get_source_signature()
+        path = self.lambda_.collect()
+        worker = Worker(self.lambda_, path, stderr=self.stderr, enforce_memory=self.enforce_memory)
+        self.close()
+        self.path, self.worker, self._signature = path, worker, signature
+
+    def invoke(self, event):
+        """Invoke the lambda with ``event`` and return its result. If the
+        lambda needed to be reloaded, the result is ``reloaded``."""
+        with self._lock:
+            reloaded = self.worker is None or self.lambda_.get_source_signature() != self._signature
+            if reloaded:
+                self.reload()
+            elif not self.worker.alive:
+                # The previous invocation timed out or ran out of memory.
+                self.worker.close()
+                self.worker = Worker(self.lambda_, self.path, stderr=self.stderr, enforce_memory=self.enforce_memory)
+            try:
+                result = self.worker.invoke(event)
+            except exceptions.LambdaWorkerError:
+                # Start a new worker on the next invocation.
+                self.close()
+                raise
+            result['reloaded'] = reloaded
+            return result
+
+    def close(self):
+        if self.worker:
+            self.worker.close()
+            self.worker = None
+        if self.path:
+            shutil.rmtree(self.path)
+            self.path = None
+
+
+class WorkerPool(object):
+    """Same as ``WarmLambda``, but with up to ``size`` workers invoking
+    ``lambda_`` concurrently. Workers are started on demand and reused
+    afterwards. If the source of the lambda changes, the code is collected
+    again and workers running the previous code are stopped as soon as they
+    finish their current invocation."""
+
+    def __init__(self, lambda_, size=1, stderr=None, enforce_memory=False):
+        self.lambda_ = lambda_
+        self.size = size
+        self.stderr = stderr
+        self.enforce_memory = enforce_memory
+        self.path = None
+        self._signature = None
+        self._idle = []
+        self._workers = 0
+        self._paths = {}
+        self._condition = threading.Condition()
+
+    def reload(self):
+        with self._condition:
+            self._reload()
+
+    def _reload(self):
+        signature = self.lambda_.get_source_signature()
+        path = self.lambda_.collect()
+        previous, self.path, self._signature = self.path, path, signature
+        self._paths[path] = 0
+        self._workers = 0
+        while self._idle:
+            self._retire(self._idle.pop())
+        self._remove_path(previous)
+        self._condition.notify_all()
+
+    def _acquire(self):
+        with self._condition:
+            reloaded = self.path is None or self.lambda_.get_source_signature() != self._signature
+            if reloaded:
+                self._reload()
+            while not self._idle and self._workers >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop(), reloaded
+            worker = Worker(self.lambda_, self.path, stderr=self.stderr, enforce_memory=self.enforce_memory)
+            self._workers += 1
+            self._paths[self.path] += 1
+            return worker, reloaded
+
+    def _release(self, worker, discard=False):
+        with self._condition:
+            if discard or worker.path != self.path or not worker.alive:
+                self._retire(worker)
+            else:
+                self._idle.append(worker)
+            self._condition.notify()
+
+    def _retire(self, worker):
+        worker.close()
+        if worker.path == self.path:
+            self._workers -= 1
+        if worker.path in self._paths:
+            self._paths[worker.path] -= 1
+            if worker.path != self.path:
+                self._remove_path(worker.path)
+
+    def _remove_path(self, path):
+        """Remove ``path`` once no worker is using it."""
+        if path in self._paths and not self._paths[path]:
+            del self._paths[path]
+            shutil.rmtree(path)
+
+    def invoke(self, event):
+        """Invoke the lambda with ``event`` using the first idle worker and
+        return its result. If the lambda needed to be reloaded, the result is
+        ``reloaded``."""
+        worker, reloaded = self._acquire()
+        try:
+            result = worker.invoke(event)
+        except Exception:
+            # Replace the worker on the next invocation.
+            self._release(worker, discard=True)
+            raise
+        self._release(worker)
+        result['reloaded'] = reloaded
+        return result
+
+    def close(self):
+        with self._condition:
+            while self._idle:
+                self._retire(self._idle.pop())
+            for path in list(self._paths):
+                shutil.rmtree(path)
+            self._paths, self.path, self._workers = {}, None, 0
+
+
+class InvokeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Invoke the lambda of the server with the json body of each ``POST``
+    request and respond with its result."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            event = json.loads(body.decode('utf-8') or 'null')
+        except ValueError as exc:
+            return self._respond(400, {'error': 'Invalid json event: {}'.format(exc)})
+
+        try:
+            result = self.server.warm_lambda.invoke(event)
+        except exceptions.BaseGordonException as exc:
+            return self._respond(500, {'error': exc.get_hint()})
+
+        self._respond(200, result)
+        if self.server.log:
+            self.server.log(result)
+
+    def _respond(self, status, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPServer(BaseHTTPServer.HTTPServer):
+
+    def __init__(self, address, warm_lambda, log=None):
+        self.warm_lambda = warm_lambda
+        self.log = log
+        BaseHTTPServer.HTTPServer.__init__(self, address, InvokeRequestHandler)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """Same as ``HTTPServer``, but listening on a unix socket
+    (``curl --unix-socket``)."""
+
+    def __init__(self, path, warm_lambda, log=None):
+        self.warm_lambda = warm_lambda
+        self.log = log
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, InvokeRequestHandler)
+
+    def get_request(self):
+        request, _ = socketserver.UnixStreamServer.get_request(self)
+        return request, ('unix', 0)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def create_server(warm_lambda, host='127.0.0.1', port=8080, socket=None, log=None):
+    """Returns a server which invokes ``warm_lambda`` for each request it
+    receives, either on ``host:port`` or on the unix ``socket``."""
+    if socket:
+        return UnixHTTPServer(socket, warm_lambda, log=log)
+    return HTTPServer((host, port), warm_lambda, log=log)
+
+
+def format_result(result):
+    """Returns a one line summary of an invocation ``result``."""
+    return u"{} {:.1f}ms (handler {:.1f}ms{}{}{})".format(
+        u"✗" if 'error' in result else u"✓",
+        result['latency'],
+        result['duration'],
+        u", billed {}ms".format(result['billed_duration']) if 'billed_duration' in result else u"",
+        u", cold" if result.get('cold') else u"",
+        u", reloaded" if result.get('reloaded') else u"",
+    ) + (u": {}".format(result['error']) if 'error' in result else u"")
+
+
+def load_events(path):
+    """Returns the events in ``path``, either a file or a directory with
+    several of them (sorted by name). ``.json`` files contain one event and
+    ``.ndjson``/``.jsonl`` files one event per line."""
+    if os.path.isdir(path):
+        filenames = sorted(
+            f for f in glob.glob(os.path.join(path, '*'))
+            if os.path.splitext(f)[1] in ('.json', '.ndjson', '.jsonl')
+        )
+    else:
+        filenames = [path]
+
+    events = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            if os.path.splitext(filename)[1] == '.json':
+                events.append(json.load(f))
+            else:
+                events.extend([json.loads(line) for line in f if line.strip()])
+    return events
+
+
+def percentile(values, percent):
+    """Returns the ``percent`` percentile of the sorted list ``values``
+    using the nearest-rank method."""
+    if not values:
+        return None
+    index = max(int(-(-len(values) * percent // 100)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(values, percents=(50, 90, 99)):
+    values = sorted(values)
+    summary = {'count': len(values)}
+    if values:
+        summary['min'] = values[0]
+        summary['max'] = values[-1]
+        summary['mean'] = round(sum(values) / len(values), 3)
+        for percent in percents:
+            summary['p{}'.format(percent)] = percentile(values, percent)
+    return summary
+
+
+def benchmark(lambda_, events, concurrency=1, iterations=100, stderr=None, enforce_memory=False):
+    """Invoke ``lambda_`` ``iterations`` times using ``concurrency`` workers
+    at the same time, cycling through ``events``. The code of the lambda is
+    collected once, and shared by all workers.
+
+    The first invocation of each worker is a cold start: its latency
+    includes starting the worker and loading the handler. Workers which time
+    out or run out of memory are replaced, so the first invocation of the
+    new worker is a cold start as well. The rest are warm invocations.
+    Returns a report with latency percentiles of both, the throughput and
+    the peak memory of each worker."""
+    concurrency = max(min(concurrency, iterations), 1)
+    path = lambda_.collect()
+    lock = threading.Lock()
+    counter = [0]
+    reports = [
+        {'worker': i + 1, 'invocations': 0, 'errors': 0, 'timeouts': 0, 'out_of_memory': 0, 'cold_starts': 0,
+         'cold': [], 'init': [], 'warm': [], 'max_rss': None}
+        for i in range(concurrency)
+    ]
+    failures = []
+
+    def next_event():
+        with lock:
+            if counter[0] >= iterations or failures:
+                return None
+            counter[0] += 1
+            return events[(counter[0] - 1) % len(events)]
+
+    def run(report):
+        worker, event = None, next_event()
+        try:
+            start = time.time()
+            worker = Worker(lambda_, path, stderr=stderr, enforce_memory=enforce_memory)
+            while event is not None:
+                result = worker.invoke(event)
+                if not result['cold']:
+                    report['warm'].append(result['latency'])
+                else:
+                    report['cold'].append(round((time.time() - start) * 1000, 3))
+                    if result.get('init_duration') is not None:
+                        report['init'].append(result['init_duration'])
+                    report['cold_starts'] += 1
+                    if 'cold_start' not in report:
+                        report['cold_start'] = report['cold'][0]
+                        report['init_duration'] = result.get('init_duration')
+                report['invocations'] += 1
+                report['errors'] += 'error' in result
+                report['timeouts'] += bool(result.get('timed_out'))
+                report['out_of_memory'] += bool(result.get('out_of_memory'))
+                report['max_rss'] = max(result.get('max_rss') or 0, report['max_rss'] or 0) or None
+                event = next_event()
+                if event is not None and not worker.alive:
+                    # Like Lambda, start a new worker after a timeout or
+                    # running out of memory.
+                    worker.close()
+                    start = time.time()
+                    worker = Worker(lambda_, path, stderr=stderr, enforce_memory=enforce_memory)
+        except Exception as exc:
+            failures.append(exc)
+        finally:
+            if worker:
+                worker.close()
+
+    threads = [threading.Thread(target=run, args=(report,)) for report in reports]
+    start = time.time()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(path)
+    wall = time.time() - start
+    if failures:
+        raise failures[0]
+
+    cold, init, warm = [], [], []
+    for report in reports:
+        cold.extend(report.pop('cold'))
+        init.extend(report.pop('init'))
+        warm.extend(report.pop('warm'))
+    invocations = sum(r['invocations'] for r in reports)
+    return {
+        'lambda': lambda_.name,
+        'concurrency': concurrency,
+        'iterations': invocations,
+        'events': len(events),
+        'errors': sum(r['errors'] for r in reports),
+        'timeouts': sum(r['timeouts'] for r in reports),
+        'out_of_memory': sum(r['out_of_memory'] for r in reports),
+        'wall': round(wall, 3),
+        'throughput': round(invocations / wall, 3) if wall else None,
+        'cold_start': summarize(cold),
+        'init_duration': summarize(init),
+        'warm': summarize(warm),
+        'workers': reports,
+    }
@@ -6,7 +6,8 @@ import requests
 
 from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest
 from gordon.utils import valid_cloudformation_name
-from gordon import utils
+from gordon import utils, emulators
+from gordon.core import ProjectServeApi
 
 
 class IntegrationTest(BaseIntegrationTest):
@@ -83,3 +84,22 @@ class BuildTest(BaseBuildTest):
         self.assertBuild('0001_project', '0001_p.json')
         self.assertBuild('0001_project', '0002_pr_r.json')
         self.assertBuild('0001_project', '0003_r.json')
+
+    def test_0001_project_serve_api(self):
+        with utils.cd(os.path.join(self.test_path, '0001_project')):
+            project = ProjectServeApi(path='.', stdin=None, api_name='helloapi')
+        self.assertEqual(sorted(project.lambdas), ['pyexample.byepy', 'pyexample.hellopy'])
+        self.assertEqual([a.name for a in project.applications],
+                         ['contrib_helpers', 'contrib_lambdas', 'pyexample'])
+
+        emulator = emulators.ApiGatewayEmulator(project.api, {})
+        for method, path, resource in (('GET', '/', '/'),
+                                       ('GET', '/shop/2/', '/shop/{item}'),
+                                       ('POST', '/complex', '/complex'),
+                                       ('POST', '/', None),
+                                       ('GET', '/shop', None)):
+            route, _ = emulator.resolve(method, path)
+            self.assertEqual(route and route.path, resource)
+        route, parameters = emulator.resolve('GET', '/shop/2')
+        self.assertEqual((route.lambda_name, parameters), ('pyexample.hellopy', {'item': '2'}))
+        self.assertEqual(emulator.resolve('POST', '/complex')[0].lambda_name, 'pyexample.byepy')
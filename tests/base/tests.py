@@ -1,6 +1,18 @@
 import os
+import json
+import shutil
+import tempfile
+try:
+    from mock import patch
+except ImportError:
+    from unittest.mock import patch
 
 from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest
+from gordon import utils
+from gordon import profiling
+from gordon import exceptions
+from gordon.core import ProjectBuild, ProjectRun
+from gordon.resources.lambdas import Lambda
 
 
 class IntegrationTest(BaseIntegrationTest):
@@ -18,3 +30,100 @@ class BuildTest(BaseBuildTest):
         self.assertBuild('0001_project', '0001_p.json')
         self.assertBuild('0001_project', '0002_pr_r.json')
         self.assertBuild('0001_project', '0003_r.json')
+
+    def test_0001_project_jobs(self):
+        builds = []
+        for jobs in ('1', '4'):
+            self._test_project_step('0001_project', '--jobs={}'.format(jobs))
+            build_path = os.path.join(self.test_path, '0001_project', '_build')
+            build = {}
+            for basedir, dirs, files in os.walk(build_path):
+                for filename in files:
+                    path = os.path.join(basedir, filename)
+                    build[os.path.relpath(path, build_path)] = utils.get_file_hash(path)
+            # The manifest is the same except for the modification times.
+            build[utils.MANIFEST_FILE] = dict(
+                (name, dict(entry, mtime=None)) for name, entry in utils.load_manifest(build_path).items()
+            )
+            builds.append(build)
+        self.assertEqual(builds[0], builds[1])
+
+    def test_0001_project_reuse_fragments(self):
+        register_resources_template = Lambda.register_resources_template
+        for args, called in ((('--no-cache',), True), ((), False)):
+            with patch.object(Lambda, 'register_resources_template', autospec=True,
+                              side_effect=register_resources_template) as register:
+                self._test_project_step('0001_project', *args)
+                self.assertEqual(register.called, called)
+            self.assertBuild('0001_project', '0001_p.json')
+            self.assertBuild('0001_project', '0002_pr_r.json')
+            self.assertBuild('0001_project', '0003_r.json')
+
+    def test_0001_project_reuse_fragments_references(self):
+        # contrib_helpers references the version lambda of contrib_lambdas, so
+        # if contrib_lambdas changes, the fragments of both are built again.
+        self._test_project_step('0001_project')
+        get_fingerprint = ProjectBuild._get_application_fingerprint
+
+        def _get_application_fingerprint(project, application):
+            fingerprint = get_fingerprint(project, application)
+            return fingerprint + '-changed' if application.name == 'contrib_lambdas' else fingerprint
+
+        register_resources_template = Lambda.register_resources_template
+        with patch.object(ProjectBuild, '_get_application_fingerprint', _get_application_fingerprint):
+            with patch.object(Lambda, 'register_resources_template', autospec=True,
+                              side_effect=register_resources_template) as register:
+                self._test_project_step('0001_project')
+        self.assertEqual(
+            sorted(call[0][0].in_project_name for call in register.call_args_list),
+            ['lambda:contrib_helpers:sleep', 'lambda:contrib_lambdas:version']
+        )
+        self.assertBuild('0001_project', '0003_r.json')
+
+    def test_0001_project_profile(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        profile = os.path.join(path, 'profile.json')
+        self._test_project_step('0001_project', '--no-cache', '--profile', profile)
+        with open(profile) as f:
+            report = json.load(f)
+        names = set([s['name'] for s in report['spans']])
+        for name in ('lambdas code', 'resources template', 'collect', 'zip',
+                     'PythonLambda.register_resources_template'):
+            self.assertIn(name, names)
+        self.assertIn('hook', report['summary'])
+        for span in report['spans']:
+            self.assertGreaterEqual(span['process_peak_memory'], span['peak_memory_increase'])
+
+        with open(profiling.get_trace_filename(profile)) as f:
+            trace = json.load(f)
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(events), len(report['spans']))
+        self.assertFalse(profiling.is_enabled())
+
+    def test_0001_project_stage_hooks(self):
+        with utils.cd(os.path.join(self.test_path, '0001_project')):
+            project = ProjectBuild(path='.', stdin=None)
+        stage_hooks = dict(
+            (stage, [(t, call_type_hook, [(c.name, [r.name for r in rs]) for c, rs in containers])
+                     for t, _, call_type_hook, containers in hooks])
+            for stage, hooks in project._stage_hooks.items()
+        )
+        lambdas = [('contrib_helpers', ['sleep']), ('contrib_lambdas', ['version'])]
+        self.assertEqual(stage_hooks['pre_project'], [])
+        self.assertEqual(stage_hooks['project'], [('lambdas', True, [])])
+        self.assertEqual(stage_hooks['pre_resources'], [('lambdas', True, lambdas)])
+        self.assertEqual(stage_hooks['resources'], [('lambdas', True, lambdas)])
+        self.assertEqual(stage_hooks['post_resources'], [])
+
+    def test_0001_project_run_loads_one_lambda(self):
+        with utils.cd(os.path.join(self.test_path, '0001_project')):
+            project = ProjectRun(path='.', stdin=None, lambda_name='contrib_lambdas.version')
+            self.assertEqual([a.name for a in project.applications], ['contrib_lambdas'])
+            self.assertEqual([l.in_project_name for l in project.get_resources('lambdas')],
+                             ['lambda:contrib_lambdas:version'])
+            self.assertEqual(project.lambda_.name, 'version')
+
+            for name in ('contrib_lambdas.unknown', 'unknown.version', 'version'):
+                with self.assertRaises(exceptions.LambdaNotFound):
+                    ProjectRun(path='.', stdin=None, lambda_name=name)
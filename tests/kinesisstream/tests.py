@@ -2,7 +2,8 @@ import os
 
 from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest
 from gordon.utils import valid_cloudformation_name
-from gordon import utils
+from gordon import utils, exceptions
+from gordon.core import ProjectReplay
 
 
 class IntegrationTest(BaseIntegrationTest):
@@ -32,3 +33,17 @@ class BuildTest(BaseBuildTest):
         self.assertBuild('0001_project', '0001_p.json')
         self.assertBuild('0001_project', '0002_pr_r.json')
         self.assertBuild('0001_project', '0003_r.json')
+
+    def test_0001_project_replay(self):
+        with utils.cd(os.path.join(self.test_path, '0001_project')):
+            project = ProjectReplay(path='.', stdin=None, stream_name='kinesis::kinesis_integration',
+                                    records='records.ndjson')
+            self.assertEqual(project.stream.in_project_name, 'kinesis-stream::kinesis_integration')
+            self.assertEqual(project.stream.get_batch_size(), 1)
+            self.assertEqual(project.lambda_.in_project_name, 'lambda:kinesisconsumer:consumer')
+            self.assertEqual([a.name for a in project.applications], ['kinesisconsumer'])
+
+            for name in ('kinesis::unknown', 'dynamodb::kinesis_integration', 'kinesis:unknown:kinesis_integration'):
+                with self.assertRaises(exceptions.StreamNotFoundError):
+                    ProjectReplay(path='.', stdin=None, stream_name=name, records='records.ndjson')
+
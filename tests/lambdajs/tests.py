@@ -1,6 +1,6 @@
 import boto3
 
-from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest
+from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest, REPORT_LINE
 from gordon.utils import valid_cloudformation_name
 from gordon import utils
 
@@ -43,5 +43,6 @@ class BuildTest(BaseBuildTest):
             ['Loading function',
             'value1 = value1',
             'output: value1',
+            REPORT_LINE,
             '']
         )
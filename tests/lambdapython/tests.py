@@ -1,4 +1,4 @@
-from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest
+from gordon.utils_tests import BaseIntegrationTest, BaseBuildTest, REPORT_LINE
 from gordon.utils import valid_cloudformation_name
 from gordon import utils
 
@@ -41,5 +41,6 @@ class BuildTest(BaseBuildTest):
             ['Loading function',
             'value1 = value1',
             'output: value1',
+            REPORT_LINE,
             '']
         )
@@ -1,13 +1,32 @@
-import unittest
+import os
+import zlib
+import time
 import json
+import base64
+import sys
+import shutil
+import tempfile
+import zipfile
+import threading
+import subprocess
+from distutils.spawn import find_executable
+import unittest
 
 try:
     from mock import patch, Mock
 except ImportError:
     from unittest.mock import patch, Mock
 
-from gordon.actions import Parameter, ActionsTemplate, GetAttr, UploadToS3
-from gordon import exceptions, protocols
+import six
+from six.moves.urllib.request import urlopen, Request
+from six.moves.urllib.error import HTTPError
+
+from gordon.actions import Parameter, ActionsTemplate, GetAttr, Ref, UploadToS3, InjectContextAndUploadToS3
+from gordon import exceptions, protocols, caches, utils, archive, workers, emulators
+from gordon.resources.lambdas import PythonLambda, NodeLambda, JavaLambda
+from gordon.resources.apigateway import ApiGateway
+from gordon.resources.kinesis import Kinesis
+from gordon.resources.dynamodb import Dynamodb
 
 
 class TestProtocols(unittest.TestCase):
@@ -146,6 +165,56 @@ class TestActions(unittest.TestCase):
 
         self.assertEqual(at.apply(context, project), {'version': '1234', 'pi': '3.1416'})
 
+    def _sleepy_action(self, name, delay, started, error=None):
+        def apply(context, project):
+            started.append(name)
+            time.sleep(delay)
+            project.puts(name)
+            if error:
+                raise error
+            return {'version': name}
+        action = Mock()
+        action.name = name
+        action.apply.side_effect = apply
+        return action
+
+    def test_actions_template_parallelizable(self):
+        project, started = Mock(), []
+        at = ActionsTemplate(parallelizable=True)
+        for i in range(6):
+            at.add(self._sleepy_action('upload{}'.format(i), 0.2 if i % 2 else 0.4, started))
+            output = Mock()
+            output.name = 'version{}'.format(i)
+            output.value = GetAttr(action='upload{}'.format(i), attr='version')
+            at.add_output(output)
+
+        start = time.time()
+        outputs = at.apply({}, project, jobs=6)
+        self.assertLess(time.time() - start, 1.2)
+        self.assertEqual(outputs, dict(('version{}'.format(i), 'upload{}'.format(i)) for i in range(6)))
+        # Output is printed in the same order as a serial apply would.
+        self.assertEqual([c[0][0] for c in project.puts.call_args_list], ['upload{}'.format(i) for i in range(6)])
+
+    def test_actions_template_parallelizable_errors(self):
+        project, started = Mock(), []
+        at = ActionsTemplate(parallelizable=True)
+        at.add(self._sleepy_action('upload0', 0.1, started, error=ValueError('a')))
+        at.add(self._sleepy_action('upload1', 0.2, started, error=ValueError('b')))
+        at.add(self._sleepy_action('upload2', 0.1, started))
+        at.add(self._sleepy_action('upload3', 0.1, started))
+
+        with self.assertRaises(exceptions.ActionsFailedError) as error:
+            at.apply({}, project, jobs=2)
+        self.assertEqual([name for name, _ in error.exception.args[0]], ['upload0', 'upload1'])
+        # Actions which haven't started once one fails are skipped.
+        self.assertEqual(sorted(started), ['upload0', 'upload1'])
+
+        at = ActionsTemplate(parallelizable=True)
+        at.add(self._sleepy_action('upload0', 0.1, started, error=ValueError('a')))
+        at.add(self._sleepy_action('upload1', 0.1, started))
+        with self.assertRaises(ValueError):
+            at.apply({}, project, jobs=2)
+
     @patch('gordon.actions.boto3.resource')
     @patch('gordon.actions.boto3.client')
     @patch('gordon.actions.utils.get_file_hash')
@@ -162,7 +231,8 @@ class TestActions(unittest.TestCase):
         get_file_hash_mock.return_value = '123'
         resource.Object.return_value.version_id = 'version123'
         context = Mock()
-        project = Mock(region='eu-west-1', build_path='_build')
+        transfer_config = utils.get_transfer_config(multipart_threshold=64 * 1024 * 1024)
+        project = Mock(region='eu-west-1', build_path='_build', transfer_config=transfer_config, manifest={})
 
         u = UploadToS3(name='name', bucket='bucket', key='key', filename='filename.zip')
         output = u.apply(context, project)
@@ -176,7 +246,8 @@ class TestActions(unittest.TestCase):
         )
         resource.Object.return_value.upload_file.assert_called_once_with(
             '_build/filename.zip',
-            ExtraArgs={'Metadata': {'sha1': '123'}}
+            ExtraArgs={'Metadata': {'sha1': '123'}},
+            Config=transfer_config
         )
 
         #
@@ -199,7 +270,8 @@ class TestActions(unittest.TestCase):
         )
         resource.Object.return_value.upload_file.assert_called_once_with(
             '_build/filename.zip',
-            ExtraArgs={'Metadata': {'sha1': '123'}}
+            ExtraArgs={'Metadata': {'sha1': '123'}},
+            Config=transfer_config
         )
 
         #
@@ -219,3 +291,895 @@ class TestActions(unittest.TestCase):
         )
         resource.Object.assert_not_called()
         resource.Object.return_value.upload_file.assert_not_called()
+
+    @patch('gordon.actions.boto3.resource')
+    @patch('gordon.actions.boto3.client')
+    @patch('gordon.actions.utils.get_file_hash')
+    def test_upload_to_s3_manifest(self, get_file_hash_mock, client_mock, resource_mock):
+        build_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, build_path)
+        os.makedirs(os.path.join(build_path, 'code'))
+        filename = os.path.join(build_path, 'code', 'filename.zip')
+        with zipfile.ZipFile(filename, 'w') as zfile:
+            zfile.writestr('code.py', 'print(1)')
+        entry = utils.get_artifact_entry(filename, digest='123')
+        utils.write_manifest(build_path, {'code/filename.zip': entry})
+        client_mock.return_value.head_object.return_value = {'Metadata': {'sha1': '123'}, 'VersionId': 'v1'}
+        get_file_hash_mock.return_value = '124'
+        project = Mock(region='eu-west-1', build_path=build_path, manifest=utils.load_manifest(build_path))
+
+        u = UploadToS3(name='name', bucket='bucket', key='key', filename='code/filename.zip')
+        self.assertEqual(u.apply({}, project)['s3version'], 'v1')
+        get_file_hash_mock.assert_not_called()
+        resource_mock.return_value.Object.assert_not_called()
+
+        # Files which changed since they were built are hashed again.
+        os.utime(filename, (entry['mtime'] + 10, entry['mtime'] + 10))
+        u = UploadToS3(name='name', bucket='bucket', key='key', filename='code/filename.zip')
+        u.apply({}, project)
+        get_file_hash_mock.assert_called_once_with(filename)
+        self.assertTrue(resource_mock.return_value.Object.return_value.upload_file.called)
+
+    @patch('gordon.actions.boto3.resource')
+    @patch('gordon.actions.boto3.client')
+    @patch('gordon.actions.utils.get_file_hash')
+    def test_inject_context_and_upload_to_s3(self, get_file_hash_mock, client_mock, resource_mock):
+        build_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, build_path)
+        filename = os.path.join(build_path, 'filename.zip')
+        with zipfile.ZipFile(filename, 'w') as zfile:
+            zfile.writestr('code.py', 'print(1)')
+        utils.write_manifest(build_path, {'filename.zip': utils.get_artifact_entry(filename, digest='123')})
+        project = Mock(region='eu-west-1', build_path=build_path, manifest=utils.load_manifest(build_path))
+        head_object = client_mock.return_value.head_object
+
+        def upload(context):
+            u = InjectContextAndUploadToS3(name='name', bucket='bucket', key='key', filename='filename.zip',
+                                           context_to_inject={'key': Ref(name='Value')})
+            u.apply(context, project)
+            return u.get_file_hash(filename)
+
+        # Unchanged files are neither read nor written.
+        file_hash = upload({'Value': 'a'})
+        head_object.return_value = {'Metadata': {'sha1': file_hash}, 'VersionId': 'v1'}
+        self.assertEqual(upload({'Value': 'a'}), file_hash)
+        resource_mock.return_value.Object.assert_called_once_with('bucket', 'key')
+        get_file_hash_mock.assert_not_called()
+
+        # The hash depends on the context, which is injected into a temporary copy.
+        uploaded = []
+
+        def upload_file(path, **kwargs):
+            with zipfile.ZipFile(path) as zfile:
+                uploaded.append((path, sorted(zfile.namelist()), zfile.read('.context')))
+        resource_mock.return_value.Object.return_value.upload_file.side_effect = upload_file
+
+        self.assertNotEqual(upload({'Value': 'b'}), file_hash)
+        path, names, context = uploaded[0]
+        self.assertEqual((names, json.loads(context.decode('utf-8'))), (['.context', 'code.py'], {'key': 'b'}))
+        self.assertFalse(os.path.exists(path))
+        with zipfile.ZipFile(filename) as zfile:
+            self.assertEqual(zfile.namelist(), ['code.py'])
+
+    def test_transfer_config(self):
+        config = utils.get_transfer_config()
+        self.assertEqual(config.multipart_threshold, 8 * 1024 * 1024)
+        self.assertEqual(config.max_concurrency, 10)
+
+        settings = {'multipart-threshold': '64M', 'multipart-chunksize': 16777216, 'max-concurrency': 4}
+        config = utils.get_transfer_config(settings, max_concurrency=20, multipart_chunksize=None)
+        self.assertEqual(config.multipart_threshold, 64 * 1024 * 1024)
+        self.assertEqual(config.multipart_chunksize, 16 * 1024 * 1024)
+        self.assertEqual(config.max_concurrency, 20)
+
+        for settings in ({'multipart-threshold': '64X'}, {'max-concurrency': 0}):
+            with self.assertRaises(exceptions.ValidationError):
+                utils.get_transfer_config(settings)
+
+    @patch('gordon.utils.boto3.resource')
+    def test_upload_template_to_s3(self, resource_mock):
+        config = utils.get_transfer_config()
+        url = utils.upload_to_s3('bucket', 'key.json', u'{}', transfer_config=config)
+        self.assertEqual(url, 'https://s3.amazonaws.com/bucket/key.json')
+        upload_fileobj = resource_mock.return_value.Bucket.return_value.upload_fileobj
+        data, key = upload_fileobj.call_args[0]
+        self.assertEqual((data.read(), key), (b'{}', 'key.json'))
+        self.assertIs(upload_fileobj.call_args[1]['Config'], config)
+
+
+class TestCaches(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workspace)
+
+    def _create_file(self, content):
+        fd, filename = tempfile.mkstemp(dir=self.workspace)
+        os.write(fd, content)
+        os.close(fd)
+        return filename
+
+    def test_artifact_cache(self):
+        cache = caches.ArtifactCache(self.workspace)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats(), {'entries': 0, 'size': 0})
+
+        path = cache.put('a', self._create_file(b'1234'))
+        self.assertEqual(cache.get('a'), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'1234')
+        self.assertEqual(cache.stats(), {'entries': 1, 'size': 4})
+
+    def test_prune_least_recently_used(self):
+        cache = caches.ArtifactCache(self.workspace)
+        for i, key in enumerate(('a', 'b', 'c')):
+            path = cache.put(key, self._create_file(b'1234'))
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+
+        # Using an entry makes it the most recently used one
+        cache.get('a')
+
+        self.assertEqual(cache.prune(8), (1, 4))
+        self.assertEqual(cache.get('b'), None)
+        self.assertNotEqual(cache.get('a'), None)
+        self.assertNotEqual(cache.get('c'), None)
+
+        self.assertEqual(cache.prune(0), (2, 8))
+        self.assertEqual(cache.stats(), {'entries': 0, 'size': 0})
+
+    def test_dependency_cache(self):
+        cache = caches.DependencyCache(self.workspace)
+        self.assertIs(cache.lock('a'), cache.lock('a'))
+        self.assertIsNot(cache.lock('a'), cache.lock('b'))
+
+        tmp = cache.mkdtemp()
+        os.makedirs(os.path.join(tmp, 'package'))
+        with open(os.path.join(tmp, 'package', '__init__.py'), 'w') as f:
+            f.write('VERSION = 1')
+        os.symlink('package', os.path.join(tmp, 'alias'))
+        path = cache.commit('a', tmp)
+        self.assertEqual(cache.get('a'), path)
+        self.assertEqual(cache.stats(), {'entries': 1, 'size': 11})
+
+        destination = tempfile.mkdtemp(dir=self.workspace)
+        with open(os.path.join(destination, 'code.py'), 'w') as f:
+            f.write('')
+        utils.link_tree(path, destination)
+        utils.link_tree(path, destination)
+        self.assertEqual(sorted(os.listdir(destination)), ['alias', 'code.py', 'package'])
+        self.assertEqual(os.readlink(os.path.join(destination, 'alias')), 'package')
+        with open(os.path.join(destination, 'package', '__init__.py')) as f:
+            self.assertEqual(f.read(), 'VERSION = 1')
+
+
+class TestDependencyKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.project = Mock(path=self.path, settings={})
+
+    def _write(self, filename, content):
+        with open(os.path.join(self.path, filename), 'w') as f:
+            f.write(content)
+
+    def test_requirements_key(self):
+        lambda_ = PythonLambda('example', {'code': '.'}, project=self.project)
+        self._write('requirements.txt', 'requests>=2.0\ncfn-response\n')
+        key = lambda_._get_requirements_key(os.path.join(self.path, 'requirements.txt'))
+
+        self._write('requirements.txt', '# Comment\nrequests>=2.0  # http\n\ncfn-response\n')
+        self.assertEqual(lambda_._get_requirements_key(os.path.join(self.path, 'requirements.txt')), key)
+
+        self._write('requirements.txt', 'requests>=2.1\ncfn-response\n')
+        self.assertNotEqual(lambda_._get_requirements_key(os.path.join(self.path, 'requirements.txt')), key)
+
+        self._write('requirements.txt', '-r base.txt\ncfn-response\n')
+        self.assertEqual(lambda_._get_requirements_key(os.path.join(self.path, 'requirements.txt')), None)
+
+    def test_package_key(self):
+        lambda_ = NodeLambda('example', {'code': '.'}, project=self.project)
+        self._write('package.json', '{"dependencies": {"path": "0.11.14"}}')
+        key = lambda_._get_package_key(self.path)
+
+        self._write('package-lock.json', '{"lockfileVersion": 1}')
+        self.assertNotEqual(lambda_._get_package_key(self.path), key)
+
+        self._write('package.json', '{"dependencies": {"lib": "file:../lib"}}')
+        self.assertEqual(lambda_._get_package_key(self.path), None)
+
+        self._write('package.json', '{"scripts": {"postinstall": "make"}}')
+        self.assertEqual(lambda_._get_package_key(self.path), None)
+
+
+ZIP_MEMORY_SCRIPT = """
+import sys, resource
+try:
+    from mock import Mock
+except ImportError:
+    from unittest.mock import Mock
+from gordon.resources.lambdas import PythonLambda
+project = Mock(path=sys.argv[1], settings={}, debug=False)
+project.get_workspace.return_value = sys.argv[1]
+lambda_ = PythonLambda('example', {'code': 'code', 'build': 'cp -Rf * {target}'}, project=project)
+lambda_.write_zip_file(sys.argv[2])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+class TestLambdaZipFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.makedirs(os.path.join(self.path, 'code'))
+
+    def _get_peak_memory(self, size):
+        """Returns the peak memory used by a process which builds a lambda
+        with ``size`` bytes of incompressible content."""
+        with open(os.path.join(self.path, 'code', 'data.bin'), 'wb') as f:
+            for _ in range(size // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+        filename = os.path.join(self.path, 'code.zip')
+        out = subprocess.check_output([sys.executable, '-c', ZIP_MEMORY_SCRIPT, self.path, filename])
+        self.assertGreater(os.path.getsize(filename), size)
+        return int(out.decode('utf-8').strip().splitlines()[-1])
+
+    def _write(self, filename, content=''):
+        filename = os.path.join(self.path, filename)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def test_write_zip_file_from_source(self):
+        for filename in ('code/code.py', 'code/lib/.hidden', 'code/lib/a.pyc', 'code/.git/HEAD',
+                         'code/tests/test_code.py', 'code/docs/index.rst', 'code/docs/keep.rst'):
+            self._write(filename)
+        self._write('.gordonignore', 'tests/\n')
+        self._write('code/.gordonignore', '# Documentation\ndocs/*.rst\n!docs/keep.rst\n')
+
+        project = Mock(path=self.path, settings={}, debug=False)
+        lambda_ = PythonLambda('example', {'code': 'code'}, project=project)
+        filename = os.path.join(self.path, 'code.zip')
+        lambda_.write_zip_file(filename)
+
+        self.assertFalse(project.create_workspace.called)
+        self.assertEqual(
+            zipfile.ZipFile(filename).namelist(),
+            ['code.py', 'docs/keep.rst', 'lib/.hidden']
+        )
+
+    def test_artifact_entry(self):
+        self._write('code/code.py', 'print(1)')
+        self._write('code/lib/lib.py', 'print(2)')
+        lambda_ = PythonLambda('example', {'code': 'code'}, project=Mock(path=self.path, settings={}, debug=False))
+        filename = os.path.join(self.path, 'code.zip')
+        digest = lambda_.write_zip_file(filename)
+
+        entry = utils.get_artifact_entry(filename, digest)
+        self.assertEqual(entry['digest'], utils.get_file_hash(filename))
+        self.assertEqual(entry['members'], 2)
+        self.assertEqual(entry['size'], os.path.getsize(filename))
+
+        copy = os.path.join(self.path, 'copy.zip')
+        self.assertEqual(utils.copy_file_with_hash(filename, copy), digest)
+        self.assertEqual(utils.get_artifact_entry(copy), dict(entry, mtime=os.path.getmtime(copy)))
+
+    def test_collect_source_hardlinks(self):
+        self._write('code/lib/code.py', 'print(1)')
+        self._write('code/.git/HEAD')
+        lambda_ = PythonLambda('example', {'code': 'code'}, project=Mock(path=self.path, settings={}))
+        destination = tempfile.mkdtemp(dir=self.path)
+        lambda_._collect_source(destination)
+
+        self.assertEqual(os.listdir(destination), ['lib'])
+        self.assertEqual(
+            os.stat(os.path.join(destination, 'lib', 'code.py')).st_ino,
+            os.stat(os.path.join(self.path, 'code', 'lib', 'code.py')).st_ino
+        )
+
+    def test_write_zip_file_slim(self):
+        for filename in ('code/code.py', 'code/README.md', 'code/LICENSE', 'code/requests/__init__.py',
+                         'code/requests/tests/test_api.py', 'code/requests-2.0.dist-info/METADATA',
+                         'code/lib/_speedups.so'):
+            self._write(filename, 'x' * 10)
+
+        project = Mock(path=self.path, settings={}, debug=False)
+        project.get_workspace.return_value = self.path
+        lambda_ = PythonLambda(
+            'example',
+            {'code': 'code', 'slim': True, 'slim-include': ['LICENSE'], 'slim-exclude': ['*.so']},
+            project=project
+        )
+        filename = os.path.join(self.path, 'code.zip')
+        log = []
+        lambda_.write_zip_file(filename, log=log.append)
+
+        self.assertEqual(
+            zipfile.ZipFile(filename).namelist(),
+            ['LICENSE', 'code.py', 'requests/__init__.py']
+        )
+        self.assertEqual(len(log), 1)
+        self.assertIn('4 files removed, 40B saved', log[0].s)
+
+    def _get_precompiled_lambda(self, python):
+        project = Mock(path=self.path, settings={}, debug=False, _gordon_root=os.path.dirname(exceptions.__file__))
+        project.get_workspace.return_value = self.path
+        return PythonLambda(
+            'example',
+            {'code': 'code', 'precompile': True, 'precompile-python': python},
+            project=project
+        )
+
+    @unittest.skipIf(not find_executable('python2.7'), 'python2.7 is not available')
+    def test_write_zip_file_precompile(self):
+        self._write('code/code.py', 'def handler(event, context):\n    return {"a", "b", "c"}\n')
+        self._write('code/lib/__init__.py')
+
+        digests = []
+        for i in range(2):
+            filename = os.path.join(self.path, 'code{}.zip'.format(i))
+            digests.append(self._get_precompiled_lambda('python2.7').write_zip_file(filename))
+            os.utime(os.path.join(self.path, 'code', 'code.py'), (i, i))
+        self.assertEqual(digests[0], digests[1])
+        self.assertEqual(
+            zipfile.ZipFile(filename).namelist(),
+            ['code.py', 'code.pyc', 'lib/__init__.py', 'lib/__init__.pyc']
+        )
+
+    def test_write_zip_file_precompile_invalid_python(self):
+        self._write('code/code.py')
+        lambda_ = self._get_precompiled_lambda(sys.executable)
+        with self.assertRaises(exceptions.LambdaPrecompileError):
+            lambda_.write_zip_file(os.path.join(self.path, 'code.zip'))
+
+    def test_write_zip_file_memory(self):
+        small = self._get_peak_memory(1024 * 1024)
+        large = self._get_peak_memory(96 * 1024 * 1024)
+        # ru_maxrss is reported in KB in linux, and bytes in OSX
+        unit = 1 if sys.platform == 'darwin' else 1024
+        self.assertLess((large - small) * unit, 16 * 1024 * 1024)
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _create_tree(self, name, mtime, mode):
+        root = os.path.join(self.path, name)
+        os.makedirs(os.path.join(root, 'lib', u'ñ'))
+        for filename, content in (('code.py', 'print(1)'), ('lib/a.txt', 'a' * 1000), (u'lib/ñ/b.txt', '')):
+            filename = os.path.join(root, filename)
+            with open(filename, 'w') as f:
+                f.write(content)
+            os.chmod(filename, mode)
+            os.utime(filename, (mtime, mtime))
+        return root
+
+    def _zip(self, root, name):
+        filename = os.path.join(self.path, name)
+        with archive.DeterministicZipFile(filename) as zf:
+            zf.write_tree(root)
+        return filename, zf.hexdigest()
+
+    def test_deterministic_zip_file(self):
+        first, first_digest = self._zip(self._create_tree('a', 1000000, 0o600), 'a.zip')
+        second, second_digest = self._zip(self._create_tree('b', 2000000, 0o640), 'b.zip')
+
+        with open(first, 'rb') as f, open(second, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(first_digest, second_digest)
+        self.assertEqual(utils.get_file_hash(first), first_digest)
+
+        zfile = zipfile.ZipFile(first)
+        self.assertEqual(zfile.testzip(), None)
+        self.assertEqual(zfile.namelist(), ['code.py', 'lib/a.txt', u'lib/ñ/b.txt'])
+        self.assertEqual(zfile.read('lib/a.txt'), b'a' * 1000)
+        self.assertEqual(zfile.getinfo('code.py').external_attr >> 16, 0o100644)
+        self.assertEqual(zfile.getinfo('code.py').date_time, (1980, 1, 1, 0, 0, 0))
+
+    def test_parallel_zip_file(self):
+        root = self._create_tree('a', 1000000, 0o644)
+        with open(os.path.join(root, 'lib', 'image.png'), 'wb') as f:
+            f.write(b'0' * 10000)
+        with open(os.path.join(root, 'lib', 'big.bin'), 'wb') as f:
+            f.write(os.urandom(archive.SPOOL_SIZE + 1000))
+
+        filenames = []
+        for compresslevel, jobs in ((6, 1), (6, 4), (0, 4)):
+            filename = os.path.join(self.path, '{}-{}.zip'.format(compresslevel, jobs))
+            with archive.DeterministicZipFile(filename, compresslevel=compresslevel) as zf:
+                self.assertEqual(zf.write_tree(root, jobs=jobs), 5)
+            filenames.append(filename)
+
+        self.assertEqual(utils.get_file_hash(filenames[0]), utils.get_file_hash(filenames[1]))
+        zfile = zipfile.ZipFile(filenames[1])
+        self.assertEqual(zfile.testzip(), None)
+        self.assertEqual(zfile.getinfo('lib/image.png').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(zfile.getinfo('lib/a.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(zfile.read('lib/image.png'), b'0' * 10000)
+
+        zfile = zipfile.ZipFile(filenames[2])
+        self.assertEqual(zfile.testzip(), None)
+        self.assertEqual(set([i.compress_type for i in zfile.infolist()]), set([zipfile.ZIP_STORED]))
+
+    def _read_stream(self, filename):
+        """Read the entries of ``filename`` one local header after the
+        other, like streaming readers (java's ``ZipInputStream``) do,
+        without looking at its central directory."""
+        entries = {}
+        with open(filename, 'rb') as f:
+            while True:
+                header = f.read(archive.LOCAL_HEADER.size)
+                if not header.startswith(b'PK\x03\x04'):
+                    return entries
+                (_, _, flags, compress_type, _, _, crc, compressed_size,
+                 size, name_length, extra_length) = archive.LOCAL_HEADER.unpack(header)
+                self.assertFalse(flags & 0x08)
+                name = f.read(name_length).decode('utf-8')
+                f.read(extra_length)
+                data = f.read(compressed_size)
+                if compress_type == archive.DEFLATED:
+                    data = zlib.decompress(data, -15)
+                self.assertEqual((size, crc), (len(data), zlib.crc32(data) & 0xFFFFFFFF))
+                entries[name] = (compress_type, data)
+
+    def test_stream_zip_file(self):
+        root = self._create_tree('a', 1000000, 0o644)
+        with open(os.path.join(root, 'lib', 'dependency.jar'), 'wb') as f:
+            f.write(b'jar' * 1000)
+
+        for jobs in (1, 4):
+            filename = os.path.join(self.path, '{}.zip'.format(jobs))
+            with archive.DeterministicZipFile(filename) as zf:
+                zf.write_tree(root, jobs=jobs)
+                zf.writestr('.context', '{}')
+
+            entries = self._read_stream(filename)
+            self.assertEqual(entries['lib/dependency.jar'], (archive.STORED, b'jar' * 1000))
+            self.assertEqual(entries['lib/a.txt'], (archive.DEFLATED, b'a' * 1000))
+            self.assertEqual(entries['.context'], (archive.DEFLATED, b'{}'))
+
+    def test_append_to_zip_file(self):
+        filename, _ = self._zip(self._create_tree('a', 1000000, 0o755), 'a.zip')
+        with zipfile.ZipFile(filename, 'a') as zfile:
+            zfile.writestr('.context', '{}')
+
+        zfile = zipfile.ZipFile(filename)
+        self.assertEqual(zfile.testzip(), None)
+        self.assertEqual(zfile.read('.context'), b'{}')
+        self.assertEqual(zfile.getinfo('code.py').external_attr >> 16, 0o100755)
+
+
+RUN_BATCH_SCRIPT = """
+import os, sys
+try:
+    from mock import Mock
+except ImportError:
+    from unittest.mock import Mock
+from gordon.resources.lambdas import PythonLambda
+project = Mock(path=sys.argv[1], settings={}, debug=False, _gordon_root=sys.argv[2])
+project.get_workspace.return_value = sys.argv[1]
+lambda_ = PythonLambda('example', {'code': 'code', 'handler': 'code.handler'}, project=project)
+lambda_.collect_and_run(sys.stdin, batch=True)
+"""
+
+
+class TestWorkers(unittest.TestCase):
+
+    HANDLER = (
+        'invocations = []\n\n\n'
+        'def handler(event, context):\n'
+        '    print("log")\n'
+        '    invocations.append(event)\n'
+        '    if event.get("fail"):\n'
+        '        raise ValueError("fail")\n'
+        '    return "{}{}".format(event["key"], len(invocations))\n'
+    )
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self._write_handler(self.HANDLER)
+        project = Mock(path=self.path, settings={}, debug=False, _gordon_root=os.path.dirname(utils.__file__))
+        project.get_workspace.return_value = self.path
+        self.lambda_ = PythonLambda('example', {'code': 'code', 'handler': 'code.handler'}, project=project)
+
+    def _write_handler(self, content):
+        if not os.path.isdir(os.path.join(self.path, 'code')):
+            os.makedirs(os.path.join(self.path, 'code'))
+        with open(os.path.join(self.path, 'code', 'code.py'), 'w') as f:
+            f.write(content)
+        # Make sure the change is visible even in filesystems with coarse mtimes.
+        mtime = time.time() + len(content)
+        os.utime(os.path.join(self.path, 'code', 'code.py'), (mtime, mtime))
+
+    def test_worker(self):
+        path = self.lambda_.collect()
+        with open(os.devnull, 'w') as devnull:
+            worker = workers.Worker(self.lambda_, path, stderr=devnull)
+            try:
+                results = [worker.invoke(event) for event in ({'key': 'a'}, {'fail': True}, {'key': 'b'})]
+            finally:
+                worker.close()
+
+        self.assertEqual([r.get('output') for r in results], ['a1', None, 'b3'])
+        self.assertEqual(results[1]['error'], 'ValueError: fail')
+        self.assertEqual([r['cold'] for r in results], [True, False, False])
+        self.assertEqual(['init_duration' in r for r in results], [True, False, False])
+        for result in results:
+            self.assertGreaterEqual(result['latency'], result['duration'])
+
+    def test_warm_lambda_reload(self):
+        with open(os.devnull, 'w') as devnull:
+            warm_lambda = workers.WarmLambda(self.lambda_, stderr=devnull)
+            try:
+                first, second = warm_lambda.invoke({'key': 'a'}), warm_lambda.invoke({'key': 'b'})
+                self._write_handler(self.HANDLER.replace('event["key"]', 'event["key"].upper()'))
+                third = warm_lambda.invoke({'key': 'c'})
+                path = warm_lambda.path
+            finally:
+                warm_lambda.close()
+
+        self.assertEqual([r['output'] for r in (first, second, third)], ['a1', 'b2', 'C1'])
+        self.assertEqual([r['reloaded'] for r in (first, second, third)], [True, False, True])
+        self.assertFalse(os.path.exists(path))
+
+    def test_worker_pool(self):
+        with open(os.devnull, 'w') as devnull:
+            pool = workers.WorkerPool(self.lambda_, size=2, stderr=devnull)
+            try:
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(pool.invoke({'key': 'a'})))
+                           for _ in range(6)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                path = pool.path
+                self._write_handler(self.HANDLER.replace('event["key"]', 'event["key"].upper()'))
+                reloaded = pool.invoke({'key': 'b'})
+            finally:
+                pool.close()
+
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(r['output'].startswith('a') for r in results))
+        self.assertLessEqual(sum(r['cold'] for r in results), 2)
+        self.assertEqual((reloaded['output'], reloaded['reloaded']), ('B1', True))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([p for p in os.listdir(self.path) if p.startswith('tmp')], [])
+
+    def test_warm_lambda_timeout(self):
+        self._write_handler('import time\n\n\ndef handler(event, context):\n    time.sleep(event["sleep"])\n    return "done"\n')
+        self.lambda_.settings['timeout'] = 1
+        with open(os.devnull, 'w') as devnull:
+            warm_lambda = workers.WarmLambda(self.lambda_, stderr=devnull)
+            try:
+                timed_out = warm_lambda.invoke({'sleep': 5})
+                alive = warm_lambda.worker.alive
+                result = warm_lambda.invoke({'sleep': 0})
+            finally:
+                warm_lambda.close()
+
+        self.assertEqual(timed_out['error'], 'Task timed out after 1.00 seconds')
+        self.assertTrue(timed_out['timed_out'])
+        self.assertEqual(timed_out['billed_duration'], 1000)
+        self.assertLess(timed_out['latency'], 5000)
+        self.assertFalse(alive)
+        self.assertEqual((result['output'], result['cold'], result['reloaded']), ('done', True, False))
+        self.assertTrue(result['duration'] <= result['billed_duration'] < result['duration'] + 1)
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'memory is only enforced on Linux')
+    def test_warm_lambda_out_of_memory(self):
+        self._write_handler('def handler(event, context):\n    return len(bytearray(event["mb"] * 1024 * 1024))\n')
+        self.lambda_.settings['memory'] = 128
+        with open(os.devnull, 'w') as devnull:
+            warm_lambda = workers.WarmLambda(self.lambda_, stderr=devnull, enforce_memory=True)
+            try:
+                out_of_memory = warm_lambda.invoke({'mb': 256})
+                alive = warm_lambda.worker.alive
+                result = warm_lambda.invoke({'mb': 16})
+            finally:
+                warm_lambda.close()
+
+        self.assertTrue(out_of_memory['out_of_memory'])
+        self.assertEqual(out_of_memory['error'], 'Runtime exited with error: out of memory (exceeded the limit of 128 MB)')
+        self.assertFalse(alive)
+        self.assertEqual((result['output'], result['cold']), (16 * 1024 * 1024, True))
+
+    def test_memory_limit_not_supported(self):
+        lambda_ = JavaLambda('example', {'code': 'code', 'handler': 'example::handler'}, project=self.lambda_.project)
+        with self.assertRaises(exceptions.LambdaMemoryLimitNotSupportedError):
+            lambda_.get_run_command(self.path, enforce_memory=True)
+
+    def test_run_command(self):
+        self.assertEqual(
+            self.lambda_.get_run_command(self.path),
+            'touch __init__.py && python _gloader.py code.handler example 128 3 --billing-granularity=1'
+        )
+        self.assertTrue(self.lambda_.get_run_command(self.path, batch=True).endswith(' --batch'))
+        self.lambda_.settings['run'] = './run.sh {handler} {timeout}'
+        self.assertEqual(self.lambda_.get_run_command(self.path), './run.sh code.handler 3')
+        with self.assertRaises(exceptions.LambdaBatchNotSupportedError):
+            self.lambda_.get_run_command(self.path, batch=True)
+
+    def test_server(self):
+        with open(os.devnull, 'w') as devnull:
+            warm_lambda = workers.WarmLambda(self.lambda_, stderr=devnull)
+            server = workers.create_server(warm_lambda, port=0)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+                response = urlopen(Request(url, data=b'{"key": "a"}'))
+                self.assertEqual(json.loads(response.read().decode('utf-8'))['output'], 'a1')
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(Request(url, data=b'invalid'))
+                self.assertEqual(error.exception.code, 400)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+                warm_lambda.close()
+
+    def test_run_batch(self):
+        process = subprocess.Popen(
+            [sys.executable, '-c', RUN_BATCH_SCRIPT, self.path, os.path.dirname(utils.__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        out, err = process.communicate(b'{"key": "a"}\n\n{"fail": true}\n{"key": "b"}\n')
+        self.assertEqual(process.returncode, 0)
+        results = [json.loads(line) for line in out.decode('utf-8').splitlines()]
+        self.assertEqual([r.get('output') for r in results], ['a1', None, 'b3'])
+        self.assertEqual(results[1]['error'], 'ValueError: fail')
+        self.assertTrue(all(r['duration'] >= 0 for r in results))
+        self.assertTrue(all(r['duration'] <= r['billed_duration'] < r['duration'] + 1 for r in results))
+        self.assertEqual(err.decode('utf-8').count('log'), 3)
+        self.assertEqual(err.decode('utf-8').count('REPORT RequestId:'), 3)
+
+    def test_benchmark(self):
+        with open(os.devnull, 'w') as devnull:
+            report = workers.benchmark(self.lambda_, [{'key': 'a'}, {'fail': True}], concurrency=2, iterations=10,
+                                       stderr=devnull)
+        self.assertEqual(report['iterations'], 10)
+        self.assertEqual(report['errors'], 5)
+        self.assertEqual(report['cold_start']['count'], 2)
+        self.assertEqual(report['warm']['count'], 8)
+        self.assertEqual(sum(w['invocations'] for w in report['workers']), 10)
+        self.assertTrue(all(w['max_rss'] for w in report['workers']))
+        self.assertEqual([p for p in os.listdir(self.path) if p.startswith('tmp')], [])
+
+    def test_benchmark_replaced_workers(self):
+        self._write_handler('import time\n\n\ndef handler(event, context):\n    time.sleep(event["sleep"])\n')
+        self.lambda_.settings['timeout'] = 1
+        with open(os.devnull, 'w') as devnull:
+            report = workers.benchmark(self.lambda_, [{'sleep': 5}, {'sleep': 0}, {'sleep': 0}], iterations=3,
+                                       stderr=devnull)
+        self.assertEqual(report['timeouts'], 1)
+        # The first invocation of the worker which replaced the one which timed out is a cold start.
+        self.assertEqual((report['cold_start']['count'], report['warm']['count']), (2, 1))
+        self.assertEqual(report['workers'][0]['cold_starts'], 2)
+
+    def test_load_events(self):
+        os.makedirs(os.path.join(self.path, 'events'))
+        with open(os.path.join(self.path, 'events', '1.json'), 'w') as f:
+            f.write('{"key": "a"}')
+        with open(os.path.join(self.path, 'events', '2.ndjson'), 'w') as f:
+            f.write('{"key": "b"}\n\n{"key": "c"}\n')
+        with open(os.path.join(self.path, 'events', 'README'), 'w') as f:
+            f.write('Events')
+        self.assertEqual(
+            [e['key'] for e in workers.load_events(os.path.join(self.path, 'events'))],
+            ['a', 'b', 'c']
+        )
+
+    def test_summarize(self):
+        summary = workers.summarize(list(range(100, 0, -1)))
+        self.assertEqual((summary['min'], summary['p50'], summary['p90'], summary['p99'], summary['max']),
+                         (1, 50, 90, 99, 100))
+        self.assertEqual(workers.summarize([]), {'count': 0})
+
+
+class TestApiGatewayEmulator(unittest.TestCase):
+
+    HANDLER = (
+        'import json\n\n\n'
+        'def handler(event, context):\n'
+        '    if event.get("fail"):\n'
+        '        raise ValueError("not found")\n'
+        '    return event\n\n\n'
+        'def proxy(event, context):\n'
+        '    return {"statusCode": 201, "headers": {"X-Item": event["pathParameters"]["item"]},\n'
+        '            "body": json.dumps([event["httpMethod"], event["queryStringParameters"], event["body"]])}\n'
+    )
+
+    SETTINGS = {
+        'resources': {
+            '/': {
+                'methods': 'GET',
+                'integration': {
+                    'type': 'MOCK',
+                    'responses': [{'pattern': '', 'code': '200', 'template': {'application/json': '{"mock": true}'}}]
+                }
+            },
+            '/items/{item}': {
+                'methods': ['GET', 'POST'],
+                'integration': {'lambda': 'app.proxy', 'type': 'AWS_PROXY'}
+            },
+            '/items/special': {
+                'methods': 'GET',
+                'integration': {'lambda': 'app.handler'}
+            },
+            '/echo': {
+                'methods': 'POST',
+                'request_templates': {
+                    'application/json': '#set($root = $input.path(\'$\'))\n{"name": "$root.name", "stage": "$context.stage"}'
+                },
+                'integration': {
+                    'lambda': 'app.handler',
+                    'responses': [
+                        {'pattern': '', 'code': '200', 'parameters': {'method.response.header.X-Test': "'yes'"}},
+                        {'pattern': '.*not found.*', 'code': '404'},
+                    ]
+                }
+            },
+        }
+    }
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.makedirs(os.path.join(self.path, 'code'))
+        with open(os.path.join(self.path, 'code', 'code.py'), 'w') as f:
+            f.write(self.HANDLER)
+        project = Mock(path=self.path, settings={}, debug=False, _gordon_root=os.path.dirname(utils.__file__))
+        project.get_workspace.return_value = self.path
+        lambdas = dict(
+            ('app.{}'.format(name), PythonLambda(name, {'code': 'code', 'handler': 'code.{}'.format(name)},
+                                                 project=project))
+            for name in ('handler', 'proxy')
+        )
+        self.devnull = open(os.devnull, 'w')
+        self.addCleanup(self.devnull.close)
+        api = ApiGateway('api', self.SETTINGS, project=project)
+        self.emulator = emulators.ApiGatewayEmulator(api, lambdas, stage='test', concurrency=2, stderr=self.devnull)
+        self.addCleanup(self.emulator.close)
+
+    def _request(self, method, path, body=b'', headers=None):
+        response = self.emulator.handle(emulators.ApiRequest(method, path, headers=headers, body=body))
+        return response.status, response.headers, response.body.decode('utf-8')
+
+    def test_routes(self):
+        self.assertEqual(self._request('GET', '/'), (200, {'Content-Type': 'application/json'}, '{"mock": true}'))
+        self.assertEqual(self._request('GET', '/items/special')[2], '{}')
+        self.assertEqual(self._request('DELETE', '/items/1')[0], 403)
+        self.assertEqual(self._request('GET', '/unknown')[0], 403)
+
+    def test_proxy_integration(self):
+        status, headers, body = self._request('POST', '/items/7?a=1', body=b'hi')
+        self.assertEqual((status, headers['X-Item']), (201, '7'))
+        self.assertEqual(json.loads(body), ['POST', {'a': '1'}, 'hi'])
+
+    def test_lambda_integration(self):
+        status, headers, body = self._request('POST', '/echo', body=b'{"name": "gordon"}')
+        self.assertEqual((status, headers['X-Test']), (200, 'yes'))
+        self.assertEqual(json.loads(body), {'name': 'gordon', 'stage': 'test'})
+
+        # Requests without a template for their content type are passed through.
+        headers = {'Content-Type': 'text/plain'}
+        status, _, body = self._request('POST', '/echo', body=b'{"fail": true}', headers=headers)
+        self.assertEqual((status, json.loads(body)), (404, {'errorMessage': 'not found', 'errorType': 'ValueError'}))
+        self.assertEqual(self._request('POST', '/echo', body=b'invalid', headers=headers)[0], 400)
+
+    def test_server(self):
+        server = emulators.ApiGatewayServer(('127.0.0.1', 0), self.emulator)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}/items/'.format(server.server_address[1])
+            responses = []
+            threads = [threading.Thread(target=lambda i=i: responses.append(urlopen(url + str(i))))
+                       for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(sorted(r.info()['X-Item'] for r in responses), ['0', '1', '2', '3'])
+        self.assertEqual(set(r.getcode() for r in responses), set([201]))
+
+    def test_render_template(self):
+        template = (
+            '## Comment\n'
+            '#set($root = $input.path(\'$\'))\n'
+            '{"all": $input.json(\'$\'), "first": $input.json(\'$.items[0]\'), "id": "$input.params(\'id\')", '
+            '"name": "${root.name}", "missing": "$!root.missing", "unknown": "$unknown"}'
+        )
+        rendered = emulators.render_template(template, '{"name": "a", "items": [1, 2]}', params={'path': {'id': '7'}})
+        self.assertEqual(json.loads(rendered), {
+            'all': {'name': 'a', 'items': [1, 2]}, 'first': 1, 'id': '7', 'name': 'a', 'missing': '',
+            'unknown': '$unknown'
+        })
+        with self.assertRaises(exceptions.UnsupportedMappingTemplateError):
+            emulators.render_template('#foreach($item in $input.path(\'$\'))', '[]')
+
+
+class TestStreamEmulator(unittest.TestCase):
+
+    HANDLER = (
+        'import json\n'
+        'import base64\n\n\n'
+        'def handler(event, context):\n'
+        '    return [json.loads(base64.b64decode(r["kinesis"]["data"]).decode("utf-8"))["n"] for r in event["Records"]]\n'
+    )
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.makedirs(os.path.join(self.path, 'code'))
+        with open(os.path.join(self.path, 'code', 'code.py'), 'w') as f:
+            f.write(self.HANDLER)
+        self.project = Mock(path=self.path, settings={}, debug=False, _gordon_root=os.path.dirname(utils.__file__))
+        self.project.get_workspace.return_value = self.path
+        self.lambda_ = PythonLambda('handler', {'code': 'code', 'handler': 'code.handler'}, project=self.project)
+        self.records = [{'user': 'u{}'.format(i % 5), 'n': i} for i in range(50)]
+
+    def _get_stream(self, cls, **settings):
+        settings.update({'lambda': 'app.handler', 'stream': 'arn:stream', 'starting_position': 'LATEST'})
+        return cls('stream', settings, project=self.project)
+
+    def test_kinesis_batches(self):
+        emulator = emulators.KinesisStreamEmulator(self._get_stream(Kinesis, batch_size=4), self.lambda_, shards=3,
+                                                   partition_key='user')
+        batches = emulator.get_batches(self.records)
+        self.assertEqual(len(batches), 3)
+
+        records = [record for shard_batches in batches for batch in shard_batches for record in batch]
+        self.assertEqual(len(records), 50)
+        for shard, shard_batches in enumerate(batches):
+            self.assertTrue(all(0 < len(batch) <= 4 for batch in shard_batches))
+            shard_records = [record for batch in shard_batches for record in batch]
+            data = [json.loads(base64.b64decode(r['kinesis']['data']).decode('utf-8')) for r in shard_records]
+            # Records of each shard keep their order, and records with the
+            # same partition key always go to the same shard.
+            self.assertEqual([d['n'] for d in data], sorted(d['n'] for d in data))
+            for record, d in zip(shard_records, data):
+                self.assertEqual(record['kinesis']['partitionKey'], d['user'])
+                self.assertEqual(emulator.get_shard(d['user']), shard)
+                self.assertTrue(record['eventID'].startswith('shardId-{:012d}:'.format(shard)))
+                self.assertEqual(record['eventSourceARN'], 'arn:stream')
+            sequence_numbers = [int(r['kinesis']['sequenceNumber']) for r in shard_records]
+            self.assertEqual(sequence_numbers, sorted(set(sequence_numbers)))
+
+    def test_dynamodb_batches(self):
+        emulator = emulators.DynamodbStreamEmulator(self._get_stream(Dynamodb), self.lambda_, partition_key='id')
+        batches = emulator.get_batches([{'id': 'a', 'price': 1.5, 'tags': ['x'], 'stock': {'n': 2}}])
+        record = batches[0][0][0]
+        self.assertEqual(record['eventName'], 'INSERT')
+        self.assertEqual(record['dynamodb']['Keys'], {'id': {'S': 'a'}})
+        self.assertEqual(record['dynamodb']['NewImage'], {
+            'id': {'S': 'a'}, 'price': {'N': '1.5'}, 'tags': {'L': [{'S': 'x'}]}, 'stock': {'M': {'n': {'N': '2'}}}
+        })
+
+    def test_replay(self):
+        emulator = emulators.KinesisStreamEmulator(self._get_stream(Kinesis, batch_size=10), self.lambda_, shards=2)
+        with open(os.devnull, 'w') as devnull:
+            emulator.stderr = devnull
+            report = emulator.replay(self.records)
+
+        self.assertEqual((report['records'], report['errors'], report['shards']), (50, 0, 2))
+        self.assertEqual(report['batches'], sum(s['batches'] for s in report['shard_reports']))
+        self.assertEqual(report['batch_sizes']['max'], 10)
+        self.assertEqual(report['cold_start']['count'], len(report['shard_reports']))
+        self.assertEqual(report['latency']['count'], report['batches'] - len(report['shard_reports']))
+        self.assertEqual([p for p in os.listdir(self.path) if p.startswith('tmp')], [])
+